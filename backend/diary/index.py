@@ -6,18 +6,100 @@ Returns: HTTP response dict с данными дневника
 '''
 
 import json
-import os
-from typing import Dict, Any, List, Optional
-from datetime import datetime, date
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import date
+
+from runtime import (
+    ConnectionPool, PoolTimeout, RequestMetrics, LatencyStats, _current, log_event,
+    dumps, encode_response, admin_authorized, SLOW_QUERY_MS,
+)
+
+
+db_pool = ConnectionPool.from_env(max_size=4)
 
 def get_db_connection():
-    """Создает подключение к БД"""
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn, cursor_factory=RealDictCursor)
+    """Берёт подключение к БД из пула"""
+    return db_pool.acquire()
+
+def release_db_connection(conn) -> None:
+    """Возвращает подключение в пул"""
+    db_pool.release(conn)
+
+# Метрики запросов (runtime.py): курсор пула считает операторы, время в БД и
+# строки текущего вызова, handler дописывает кодирование, размер и латентность,
+# пишет строку JSON-лога и копит гистограммы по маршруту (GET /diary/metrics)
+ROUTE_KINDS: Tuple[str, ...] = ('entries', 'plans', 'students', 'groups')
+
+def route_label(method: str, path: str) -> str:
+    """Маршрут для гистограмм: вид ресурса вместо полного пути"""
+    kind = next((k for k in ROUTE_KINDS if k in path), None)
+    return f'{method} /diary/{kind}' if kind else '(unknown)'
+
+
+route_stats = LatencyStats(key='route')
+
+ENTRIES_PAGE_SIZE = 100
+ENTRIES_MAX_PAGE_SIZE = 500
+
+def parse_entries_cursor(cursor: Optional[str]) -> Optional[Tuple[date, int]]:
+    """Разбирает курсор вида '2024-05-01:123' (дата и id последней записи страницы); ValueError — битый курсор"""
+    if not cursor:
+        return None
+    entry_date, _, entry_id = cursor.partition(':')
+    return date.fromisoformat(entry_date), int(entry_id)
+
+def parse_entries_limit(limit: Optional[str]) -> int:
+    """Размер страницы: ENTRIES_PAGE_SIZE по умолчанию, не больше ENTRIES_MAX_PAGE_SIZE; ValueError — не целое или < 1"""
+    page_size = int(limit) if limit else ENTRIES_PAGE_SIZE
+    if page_size < 1:
+        raise ValueError(f'limit must be positive: {page_size}')
+    return min(page_size, ENTRIES_MAX_PAGE_SIZE)
+
+def attach_media(cur, entries: List[Dict[str, Any]]) -> None:
+    """Подгружает медиа для всех записей одним запросом"""
+    for entry in entries:
+        entry['media'] = []
+    if not entries:
+        return
+    by_id = {entry['id']: entry for entry in entries}
+    cur.execute(
+        "SELECT * FROM diary_media WHERE diary_entry_id = ANY(%s) ORDER BY id",
+        (list(by_id),)
+    )
+    for media in cur.fetchall():
+        by_id[media['diary_entry_id']]['media'].append(media)
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Точка входа: ответ маршрута сжимается, если клиент это принимает; вызов попадает в метрики"""
+    method: str = event.get('httpMethod', 'GET')
+    path: str = event.get('path', '')
+    if method == 'GET' and path.rstrip('/').endswith('/metrics'):
+        # служебная сводка — только с X-Admin-Token
+        authorized = admin_authorized(event.get('headers'))
+        return {
+            'statusCode': 200 if authorized else 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': dumps(
+                {'routes': route_stats.summary(), 'pool': db_pool.stats(), 'slow_query_ms': SLOW_QUERY_MS}
+                if authorized else {'error': 'forbidden'}
+            )
+        }
+    if method == 'OPTIONS':
+        return handle_request(event, context)
+
+    metrics = _current.metrics = RequestMetrics(method, route_label(method, path), key='route')
+    try:
+        result = encode_response(handle_request(event, context), event.get('headers') or {})
+    finally:
+        _current.metrics = None
+    body = result.get('body') or ''
+    entry = metrics.finish(result['statusCode'], len(body) if result.get('isBase64Encoded') else len(body.encode()))
+    route_stats.record(entry)
+    log_event('request', **entry)
+    return result
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     path: str = event.get('path', '')
     
@@ -28,7 +110,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Role',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Role, X-Admin-Token',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -39,6 +121,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'Access-Control-Allow-Origin': '*'
     }
     
+    conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
@@ -47,65 +130,74 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         user_id = event.get('headers', {}).get('X-User-Id')
         user_role = event.get('headers', {}).get('X-Role', 'student')
         
-        # GET /diary/entries - получить записи дневника
+        # GET /diary/entries - получить записи дневника (постранично)
         if method == 'GET' and 'entries' in path:
-            student_id = event.get('queryStringParameters', {}).get('student_id')
+            params = event.get('queryStringParameters') or {}
+            student_id = params.get('student_id')
             
+            conditions: List[str] = []
+            values: List[Any] = []
             if user_role == 'director':
                 # Директор видит все записи
                 if student_id:
-                    cur.execute(
-                        "SELECT de.*, u1.name as student_name, u2.name as trainer_name "
-                        "FROM diary_entries de "
-                        "JOIN users u1 ON de.student_id = u1.id "
-                        "LEFT JOIN users u2 ON de.trainer_id = u2.id "
-                        "WHERE de.student_id = %s ORDER BY de.entry_date DESC",
-                        (student_id,)
-                    )
-                else:
-                    cur.execute(
-                        "SELECT de.*, u1.name as student_name, u2.name as trainer_name "
-                        "FROM diary_entries de "
-                        "JOIN users u1 ON de.student_id = u1.id "
-                        "LEFT JOIN users u2 ON de.trainer_id = u2.id "
-                        "ORDER BY de.entry_date DESC LIMIT 100"
-                    )
+                    conditions.append("de.student_id = %s")
+                    values.append(student_id)
             elif user_role == 'trainer':
                 # Тренер видит записи своих учеников
-                cur.execute(
-                    "SELECT de.*, u1.name as student_name, u2.name as trainer_name "
-                    "FROM diary_entries de "
-                    "JOIN users u1 ON de.student_id = u1.id "
-                    "LEFT JOIN users u2 ON de.trainer_id = u2.id "
-                    "WHERE de.trainer_id = %s ORDER BY de.entry_date DESC",
-                    (user_id,)
-                )
+                conditions.append("de.trainer_id = %s")
+                values.append(user_id)
             else:
                 # Ученик/родитель видит только свои записи
-                cur.execute(
-                    "SELECT de.*, u1.name as student_name, u2.name as trainer_name "
-                    "FROM diary_entries de "
-                    "JOIN users u1 ON de.student_id = u1.id "
-                    "LEFT JOIN users u2 ON de.trainer_id = u2.id "
-                    "WHERE de.student_id = %s ORDER BY de.entry_date DESC",
-                    (student_id or user_id,)
-                )
+                conditions.append("de.student_id = %s")
+                values.append(student_id or user_id)
+            
+            # Keyset-пагинация по (entry_date, id): следующая страница начинается после курсора.
+            # Битый курсор — ошибка клиента, а не молчаливый возврат к первой странице
+            try:
+                after = parse_entries_cursor(params.get('cursor'))
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'isBase64Encoded': False,
+                    'body': dumps({'error': 'Некорректный cursor'})
+                }
+            try:
+                page_size = parse_entries_limit(params.get('limit'))
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'isBase64Encoded': False,
+                    'body': dumps({'error': 'Некорректный limit'})
+                }
+            if after:
+                conditions.append("(de.entry_date, de.id) < (%s, %s)")
+                values.extend(after)
             
+            where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+            cur.execute(
+                "SELECT de.*, u1.name as student_name, u2.name as trainer_name "
+                "FROM diary_entries de "
+                "JOIN users u1 ON de.student_id = u1.id "
+                "LEFT JOIN users u2 ON de.trainer_id = u2.id "
+                f"{where}ORDER BY de.entry_date DESC, de.id DESC LIMIT %s",
+                values + [page_size + 1]
+            )
             entries = cur.fetchall()
+            next_cursor = None
+            if len(entries) > page_size:
+                entries = entries[:page_size]
+                last = entries[-1]
+                next_cursor = f"{last['entry_date']}:{last['id']}"
             
-            # Получаем медиа для каждой записи
-            for entry in entries:
-                cur.execute(
-                    "SELECT * FROM diary_media WHERE diary_entry_id = %s",
-                    (entry['id'],)
-                )
-                entry['media'] = cur.fetchall()
+            attach_media(cur, entries)
             
             return {
                 'statusCode': 200,
                 'headers': headers,
                 'isBase64Encoded': False,
-                'body': json.dumps({'entries': entries}, default=str)
+                'body': dumps({'entries': entries, 'next_cursor': next_cursor})
             }
         
         # POST /diary/entries - создать запись (только тренер)
@@ -115,7 +207,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'statusCode': 403,
                     'headers': headers,
                     'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Только тренер может создавать записи'})
+                    'body': dumps({'error': 'Только тренер может создавать записи'})
                 }
             
             body_data = json.loads(event.get('body', '{}'))
@@ -154,7 +246,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'statusCode': 201,
                 'headers': headers,
                 'isBase64Encoded': False,
-                'body': json.dumps({'entry': entry}, default=str)
+                'body': dumps({'entry': entry})
             }
         
         # GET /diary/plans - получить планы занятий
@@ -185,7 +277,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'statusCode': 200,
                 'headers': headers,
                 'isBase64Encoded': False,
-                'body': json.dumps({'plans': plans}, default=str)
+                'body': dumps({'plans': plans})
             }
         
         # POST /diary/plans - создать план занятия (только тренер)
@@ -195,7 +287,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'statusCode': 403,
                     'headers': headers,
                     'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Только тренер может создавать планы'})
+                    'body': dumps({'error': 'Только тренер может создавать планы'})
                 }
             
             body_data = json.loads(event.get('body', '{}'))
@@ -221,7 +313,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'statusCode': 201,
                 'headers': headers,
                 'isBase64Encoded': False,
-                'body': json.dumps({'plan': plan}, default=str)
+                'body': dumps({'plan': plan})
             }
         
         # GET /diary/students - получить список учеников
@@ -246,7 +338,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'statusCode': 200,
                 'headers': headers,
                 'isBase64Encoded': False,
-                'body': json.dumps({'students': students}, default=str)
+                'body': dumps({'students': students})
             }
         
         # GET /diary/groups - получить группы
@@ -279,23 +371,31 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'statusCode': 200,
                 'headers': headers,
                 'isBase64Encoded': False,
-                'body': json.dumps({'groups': groups}, default=str)
+                'body': dumps({'groups': groups})
             }
         
-        cur.close()
-        conn.close()
-        
         return {
             'statusCode': 404,
             'headers': headers,
             'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Endpoint not found'})
+            'body': dumps({'error': 'Endpoint not found'})
         }
         
+    except PoolTimeout:
+        return {
+            'statusCode': 503,
+            'headers': headers,
+            'isBase64Encoded': False,
+            'body': dumps({'error': 'База данных перегружена'})
+        }
     except Exception as e:
         return {
             'statusCode': 500,
             'headers': headers,
             'isBase64Encoded': False,
-            'body': json.dumps({'error': str(e)})
+            'body': dumps({'error': str(e)})
         }
+    finally:
+        # Соединение возвращается в пул на любом пути выхода
+        if conn is not None:
+            release_db_connection(conn)
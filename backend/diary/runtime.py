@@ -0,0 +1,455 @@
+"""Общий код облачных функций: пул соединений, метрики запросов, кодирование ответов, служебный доступ.
+
+Исходник — backend/shared/runtime.py. Каждая функция деплоится из своего
+каталога, поэтому рядом с её index.py лежит копия этого файла. Правки вносятся
+только сюда, копии обновляет tools/sync_shared.py (--check сверяет их).
+"""
+
+import base64
+import gzip
+import hmac
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_right
+from contextlib import contextmanager
+from datetime import datetime, timedelta, date
+from decimal import Decimal
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+
+# === Пул соединений ===
+
+class PoolTimeout(Exception):
+    """Нет свободного соединения за wait_timeout."""
+
+
+class ConnectionPool:
+    """Пул соединений уровня модуля — живёт между вызовами тёплого инстанса функции."""
+
+    def __init__(self, max_size=4, idle_timeout=300.0, check_after=30.0, wait_timeout=10.0, cursor_factory=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.wait_timeout = wait_timeout
+        self.cursor_factory = cursor_factory or InstrumentedCursor
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._counters = {'created': 0, 'reused': 0, 'evicted': 0, 'broken': 0, 'acquired': 0, 'timeouts': 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @classmethod
+    def from_env(cls, max_size=4, **kwargs):
+        """Пул с настройками из DB_POOL_*; max_size — значение по умолчанию для функции."""
+        return cls(
+            max_size=int(os.environ.get('DB_POOL_MAX_SIZE', str(max_size))),
+            idle_timeout=float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300')),
+            check_after=float(os.environ.get('DB_POOL_CHECK_AFTER', '30')),
+            wait_timeout=float(os.environ.get('DB_POOL_WAIT_TIMEOUT', '10')),
+            **kwargs
+        )
+
+    def _connect(self):
+        return psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=self.cursor_factory)
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _healthy(self, conn, idle_for):
+        """Проверяет соединение запросом, если оно простаивало дольше check_after."""
+        if conn.closed:
+            return False
+        if idle_for < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _evict_idle(self, now):
+        keep = []
+        for conn, released_at in self._idle:
+            if conn.closed or now - released_at > self.idle_timeout:
+                self._close(conn)
+                self._counters['evicted'] += 1
+            else:
+                keep.append((conn, released_at))
+        self._idle = keep
+
+    def acquire(self):
+        started = time.monotonic()
+        conn, idle_for = None, 0.0
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._evict_idle(now)
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                    idle_for = now - released_at
+                    break
+                if self._in_use < self.max_size:
+                    break
+                remaining = self.wait_timeout - (now - started)
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout('no free database connection')
+                self._cond.wait(remaining)
+            self._in_use += 1
+            waited = time.monotonic() - started
+            self._counters['acquired'] += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        try:
+            if conn is not None and not self._healthy(conn, idle_for):
+                self._close(conn)
+                conn = None
+                with self._cond:
+                    self._counters['broken'] += 1
+            if conn is None:
+                conn = self._connect()
+                with self._cond:
+                    self._counters['created'] += 1
+            else:
+                with self._cond:
+                    self._counters['reused'] += 1
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def release(self, conn):
+        """Откатывает незакоммиченное и возвращает соединение в пул."""
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self._close(conn)
+        with self._cond:
+            self._in_use -= 1
+            if not conn.closed:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._cond:
+            acquired = self._counters['acquired']
+            return {
+                **self._counters,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'max_size': self.max_size,
+                'wait_avg_ms': round(self._wait_total / acquired * 1000, 3) if acquired else 0.0,
+                'wait_max_ms': round(self._wait_max * 1000, 3),
+            }
+
+# === Метрики запросов ===
+#
+# Курсор пула учитывает каждый оператор в метриках текущего вызова: число
+# запросов, время в Postgres, прочитанные строки. handler функции добавляет
+# время кодирования, размер ответа и полную латентность, пишет строку
+# JSON-лога и копит гистограммы в LatencyStats. Запросы дольше SLOW_QUERY_MS
+# логируются с нормализованным SQL.
+
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') == '1'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|%\(\w+\)s|%s|\b\d+(?:\.\d+)?\b")
+SQL_VALUE_GROUPS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+")
+SQL_VALUE_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+
+_current = threading.local()
+
+
+def log_event(event, **fields):
+    if REQUEST_LOG:
+        print(json.dumps({'event': event, **fields}, default=str, ensure_ascii=False), flush=True)
+
+def normalize_sql(sql):
+    """Текст запроса без литералов: запросы, различающиеся только значениями, совпадают."""
+    if isinstance(sql, bytes):
+        sql = sql.decode(errors='replace')
+    sql = SQL_VALUE_GROUPS.sub('(?), ...', SQL_LITERAL.sub('?', sql))
+    return ' '.join(SQL_VALUE_LIST.sub('?, ...', sql).split())[:2000]
+
+
+class RequestMetrics:
+    """Счётчики одного HTTP-вызова; label — action или маршрут, key — имя этого поля в логе."""
+
+    def __init__(self, method, label='', key='action'):
+        self.method = method
+        self.label = label
+        self.key = key
+        self.statements = 0
+        self.db_ms = 0.0
+        self.rows = 0
+        self.encode_ms = 0.0
+        self.started = time.perf_counter()
+
+    def finish(self, status, response_bytes):
+        return {
+            self.key: self.label,
+            'method': self.method,
+            'status': status,
+            'latency_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'db_ms': round(self.db_ms, 2),
+            'statements': self.statements,
+            'rows': self.rows,
+            'encode_ms': round(self.encode_ms, 2),
+            'bytes': response_bytes,
+        }
+
+
+def current_metrics():
+    return getattr(_current, 'metrics', None)
+
+
+class InstrumentedCursor(RealDictCursor):
+    """RealDictCursor, который записывает запросы в метрики текущего вызова."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            metrics = current_metrics()
+            if metrics is not None:
+                metrics.statements += 1
+                metrics.db_ms += elapsed
+            if elapsed >= SLOW_QUERY_MS:
+                log_event('slow_query', **({metrics.key: metrics.label} if metrics else {}),
+                          ms=round(elapsed, 2), sql=normalize_sql(self.query or query))
+
+    def _count(self, rows):
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.rows += rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._count(len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in super().__iter__():
+            self._count(1)
+            yield row
+
+
+def percentile(buckets, count, max_ms, q):
+    """Оценка перцентиля по гистограмме: верхняя граница корзины, не выше наблюдённого максимума."""
+    if not count:
+        return None
+    need = q * count
+    seen = 0
+    for bound, n in zip(LATENCY_BUCKETS_MS, buckets):
+        seen += n
+        if seen >= need:
+            return min(bound, round(max_ms, 2))
+    return round(max_ms, 2)
+
+
+class LatencyStats:
+    """Гистограммы латентности и суммы по значению поля key (action, маршрут) за время жизни инстанса."""
+
+    def __init__(self, key='action'):
+        self.key = key
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, entry):
+        with self._lock:
+            s = self._stats.get(entry[self.key])
+            if s is None:
+                s = self._stats[entry[self.key]] = {
+                    'count': 0, 'errors': 0, 'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                    'latency_ms': 0.0, 'max_ms': 0.0, 'db_ms': 0.0, 'statements': 0,
+                    'max_statements': 0, 'rows': 0, 'encode_ms': 0.0, 'bytes': 0,
+                }
+            s['count'] += 1
+            s['errors'] += entry['status'] >= 500
+            s['buckets'][bisect_right(LATENCY_BUCKETS_MS, entry['latency_ms'])] += 1
+            s['latency_ms'] += entry['latency_ms']
+            s['max_ms'] = max(s['max_ms'], entry['latency_ms'])
+            s['max_statements'] = max(s['max_statements'], entry['statements'])
+            for key in ('db_ms', 'statements', 'rows', 'encode_ms', 'bytes'):
+                s[key] += entry[key]
+
+    def summary(self):
+        with self._lock:
+            result = {}
+            for name, s in sorted(self._stats.items()):
+                n = s['count']
+                result[name] = {
+                    'count': n,
+                    'errors': s['errors'],
+                    'latency_avg_ms': round(s['latency_ms'] / n, 2),
+                    'latency_p50_ms': percentile(s['buckets'], n, s['max_ms'], 0.50),
+                    'latency_p95_ms': percentile(s['buckets'], n, s['max_ms'], 0.95),
+                    'latency_p99_ms': percentile(s['buckets'], n, s['max_ms'], 0.99),
+                    'latency_max_ms': round(s['max_ms'], 2),
+                    'db_avg_ms': round(s['db_ms'] / n, 2),
+                    'statements_avg': round(s['statements'] / n, 2),
+                    'statements_max': s['max_statements'],
+                    'rows_avg': round(s['rows'] / n, 1),
+                    'encode_avg_ms': round(s['encode_ms'] / n, 3),
+                    'bytes_avg': s['bytes'] // n,
+                    'histogram': dict(zip([f'le_{b}' for b in LATENCY_BUCKETS_MS] + ['inf'], s['buckets'])),
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+# === Кодирование ответов ===
+#
+# orjson используется, если установлен; иначе стандартный json. Даты и
+# Decimal кодируются так же, как раньше давал default=str, поэтому формат
+# ответа от бэкенда не зависит. RawJSON — уже сериализованный фрагмент
+# (справочник из кэша), он вставляется в тело без повторного кодирования.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+
+ENCODERS = {
+    datetime: str,
+    date: str,
+    Decimal: str,
+    timedelta: str,
+}
+
+
+class RawJSON:
+    """Готовый JSON-фрагмент для вставки в ответ как есть."""
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+def dumps(body):
+    started = time.perf_counter()
+    fragments = []
+
+    def default(value):
+        if isinstance(value, RawJSON):
+            # метка-строка заменяется фрагментом после кодирования
+            fragments.append(value.text)
+            return f'\x00{len(fragments) - 1}\x00'
+        encoder = ENCODERS.get(type(value))
+        return encoder(value) if encoder else str(value)
+
+    if orjson is not None:
+        text = orjson.dumps(body, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS).decode()
+    else:
+        text = json.dumps(body, default=default)
+    for i, fragment in enumerate(fragments):
+        text = text.replace(f'"\\u0000{i}\\u0000"', fragment, 1)
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.encode_ms += (time.perf_counter() - started) * 1000
+    return text
+
+def get_header(headers, name):
+    name = name.lower()
+    for key, value in (headers or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+def accepted_encodings(headers):
+    """Кодировки из Accept-Encoding, кроме явно запрещённых q=0."""
+    accepted = set()
+    for part in (get_header(headers, 'Accept-Encoding') or '').split(','):
+        name, *params = part.split(';')
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+def encode_response(result, headers):
+    """Сжимает крупное тело в br/gzip, если клиент их принимает; сжатое тело уходит в base64."""
+    body = result.get('body')
+    if not body or result.get('isBase64Encoded') or len(body) < COMPRESS_MIN_BYTES:
+        return result
+    accepted = accepted_encodings(headers)
+    started = time.perf_counter()
+    if brotli is not None and 'br' in accepted:
+        encoding, data = 'br', brotli.compress(body.encode(), quality=4)
+    elif 'gzip' in accepted:
+        encoding, data = 'gzip', gzip.compress(body.encode(), compresslevel=5)
+    else:
+        return result
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.encode_ms += (time.perf_counter() - started) * 1000
+    return {
+        **result,
+        'headers': {**result.get('headers', {}), 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'},
+        'body': base64.b64encode(data).decode(),
+        'isBase64Encoded': True,
+    }
+
+# === Служебный доступ ===
+#
+# Служебные действия (метрики, пул, ремонт счётчиков) доступны только с
+# заголовком X-Admin-Token, равным ADMIN_TOKEN из окружения функции.
+# Без ADMIN_TOKEN они закрыты для всех.
+
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+
+def admin_authorized(headers):
+    expected = os.environ.get('ADMIN_TOKEN', '')
+    given = get_header(headers, ADMIN_TOKEN_HEADER) or ''
+    return bool(expected) and hmac.compare_digest(given.encode(), expected.encode())
@@ -1,13 +1,38 @@
 """API для Kinetic Universe — персонажи, трюки, турниры, покупки, тренировки, профили."""
 
 import json
+import math
 import os
-from datetime import datetime, timedelta, date
+import select
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, date, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.errors import ForeignKeyViolation
+from psycopg2.extras import execute_values
+
+from runtime import (
+    ConnectionPool, PoolTimeout, RequestMetrics, LatencyStats, RawJSON, _current, log_event,
+    dumps, get_header, encode_response, admin_authorized, SLOW_QUERY_MS,
+)
+
+
+db_pool = ConnectionPool.from_env(max_size=4)
 
 def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=RealDictCursor)
+    return db_pool.acquire()
+
+def release_db(conn):
+    db_pool.release(conn)
+
+# Метрики запросов (runtime.py) копятся по action в памяти тёплого инстанса
+# (action=metrics); кодирование ответов — dumps/encode_response оттуда же.
+
+action_stats = LatencyStats(key='action')
+
 
 def resp(status, body):
     return {
@@ -16,15 +41,666 @@ def resp(status, body):
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*'
         },
-        'body': json.dumps(body, default=str)
+        'body': dumps(body)
+    }
+
+def parse_limit(value, default, maximum):
+    """Размер страницы из параметра запроса: default, если не задан, и не больше maximum.
+
+    ValueError — не целое число или меньше 1; маршрут отвечает на это 400.
+    """
+    limit = int(value) if value not in (None, '') else default
+    if limit < 1:
+        raise ValueError(f'limit must be positive: {limit}')
+    return min(limit, maximum)
+
+
+class LocalSharedTier:
+    """Локальная замена общего кэша (Redis и т.п.): хранит строки с TTL в памяти процесса."""
+
+    def __init__(self):
+        self._data = {}
+
+    def get(self, key):
+        item = self._data.get(key)
+        if not item:
+            return None
+        value, expires_at = item
+        if expires_at < time.time():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        self._data[key] = (value, time.time() + ttl)
+
+
+class RedisSharedTier:
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(key)
+        return value.decode() if value is not None else None
+
+    def set(self, key, value, ttl):
+        self._client.set(key, value, ex=max(int(ttl), 1))
+
+
+def make_shared_tier():
+    kind = os.environ.get('CATALOG_SHARED_CACHE', '')
+    if kind == 'local':
+        return LocalSharedTier()
+    if kind == 'redis' and os.environ.get('REDIS_URL'):
+        try:
+            return RedisSharedTier(os.environ['REDIS_URL'])
+        except ImportError:
+            return None
+    return None
+
+
+class CatalogCache:
+    """Read-through кэш справочников: LRU в процессе + необязательный общий уровень.
+
+    Запись живёт ttl секунд без обращений к БД, после чего сверяется с
+    catalog_versions: при той же версии продлевается, иначе перечитывается.
+    """
+
+    def __init__(self, ttl=60.0, max_entries=64, shared=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self._lru = OrderedDict()
+
+    def peek(self, key):
+        entry = self._lru.get(key)
+        if entry and time.monotonic() - entry['fetched_at'] < self.ttl:
+            self._lru.move_to_end(key)
+            return entry
+        return None
+
+    def get(self, cur, catalog, variant, loader):
+        key = f'{catalog}:{variant}'
+        entry = self.peek(key)
+        if entry:
+            return entry
+        cur.execute("SELECT version, updated_at FROM catalog_versions WHERE catalog = %s", (catalog,))
+        row = cur.fetchone()
+        version = row['version'] if row else 0
+        updated_at = row['updated_at'] if row else datetime.utcnow()
+        entry = self._lru.get(key)
+        if entry is None or entry['version'] != version:
+            entry = self._from_shared(key, version) or self._load(cur, key, version, updated_at, loader)
+        entry['fetched_at'] = time.monotonic()
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+        return entry
+
+    def invalidate(self, catalog=None):
+        for key in list(self._lru):
+            if catalog is None or key.startswith(f'{catalog}:'):
+                del self._lru[key]
+
+    def _entry(self, key, version, last_modified, rows_json):
+        return {
+            'key': key,
+            'version': version,
+            'rows': json.loads(rows_json),
+            'rows_json': rows_json,
+            'etag': f'"{key.replace(":", "-")}-v{version}"',
+            'last_modified': last_modified,
+        }
+
+    def _from_shared(self, key, version):
+        if not self.shared:
+            return None
+        cached = self.shared.get(f'catalog:{key}:v{version}')
+        if not cached:
+            return None
+        last_modified, rows_json = cached.split('\n', 1)
+        return self._entry(key, version, last_modified, rows_json)
+
+    def _load(self, cur, key, version, updated_at, loader):
+        rows_json = json.dumps(loader(cur), default=str)
+        last_modified = format_datetime(updated_at.replace(tzinfo=timezone.utc), usegmt=True)
+        if self.shared:
+            self.shared.set(f'catalog:{key}:v{version}', f'{last_modified}\n{rows_json}', self.ttl * 10)
+        return self._entry(key, version, last_modified, rows_json)
+
+
+catalog_cache = CatalogCache(
+    ttl=float(os.environ.get('CATALOG_CACHE_TTL', '60')),
+    shared=make_shared_tier(),
+)
+
+def load_tricks(sport):
+    def loader(cur):
+        if sport:
+            cur.execute("SELECT * FROM tricks WHERE sport_type = %s ORDER BY difficulty, id", (sport,))
+        else:
+            cur.execute("SELECT * FROM tricks ORDER BY sport_type, difficulty, id")
+        return cur.fetchall()
+    return loader
+
+def load_achievements(cur):
+    cur.execute("SELECT * FROM achievements ORDER BY id")
+    return cur.fetchall()
+
+def load_accessories(cur):
+    cur.execute("SELECT * FROM accessories WHERE is_available = true ORDER BY price")
+    return cur.fetchall()
+
+def catalog_resp(entry, field, headers):
+    """Отдаёт справочник из кэша: 304 по ETag/If-Modified-Since без сериализации тела."""
+    cache_headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag, Last-Modified',
+        'ETag': entry['etag'],
+        'Last-Modified': entry['last_modified'],
+        'Cache-Control': 'no-cache',
+    }
+    if_none_match = get_header(headers, 'If-None-Match')
+    if_modified_since = get_header(headers, 'If-Modified-Since')
+    not_modified = False
+    if if_none_match:
+        not_modified = entry['etag'] in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    elif if_modified_since:
+        try:
+            not_modified = parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(entry['last_modified'])
+        except (TypeError, ValueError):
+            not_modified = False
+    if not_modified:
+        return {'statusCode': 304, 'headers': cache_headers, 'body': ''}
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', **cache_headers},
+        'body': dumps({field: RawJSON(entry['rows_json'])})
     }
 
+NOTIFICATION_BATCH_SIZE = 1000
+NOTIFICATIONS_PAGE_SIZE = 50
+NOTIFICATIONS_MAX_PAGE_SIZE = 200
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', '30'))
+NOTIFICATION_ARCHIVE_BATCH = int(os.environ.get('NOTIFICATION_ARCHIVE_BATCH', '1000'))
+NOTIFICATION_ARCHIVE_MAX_BATCH = 10000
+NOTIFICATION_ARCHIVE_MAX_BATCHES = 1000
+NOTIFICATION_MAX_RETENTION_DAYS = 3650
+
+# Вставка уведомлений вместе с приростом счётчика непрочитанных
+INSERT_NOTIFICATIONS_SQL = """
+WITH ins AS (
+    INSERT INTO character_notifications (character_id, title, message, notification_type, data)
+    VALUES %s
+    RETURNING character_id
+)
+INSERT INTO character_stats (character_id, unread_notifications)
+SELECT character_id, COUNT(*) FROM ins GROUP BY character_id
+ON CONFLICT (character_id) DO UPDATE
+SET unread_notifications = character_stats.unread_notifications + EXCLUDED.unread_notifications
+"""
+
 def create_notification(cur, character_id, title, message, ntype='info', data=None):
+    create_notifications(cur, [(character_id, title, message, ntype, data)])
+
+def create_notifications(cur, rows):
+    """rows — кортежи (character_id, title, message, ntype, data); пишутся многострочными INSERT."""
+    values = [
+        (character_id, title, message, ntype, json.dumps(data) if data else None)
+        for character_id, title, message, ntype, data in rows
+    ]
+    if not values:
+        return 0
+    execute_values(cur, INSERT_NOTIFICATIONS_SQL, values, page_size=NOTIFICATION_BATCH_SIZE)
+    return len(values)
+
+def broadcast_notification(cur, title, message, ntype='info', data=None):
     cur.execute(
+        "WITH ins AS ("
         "INSERT INTO character_notifications (character_id, title, message, notification_type, data) "
-        "VALUES (%s, %s, %s, %s, %s)",
-        (character_id, title, message, ntype, json.dumps(data) if data else None)
+        "SELECT id, %s, %s, %s, %s FROM characters RETURNING character_id), "
+        "bump AS ("
+        "INSERT INTO character_stats (character_id, unread_notifications) SELECT character_id, 1 FROM ins "
+        "ON CONFLICT (character_id) DO UPDATE "
+        "SET unread_notifications = character_stats.unread_notifications + 1) "
+        "SELECT COUNT(*) AS cnt FROM ins",
+        (title, message, ntype, json.dumps(data) if data else None)
+    )
+    return cur.fetchone()['cnt']
+
+def mark_notifications_read(cur, character_id, notification_ids=None):
+    """Помечает уведомления прочитанными и уменьшает счётчик на число реально изменённых строк."""
+    cur.execute(
+        "WITH marked AS ("
+        "UPDATE character_notifications SET is_read = true "
+        "WHERE character_id = %(cid)s AND is_read = false "
+        "AND (%(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[])) RETURNING id) "
+        "UPDATE character_stats SET unread_notifications = GREATEST(unread_notifications - (SELECT COUNT(*) FROM marked), 0) "
+        "WHERE character_id = %(cid)s RETURNING unread_notifications",
+        {'cid': character_id, 'ids': notification_ids or None}
     )
+    row = cur.fetchone()
+    return row['unread_notifications'] if row else 0
+
+def unread_notifications(cur, character_id):
+    cur.execute("SELECT unread_notifications FROM character_stats WHERE character_id = %s", (character_id,))
+    row = cur.fetchone()
+    return row['unread_notifications'] if row else 0
+
+def parse_notifications_cursor(cursor):
+    """Курсор «created_at:id» → (datetime, id) или None."""
+    if not cursor:
+        return None
+    created_at, _, nid = cursor.rpartition(':')
+    try:
+        return datetime.fromisoformat(created_at), int(nid)
+    except ValueError:
+        return None
+
+def notifications_page(cur, character_id, cursor=None, limit=NOTIFICATIONS_PAGE_SIZE):
+    """Страница уведомлений от новых к старым; keyset по (created_at, id)."""
+    after = parse_notifications_cursor(cursor)
+    cur.execute(
+        "SELECT * FROM character_notifications WHERE character_id = %(cid)s "
+        "AND (%(ts)s::timestamp IS NULL OR (created_at, id) < (%(ts)s::timestamp, %(id)s::int)) "
+        "ORDER BY created_at DESC, id DESC LIMIT %(limit)s",
+        {'cid': character_id, 'ts': after[0] if after else None, 'id': after[1] if after else None, 'limit': limit + 1}
+    )
+    rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1]['created_at'].isoformat()}:{rows[-1]['id']}"
+    return rows, next_cursor
+
+# Одна пачка: прочитанные уведомления старше срока переносятся в архив
+ARCHIVE_NOTIFICATIONS_SQL = """
+WITH batch AS (
+    SELECT id FROM character_notifications
+    WHERE is_read = true AND created_at < NOW() - make_interval(days => %(days)s)
+    ORDER BY created_at
+    LIMIT %(batch)s
+    FOR UPDATE SKIP LOCKED
+),
+moved AS (
+    DELETE FROM character_notifications n USING batch b WHERE n.id = b.id
+    RETURNING n.id, n.character_id, n.title, n.message, n.notification_type, n.data, n.created_at
+),
+archived AS (
+    INSERT INTO character_notifications_archive (id, character_id, title, message, notification_type, data, created_at)
+    SELECT * FROM moved
+    ON CONFLICT (id) DO NOTHING
+)
+SELECT COUNT(*) AS cnt FROM moved
+"""
+
+def archive_notifications(conn, days=NOTIFICATION_RETENTION_DAYS, batch_size=NOTIFICATION_ARCHIVE_BATCH, max_batches=100):
+    """Переносит старые прочитанные уведомления в архив пачками, каждая пачка — своя транзакция."""
+    archived = batches = 0
+    cur = conn.cursor()
+    while batches < max_batches:
+        cur.execute(ARCHIVE_NOTIFICATIONS_SQL, {'days': days, 'batch': batch_size})
+        moved = cur.fetchone()['cnt']
+        conn.commit()
+        if moved <= 0:
+            break
+        archived += moved
+        batches += 1
+        if moved < batch_size:
+            break
+    return {'archived': archived, 'batches': batches, 'retention_days': days}
+
+# === Журнал кинетиков ===
+#
+# Любое движение кинетиков — один запрос: условный UPDATE characters
+# (остаток не уходит в минус) и строки журнала из его RETURNING.
+# Запрос собирается из CTE: вызывающий код задаёт entries
+# (character_id, amount, source, description, created_by, ord),
+# LEDGER_MOVE_CTE меняет остатки, LEDGER_TX_CTE пишет журнал с balance_after.
+# Другие поля персонажа меняются в том же UPDATE через ledger_ctes():
+# дополнительные колонки entries суммируются по персонажу (e.xp и т.п.).
+
+TRANSACTIONS_PAGE_SIZE = 100
+TRANSACTIONS_MAX_PAGE_SIZE = 500
+LEDGER_PARTITIONS_AHEAD = 3
+SNAPSHOT_LAG = timedelta(minutes=5)
+SNAPSHOT_BATCH = 1000
+SNAPSHOT_MAX_BATCH = 10000
+RECONCILE_MAX_LIMIT = 1000
+
+LEDGER_MOVE_CTE = """
+moved AS (
+    UPDATE characters c SET kinetics = c.kinetics + e.amount, updated_at = NOW(){extra_set}
+    FROM (SELECT character_id, SUM(amount) AS amount{sums} FROM entries GROUP BY character_id) e{prev_from}
+    WHERE c.id = e.character_id AND c.kinetics + e.amount >= 0{prev_where}{extra_where}
+    RETURNING c.*{returning}
+)"""
+
+# Опыт из колонки entries.xp и уровень по нему
+LEDGER_XP_SET = ", experience = c.experience + e.xp, level = LEAST(FLOOR((c.experience + e.xp) / 100) + 1, 100)"
+
+LEDGER_TX_CTE = """
+tx AS (
+    INSERT INTO kinetics_transactions (character_id, amount, transaction_type, source, description, created_by, balance_after)
+    SELECT e.character_id, e.amount, CASE WHEN e.amount > 0 THEN 'earn' ELSE 'spend' END,
+           e.source, e.description, e.created_by,
+           m.kinetics - COALESCE(SUM(e.amount) OVER (
+               PARTITION BY e.character_id ORDER BY e.ord DESC ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+           ), 0)
+    FROM entries e JOIN moved m ON m.id = e.character_id
+    WHERE e.amount <> 0
+    RETURNING *
+)"""
+
+
+def ledger_ctes(extra_set='', extra_where='', sums=(), returning=''):
+    """moved + tx для entries; extra_set/extra_where дописываются к UPDATE characters.
+
+    sums — колонки entries, которые суммируются по персонажу и доступны в
+    extra_set как e.<колонка>; returning дописывается к RETURNING c.*,
+    в нём prev — строка персонажа до изменения.
+    """
+    return LEDGER_MOVE_CTE.format(
+        extra_set=extra_set, extra_where=extra_where,
+        sums=''.join(f', SUM({col}) AS {col}' for col in sums),
+        prev_from=', characters prev' if 'prev.' in returning else '',
+        prev_where=' AND prev.id = c.id' if 'prev.' in returning else '',
+        returning=returning,
+    ) + ',' + LEDGER_TX_CTE
+
+
+POST_TRANSACTION_SQL = (
+    "WITH entries AS ("
+    "SELECT %(cid)s::int AS character_id, %(amount)s::int AS amount, %(source)s::text AS source, "
+    "%(description)s::text AS description, %(created_by)s::text AS created_by, 1 AS ord), "
+    + ledger_ctes() +
+    " SELECT m.*, (SELECT row_to_json(tx) FROM tx) AS ledger_tx FROM moved m"
+)
+
+def post_transaction(cur, character_id, amount, source, description='', created_by=None):
+    """Проводит операцию: (персонаж, строка журнала) или (None, None), если персонажа нет или не хватает кинетиков."""
+    cur.execute(POST_TRANSACTION_SQL, {
+        'cid': character_id, 'amount': amount, 'source': source,
+        'description': description, 'created_by': created_by,
+    })
+    row = cur.fetchone()
+    if not row:
+        return None, None
+    tx = row.pop('ledger_tx')
+    return row, tx
+
+def transactions_page(cur, character_id, cursor=None, limit=TRANSACTIONS_PAGE_SIZE):
+    """История операций от новых к старым; keyset по (created_at, id), курсор как у уведомлений."""
+    after = parse_notifications_cursor(cursor)
+    cur.execute(
+        "SELECT * FROM kinetics_transactions WHERE character_id = %(cid)s "
+        "AND (%(ts)s::timestamp IS NULL OR (created_at, id) < (%(ts)s::timestamp, %(id)s::int)) "
+        "ORDER BY created_at DESC, id DESC LIMIT %(limit)s",
+        {'cid': character_id, 'ts': after[0] if after else None, 'id': after[1] if after else None, 'limit': limit + 1}
+    )
+    rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1]['created_at'].isoformat()}:{rows[-1]['id']}"
+    return rows, next_cursor
+
+# Снимок ≤ момента + операции после него: читается только хвост журнала
+BALANCE_AT_SQL = """
+SELECT s.snapshot_at,
+       CASE WHEN s.snapshot_at IS NULL AND EXISTS (
+                SELECT 1 FROM kinetics_balance_snapshots
+                WHERE character_id = %(cid)s AND kind = 'opening'
+            ) THEN NULL
+            ELSE COALESCE(s.balance, 0) + COALESCE((
+                SELECT SUM(amount) FROM kinetics_transactions
+                WHERE character_id = %(cid)s
+                  AND created_at > COALESCE(s.snapshot_at, '-infinity') AND created_at <= %(at)s
+            ), 0)
+       END AS balance
+FROM (SELECT 1) one
+LEFT JOIN LATERAL (
+    SELECT snapshot_at, balance FROM kinetics_balance_snapshots
+    WHERE character_id = %(cid)s AND snapshot_at <= %(at)s
+    ORDER BY snapshot_at DESC LIMIT 1
+) s ON true
+"""
+
+def balance_at(cur, character_id, at):
+    """Остаток на момент at; balance = None, если момент раньше ввода журнала."""
+    cur.execute(BALANCE_AT_SQL, {'cid': character_id, 'at': at})
+    return cur.fetchone()
+
+# Пачка персонажей: новый снимок пишется только при движении после прошлого снимка
+SNAPSHOT_BALANCES_SQL = """
+WITH batch AS (
+    SELECT id FROM characters WHERE id > %(after)s ORDER BY id LIMIT %(batch)s
+),
+ins AS (
+    INSERT INTO kinetics_balance_snapshots (character_id, snapshot_at, balance)
+    SELECT b.id, %(cutoff)s, COALESCE(s.balance, 0) + COALESCE(t.amount, 0)
+    FROM batch b
+    LEFT JOIN LATERAL (
+        SELECT snapshot_at, balance FROM kinetics_balance_snapshots
+        WHERE character_id = b.id AND snapshot_at <= %(cutoff)s
+        ORDER BY snapshot_at DESC LIMIT 1
+    ) s ON true
+    LEFT JOIN LATERAL (
+        SELECT SUM(amount) AS amount FROM kinetics_transactions
+        WHERE character_id = b.id
+          AND created_at > COALESCE(s.snapshot_at, '-infinity') AND created_at <= %(cutoff)s
+    ) t ON true
+    WHERE t.amount IS NOT NULL
+    ON CONFLICT (character_id, snapshot_at) DO NOTHING
+    RETURNING character_id
+)
+SELECT (SELECT MAX(id) FROM batch) AS last_id, (SELECT COUNT(*) FROM ins) AS written
+"""
+
+def ensure_ledger_partitions(conn, months_ahead=LEDGER_PARTITIONS_AHEAD):
+    """Секции журнала на текущий и months_ahead следующих месяцев; строки из секции по умолчанию переносятся.
+
+    Запускается отдельным шагом по расписанию (tools/ledger_partitions.py).
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT ensure_kinetics_partitions(CURRENT_DATE, %s) AS created", (months_ahead + 1,))
+    created = cur.fetchone()['created']
+    cur.execute("SELECT COUNT(*) AS cnt FROM kinetics_transactions_default")
+    stray = cur.fetchone()['cnt']
+    conn.commit()
+    return {'partitions_created': created, 'default_partition_rows': stray}
+
+def snapshot_balances(conn, batch_size=SNAPSHOT_BATCH):
+    """Снимки остатков пачками, каждая — своя транзакция.
+
+    Снимок берётся с отставанием SNAPSHOT_LAG: created_at — время начала транзакции,
+    поэтому ещё не закоммиченные операции не должны попасть «за» снимок.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT LOCALTIMESTAMP - %s AS cutoff", (SNAPSHOT_LAG,))
+    cutoff = cur.fetchone()['cutoff']
+    conn.commit()
+    after = written = batches = 0
+    while True:
+        cur.execute(SNAPSHOT_BALANCES_SQL, {'after': after, 'batch': batch_size, 'cutoff': cutoff})
+        row = cur.fetchone()
+        conn.commit()
+        if row['last_id'] is None:
+            break
+        after = row['last_id']
+        written += row['written']
+        batches += 1
+    return {'snapshots': written, 'batches': batches, 'cutoff': cutoff}
+
+# Остаток по журналу против characters.kinetics; одна выборка — один согласованный снимок данных
+RECONCILE_SQL = """
+SELECT c.id AS character_id, c.kinetics,
+       COALESCE(s.balance, 0) + COALESCE(t.amount, 0) AS ledger_balance
+FROM characters c
+LEFT JOIN LATERAL (
+    SELECT snapshot_at, balance FROM kinetics_balance_snapshots
+    WHERE character_id = c.id ORDER BY snapshot_at DESC LIMIT 1
+) s ON true
+LEFT JOIN LATERAL (
+    SELECT SUM(amount) AS amount FROM kinetics_transactions
+    WHERE character_id = c.id AND created_at > COALESCE(s.snapshot_at, '-infinity')
+) t ON true
+WHERE %(cid)s::int IS NULL OR c.id = %(cid)s::int
+ORDER BY c.id
+"""
+
+def reconcile_ledger(conn, character_id=None, limit=100, itersize=2000):
+    """Потоковая сверка через серверный курсор: память не зависит от числа персонажей."""
+    checked = 0
+    drift = []
+    drifted = 0
+    with conn.cursor(name='reconcile_ledger') as cur:
+        cur.itersize = itersize
+        cur.execute(RECONCILE_SQL, {'cid': character_id})
+        for row in cur:
+            checked += 1
+            if row['kinetics'] != row['ledger_balance']:
+                drifted += 1
+                if len(drift) < limit:
+                    drift.append({**row, 'difference': row['kinetics'] - row['ledger_balance']})
+    conn.rollback()
+    return {'checked': checked, 'drifted': drifted, 'drift': drift, 'consistent': drifted == 0}
+
+# === Покупки ===
+#
+# Проверка остатка, покупка и запись в журнал — один оператор: товар
+# вставляется через ON CONFLICT DO NOTHING, списание — условный UPDATE из
+# ledger_ctes(). Параллельные покупки не уводят остаток в минус и не
+# списывают дважды; если товар вставлен, а денег не хватило, вызывающий
+# код откатывает транзакцию.
+
+CUSTOMIZATION_FIELDS = ('hairstyle', 'hair_color', 'body_type', 'name', 'avatar_url')
+
+PURCHASE_ITEM_SQL = """
+WITH item AS (
+    INSERT INTO purchased_items (character_id, item_type, item_value, item_name, cost)
+    VALUES (%(cid)s, %(item_type)s, %(item_value)s, %(item_name)s, %(cost)s)
+    ON CONFLICT (character_id, item_type, item_value) DO NOTHING
+    RETURNING *
+),
+entries AS (
+    SELECT character_id, -cost AS amount, 'shop'::text AS source,
+           'Покупка: ' || item_name AS description, NULL::text AS created_by, 1 AS ord
+    FROM item
+),
+""" + ledger_ctes() + """
+SELECT m.*, (SELECT row_to_json(i) FROM item i) AS purchased
+FROM (SELECT 1) one LEFT JOIN moved m ON true
+"""
+
+# Платная вещь меняет поле в том же UPDATE, что и списывает кинетики;
+# уже купленная или бесплатная — отдельным UPDATE без списания.
+PURCHASE_CUSTOMIZATION_SQL = """
+WITH item AS (
+    INSERT INTO purchased_items (character_id, item_type, item_value, item_name, cost)
+    SELECT %(cid)s, %(item_type)s, %(item_value)s, %(item_name)s, %(cost)s WHERE %(cost)s > 0
+    ON CONFLICT (character_id, item_type, item_value) DO NOTHING
+    RETURNING *
+),
+entries AS (
+    SELECT character_id, -cost AS amount, 'shop'::text AS source,
+           'Покупка: ' || item_type AS description, NULL::text AS created_by, 1 AS ord
+    FROM item
+),
+{ledger},
+free AS (
+    UPDATE characters SET {field} = %(value)s, updated_at = NOW()
+    WHERE id = %(cid)s AND NOT EXISTS (SELECT 1 FROM item)
+    RETURNING *
+)
+SELECT c.*, EXISTS (SELECT 1 FROM item) AS paid,
+       EXISTS (
+           SELECT 1 FROM purchased_items
+           WHERE character_id = %(cid)s AND item_type = %(item_type)s AND item_value = %(item_value)s
+       ) AS owned
+FROM (SELECT 1) one
+LEFT JOIN (SELECT * FROM moved UNION ALL SELECT * FROM free) c ON true
+"""
+
+def purchase_customization_sql(field):
+    return PURCHASE_CUSTOMIZATION_SQL.format(ledger=ledger_ctes(extra_set=f', {field} = %(value)s'), field=field)
+
+# Новый вид спорта дописывается в том же UPDATE, что и списание; повтор не списывает
+ADD_SPORT_SQL = """
+WITH entries AS (
+    SELECT %(cid)s::int AS character_id, -%(cost)s::int AS amount, 'shop'::text AS source,
+           'Добавлен вид спорта: ' || %(sport)s::text AS description, NULL::text AS created_by, 1 AS ord
+),
+""" + ledger_ctes(
+    extra_set=", sport_types = COALESCE(NULLIF(c.sport_types, '{}'), ARRAY[c.sport_type]) || %(sport)s::text",
+    extra_where=" AND NOT %(sport)s::text = ANY(COALESCE(NULLIF(c.sport_types, '{}'), ARRAY[c.sport_type]))",
+) + """
+SELECT * FROM moved
+"""
+
+BUY_ACCESSORY_SQL = """
+WITH acc AS (
+    SELECT * FROM accessories WHERE id = %(acc)s AND is_available = true
+),
+owned AS (
+    INSERT INTO character_accessories (character_id, accessory_id)
+    SELECT %(cid)s, id FROM acc
+    ON CONFLICT (character_id, accessory_id) DO NOTHING
+    RETURNING accessory_id
+),
+entries AS (
+    SELECT %(cid)s::int AS character_id, -a.price AS amount, 'shop'::text AS source,
+           'Аксессуар: ' || a.name AS description, NULL::text AS created_by, 1 AS ord
+    FROM acc a JOIN owned o ON o.accessory_id = a.id
+),
+""" + ledger_ctes() + """
+SELECT m.*, (SELECT row_to_json(a) FROM acc a) AS accessory, EXISTS (SELECT 1 FROM owned) AS acquired
+FROM (SELECT 1) one LEFT JOIN moved m ON true
+"""
+
+JOIN_TOURNAMENT_SQL = """
+WITH entry AS (
+    INSERT INTO tournament_entries (tournament_id, character_id)
+    VALUES (%(tid)s, %(cid)s)
+    ON CONFLICT (tournament_id, character_id) DO NOTHING
+    RETURNING *
+),
+entries AS (
+    SELECT character_id, -%(fee)s::int AS amount, 'tournament'::text AS source,
+           'Вступление в турнир #' || tournament_id AS description, NULL::text AS created_by, 1 AS ord
+    FROM entry
+),
+""" + ledger_ctes() + """
+SELECT m.*, (SELECT row_to_json(e) FROM entry e) AS entry
+FROM (SELECT 1) one LEFT JOIN moved m ON true
+"""
+
+# Итог мини-игры: награда, счётчики игр и строка game_results — одним оператором
+GAME_COMPLETE_SQL = """
+WITH entries AS (
+    SELECT %(cid)s::int AS character_id, %(kin)s::int AS amount, 'game'::text AS source,
+           'Мини-игра: ' || %(game)s::text AS description, NULL::text AS created_by, 1 AS ord,
+           %(xp)s::int AS xp, %(won)s::int AS won
+),
+""" + ledger_ctes(
+    extra_set=LEDGER_XP_SET + ", games_played = c.games_played + 1, games_won = c.games_won + e.won",
+    sums=('xp', 'won'),
+    returning=', prev.level AS prev_level, prev.games_won AS prev_games_won',
+) + """,
+game AS (
+    INSERT INTO game_results (character_id, game_name, won, earned_xp, earned_kinetics, score)
+    SELECT id, %(game)s, %(won_flag)s, %(xp)s, %(kin)s, %(score)s FROM moved
+)
+SELECT * FROM moved
+"""
+
+def split_row(row, *keys):
+    """Отделяет служебные колонки от строки персонажа; None, если персонаж не изменён."""
+    extra = [row.pop(key) for key in keys]
+    return (row if row['id'] is not None else None), *extra
+
 
 def get_current_week():
     today = date.today()
@@ -38,108 +714,1185 @@ def get_or_create_tournament(cur):
     cur.execute("SELECT * FROM tournaments WHERE week_start = %s", (monday,))
     tournament = cur.fetchone()
     if not tournament:
+        # параллельный запрос мог создать неделю первым: тогда читаем его строку
         cur.execute(
             "INSERT INTO tournaments (week_start, week_end, month_key, status) "
-            "VALUES (%s, %s, %s, 'active') RETURNING *",
+            "VALUES (%s, %s, %s, 'active') ON CONFLICT (week_start) DO NOTHING RETURNING *",
             (monday, sunday, month_key)
         )
         tournament = cur.fetchone()
-        cur.execute("SELECT id FROM characters")
-        all_chars = cur.fetchall()
-        for ch in all_chars:
-            create_notification(cur, ch['id'],
-                'Новый турнир начался!',
-                f'Еженедельный турнир {monday.strftime("%d.%m")} - {sunday.strftime("%d.%m")}. Вступи за 100 кинетиков!',
-                'tournament', {'tournament_id': tournament['id']})
+        if not tournament:
+            cur.execute("SELECT * FROM tournaments WHERE week_start = %s", (monday,))
+            return cur.fetchone()
+        broadcast_notification(cur,
+            'Новый турнир начался!',
+            f'Еженедельный турнир {monday.strftime("%d.%m")} - {sunday.strftime("%d.%m")}. Вступи за 100 кинетиков!',
+            'tournament', {'tournament_id': tournament['id']})
     return tournament
 
+GAME_POINTS = 10
+TRICK_POINTS = 25
+TRAINING_POINTS = 30
+
+# Очки и места всех участников считаются одним запросом: агрегаты по каждой
+# таблице активности группируются по персонажу, место — оконной функцией.
+# Переписываются только изменившиеся строки, им проставляется следующая версия турнира.
+# FOR NO KEY UPDATE совместим с KEY SHARE, который держит вставка участника по
+# внешнему ключу: два одновременных вступления не повышают блокировку навстречу друг другу.
+RECALC_TOURNAMENT_SQL = """
+WITH t AS (
+    SELECT id, week_start, week_end, version FROM tournaments WHERE id = %(tid)s AND status = 'active' FOR NO KEY UPDATE
+),
+entrants AS (
+    SELECT te.id, te.character_id, te.joined_at
+    FROM tournament_entries te JOIN t ON te.tournament_id = t.id
+),
+games AS (
+    SELECT g.character_id, COUNT(*) AS cnt
+    FROM game_results g JOIN entrants e ON e.character_id = g.character_id, t
+    WHERE g.created_at >= t.week_start AND g.created_at < t.week_end + 1
+    GROUP BY g.character_id
+),
+tricks AS (
+    SELECT ct.character_id, COUNT(*) AS cnt
+    FROM character_tricks ct JOIN entrants e ON e.character_id = ct.character_id, t
+    WHERE ct.confirmed_at >= t.week_start AND ct.confirmed_at < t.week_end + 1
+    GROUP BY ct.character_id
+),
+trainings AS (
+    SELECT tv.character_id, COUNT(*) AS cnt
+    FROM training_visits tv JOIN entrants e ON e.character_id = tv.character_id, t
+    WHERE tv.visit_date >= t.week_start AND tv.visit_date <= t.week_end
+    GROUP BY tv.character_id
+),
+scored AS (
+    SELECT e.id, e.joined_at,
+           COALESCE(g.cnt, 0) * %(game_points)s AS games_score,
+           COALESCE(tr.cnt, 0) * %(trick_points)s AS tricks_score,
+           COALESCE(tv.cnt, 0) * %(training_points)s AS training_score
+    FROM entrants e
+    LEFT JOIN games g ON g.character_id = e.character_id
+    LEFT JOIN tricks tr ON tr.character_id = e.character_id
+    LEFT JOIN trainings tv ON tv.character_id = e.character_id
+),
+ranked AS (
+    SELECT id, games_score, tricks_score, training_score,
+           games_score + tricks_score + training_score AS score,
+           ROW_NUMBER() OVER (
+               ORDER BY games_score + tricks_score + training_score DESC, joined_at ASC, id ASC
+           ) AS rank
+    FROM scored
+)
+UPDATE tournament_entries te
+SET games_score = r.games_score, tricks_score = r.tricks_score,
+    training_score = r.training_score, score = r.score, rank = r.rank,
+    version = t.version + 1
+FROM ranked r, t
+WHERE te.id = r.id
+  AND (te.games_score, te.tricks_score, te.training_score, te.score, te.rank)
+      IS DISTINCT FROM (r.games_score::int, r.tricks_score::int, r.training_score::int, r.score::int, r.rank::int)
+"""
+
 def recalc_tournament_scores(cur, tournament_id):
-    cur.execute("SELECT * FROM tournament_entries WHERE tournament_id = %s", (tournament_id,))
-    entries = cur.fetchall()
-    cur.execute("SELECT * FROM tournaments WHERE id = %s", (tournament_id,))
-    t = cur.fetchone()
-    if not t:
-        return
-    ws = t['week_start']
-    we = t['week_end'] + timedelta(days=1)
-
-    for entry in entries:
-        cid = entry['character_id']
-        cur.execute(
-            "SELECT COUNT(*) as cnt FROM game_results WHERE character_id = %s AND created_at >= %s AND created_at < %s",
-            (cid, ws, we)
-        )
-        games = cur.fetchone()['cnt']
-        cur.execute(
-            "SELECT COUNT(*) as cnt FROM character_tricks WHERE character_id = %s AND confirmed_at >= %s AND confirmed_at < %s",
-            (cid, ws, we)
-        )
-        tricks = cur.fetchone()['cnt']
+    cur.execute(RECALC_TOURNAMENT_SQL, {
+        'tid': tournament_id,
+        'game_points': GAME_POINTS,
+        'trick_points': TRICK_POINTS,
+        'training_points': TRAINING_POINTS,
+    })
+    updated = cur.rowcount
+    if updated:
+        bump_tournament_version(cur, tournament_id)
+    refresh_monthly_leaderboard(cur, tournament_id)
+    return updated
+
+def bump_tournament_version(cur, tournament_id):
+    """Закрывает версию турнирной таблицы; триггер сообщает о ней ленте изменений."""
+    cur.execute("UPDATE tournaments SET version = version + 1 WHERE id = %s RETURNING version", (tournament_id,))
+    return cur.fetchone()['version']
+
+# Места по уже посчитанным очкам, без пересчёта истории активности
+RERANK_TOURNAMENT_SQL = """
+WITH t AS (
+    SELECT id, version FROM tournaments WHERE id = %(tid)s
+),
+ranked AS (
+    SELECT id, ROW_NUMBER() OVER (ORDER BY score DESC, joined_at ASC, id ASC) AS rank
+    FROM tournament_entries WHERE tournament_id = %(tid)s
+)
+UPDATE tournament_entries te SET rank = r.rank, version = t.version + 1
+FROM ranked r, t
+WHERE te.id = r.id AND te.tournament_id = %(tid)s AND te.rank IS DISTINCT FROM r.rank
+"""
+
+def apply_tournament_scores(cur, tournament_id):
+    """После инкрементального изменения очков: места, версия таблицы и месячный рейтинг."""
+    cur.execute(RERANK_TOURNAMENT_SQL, {'tid': tournament_id})
+    bump_tournament_version(cur, tournament_id)
+    refresh_monthly_leaderboard(cur, tournament_id)
+
+# Посещения группы одним оператором: дубли (character_id, visit_date) и
+# неизвестные персонажи пропускаются, счётчики, уведомления и очки турнира
+# недели посещения растут только для реально вставленных строк.
+ADD_TRAINING_VISITS_SQL = """
+WITH visits AS (
+    INSERT INTO training_visits (character_id, visit_date, confirmed_by, notes, group_name)
+    SELECT c.id, %(date)s::date, %(by)s, %(notes)s, %(group)s
+    FROM characters c WHERE c.id = ANY(%(ids)s::int[])
+    ON CONFLICT (character_id, visit_date) DO NOTHING
+    RETURNING *
+),
+stats AS (
+    INSERT INTO character_stats (character_id, trainings_count, unread_notifications)
+    SELECT character_id, 1, 1 FROM visits
+    ON CONFLICT (character_id) DO UPDATE
+    SET trainings_count = character_stats.trainings_count + 1,
+        unread_notifications = character_stats.unread_notifications + 1,
+        updated_at = NOW()
+),
+notes AS (
+    INSERT INTO character_notifications (character_id, title, message, notification_type)
+    SELECT character_id, 'Тренировка засчитана!', 'Посещение тренировки ' || visit_date || ' зачислено', 'info'
+    FROM visits
+),
+scores AS (
+    UPDATE tournament_entries te
+    SET training_score = te.training_score + %(points)s, score = te.score + %(points)s, version = t.version + 1
+    FROM visits v, tournaments t
+    WHERE v.visit_date BETWEEN t.week_start AND t.week_end AND t.status = 'active'
+      AND te.tournament_id = t.id AND te.character_id = v.character_id
+    RETURNING te.tournament_id
+)
+SELECT v.*, (SELECT array_agg(DISTINCT tournament_id) FROM scores) AS tournament_ids
+FROM visits v ORDER BY v.character_id
+"""
+
+def add_training_visits(cur, character_ids, visit_date, confirmed_by='', notes='', group_name=None):
+    """Отмечает посещение списка персонажей; возвращает вставленные строки."""
+    cur.execute(ADD_TRAINING_VISITS_SQL, {
+        'ids': list(character_ids), 'date': visit_date, 'by': confirmed_by, 'notes': notes,
+        'group': group_name, 'points': TRAINING_POINTS,
+    })
+    visits = cur.fetchall()
+    tournament_ids = visits[0]['tournament_ids'] or [] if visits else []
+    for visit in visits:
+        visit.pop('tournament_ids')
+    for tid in tournament_ids:
+        apply_tournament_scores(cur, tid)
+    today = date.today()
+    rewarded = advance_quests(cur, [(v['character_id'], 'training_daily', 1) for v in visits if v['visit_date'] == today])
+    for cid, row in rewarded.items():
+        check_achievements(cur, cid, {'level': (row['prev_level'], row['level'])})
+    return visits
+
+# === Закрытие недели ===
+#
+# Итоги рассылаются пачками по местам; каждая пачка вместе с чекпоинтом
+# results_sent_through — одна транзакция, поэтому повторный запуск после
+# сбоя продолжает с места остановки и не шлёт итоги дважды.
+
+WEEKLY_RESULTS_CHUNK = int(os.environ.get('WEEKLY_RESULTS_CHUNK', '1000'))
+# Сколько секунд HTTP-вызов рассылает итоги; остаток дорассылает следующий вызов или cron
+WEEKLY_CLOSE_BUDGET = float(os.environ.get('WEEKLY_CLOSE_BUDGET', '20'))
+
+WEEKLY_RESULTS_CHUNK_SQL = """
+WITH t AS (
+    SELECT id, week_start, week_end, participants, results_sent_through,
+           to_char(week_start, 'DD.MM') || ' - ' || to_char(week_end, 'DD.MM') AS week
+    FROM tournaments WHERE id = %(tid)s AND status = 'closing'
+    FOR UPDATE
+),
+chunk AS (
+    SELECT te.* FROM tournament_entries te, t
+    WHERE te.tournament_id = t.id AND te.rank > t.results_sent_through
+    ORDER BY te.rank
+    LIMIT %(chunk)s
+),
+notes AS (
+    INSERT INTO character_notifications (character_id, title, message, notification_type, data)
+    SELECT c.character_id, 'Итоги недели: ' || c.rank || ' место!',
+           'Турнир ' || t.week || ': ' || c.score || ' очков', 'weekly_results',
+           json_build_object(
+               'type', 'weekly_results', 'tournament_id', t.id, 'rank', c.rank, 'score', c.score,
+               'games_score', c.games_score, 'tricks_score', c.tricks_score, 'training_score', c.training_score,
+               'total_participants', t.participants, 'week', t.week
+           )::text
+    FROM chunk c, t
+    RETURNING character_id
+),
+stats AS (
+    INSERT INTO character_stats (character_id, unread_notifications)
+    SELECT character_id, COUNT(*) FROM notes GROUP BY character_id
+    ON CONFLICT (character_id) DO UPDATE
+    SET unread_notifications = character_stats.unread_notifications + EXCLUDED.unread_notifications
+),
+checkpoint AS (
+    UPDATE tournaments SET results_sent_through = (SELECT MAX(rank) FROM chunk)
+    WHERE id = %(tid)s AND EXISTS (SELECT 1 FROM chunk)
+)
+SELECT COUNT(*) AS sent, MAX(rank) AS through FROM chunk
+"""
+
+def freeze_tournament(conn, tournament_id):
+    """Последний пересчёт и перевод в closing; у закрываемого турнира очки больше не меняются."""
+    cur = conn.cursor()
+    cur.execute("SELECT status FROM tournaments WHERE id = %s FOR UPDATE", (tournament_id,))
+    row = cur.fetchone()
+    if row and row['status'] == 'active':
+        recalc_tournament_scores(cur, tournament_id)
         cur.execute(
-            "SELECT COUNT(*) as cnt FROM training_visits WHERE character_id = %s AND visit_date >= %s AND visit_date <= %s",
-            (cid, ws, t['week_end'])
+            "UPDATE tournaments SET status = 'closing', "
+            "participants = (SELECT COUNT(*) FROM tournament_entries WHERE tournament_id = %s) WHERE id = %s",
+            (tournament_id, tournament_id)
         )
-        trainings = cur.fetchone()['cnt']
+    conn.commit()
 
-        total = games * 10 + tricks * 25 + trainings * 30
+def close_weekly_tournament(conn, tournament_id, chunk_size=WEEKLY_RESULTS_CHUNK, deadline=None, progress=None):
+    """Замораживает итоги и рассылает их пачками с чекпоинтом.
+
+    deadline (time.monotonic()) ограничивает время одного вызова: незаконченный
+    турнир остаётся в closing и дорассылается следующим запуском. progress
+    получает метрики после каждой пачки.
+    """
+    started = time.monotonic()
+    freeze_tournament(conn, tournament_id)
+    cur = conn.cursor()
+    cur.execute("SELECT participants, results_sent_through FROM tournaments WHERE id = %s", (tournament_id,))
+    row = cur.fetchone()
+    conn.commit()
+    metrics = {
+        'tournament_id': tournament_id, 'participants': row['participants'] or 0,
+        'resumed_from': row['results_sent_through'], 'sent': 0, 'chunks': 0, 'status': 'closing',
+    }
+    while deadline is None or time.monotonic() < deadline:
+        cur.execute(WEEKLY_RESULTS_CHUNK_SQL, {'tid': tournament_id, 'chunk': chunk_size})
+        chunk = cur.fetchone()
+        conn.commit()
+        if not chunk['sent']:
+            cur.execute(
+                "UPDATE tournaments SET status = 'closed', closed_at = NOW() WHERE id = %s AND status = 'closing'",
+                (tournament_id,)
+            )
+            conn.commit()
+            metrics['status'] = 'closed'
+            break
+        metrics['sent'] += chunk['sent']
+        metrics['chunks'] += 1
+        metrics['through'] = chunk['through']
+        if progress:
+            elapsed = time.monotonic() - started
+            progress({**metrics, 'elapsed_s': round(elapsed, 3), 'per_second': round(metrics['sent'] / elapsed, 1)})
+    elapsed = time.monotonic() - started
+    metrics['elapsed_s'] = round(elapsed, 3)
+    metrics['per_second'] = round(metrics['sent'] / elapsed, 1) if elapsed else 0
+    return metrics
+
+def close_weekly_tournaments(conn, chunk_size=WEEKLY_RESULTS_CHUNK, deadline=None, progress=None):
+    """Закрывает все прошедшие недели, которые ещё не закрыты, от старых к новым."""
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM tournaments WHERE status <> 'closed' AND week_end < CURRENT_DATE ORDER BY week_start")
+    ids = [r['id'] for r in cur.fetchall()]
+    conn.commit()
+    results = []
+    for tid in ids:
+        results.append(close_weekly_tournament(conn, tid, chunk_size, deadline, progress))
+        if results[-1]['status'] != 'closed':
+            break
+    return results
+
+LEADERBOARD_MAX_LIMIT = 200
+
+# Месячные суммы пересчитываются только для участников изменившегося турнира;
+# строки без изменений не переписываются. Участники соединяются явно, а не
+# через IN (…): коррелированный подзапрос выполнялся на каждую строку месяца.
+REFRESH_MONTHLY_SQL = """
+WITH t AS (
+    SELECT id, month_key, to_date(month_key || '-01', 'YYYY-MM-DD') AS month_start
+    FROM tournaments WHERE id = %(tid)s
+),
+sums AS (
+    SELECT te.character_id, t.month_start,
+           SUM(te.score) AS total_score, SUM(te.games_score) AS games_score,
+           SUM(te.tricks_score) AS tricks_score, SUM(te.training_score) AS training_score
+    FROM t
+    JOIN tournament_entries e ON e.tournament_id = t.id
+    JOIN tournament_entries te ON te.character_id = e.character_id
+    JOIN tournaments mt ON mt.id = te.tournament_id AND mt.month_key = t.month_key
+    GROUP BY te.character_id, t.month_start
+)
+INSERT INTO monthly_leaderboards (character_id, month_start, total_score, games_score, tricks_score, training_score)
+SELECT character_id, month_start, total_score, games_score, tricks_score, training_score FROM sums
+ON CONFLICT (character_id, month_start) DO UPDATE SET
+    total_score = EXCLUDED.total_score, games_score = EXCLUDED.games_score,
+    tricks_score = EXCLUDED.tricks_score, training_score = EXCLUDED.training_score, updated_at = NOW()
+WHERE (monthly_leaderboards.total_score, monthly_leaderboards.games_score,
+       monthly_leaderboards.tricks_score, monthly_leaderboards.training_score)
+      IS DISTINCT FROM (EXCLUDED.total_score, EXCLUDED.games_score, EXCLUDED.tricks_score, EXCLUDED.training_score)
+RETURNING month_start
+"""
+
+RERANK_MONTHLY_SQL = """
+UPDATE monthly_leaderboards ml SET rank = r.rank
+FROM (
+    SELECT id, ROW_NUMBER() OVER (ORDER BY total_score DESC, character_id) AS rank
+    FROM monthly_leaderboards WHERE month_start = %(month_start)s
+) r
+WHERE ml.id = r.id AND ml.month_start = %(month_start)s AND ml.rank IS DISTINCT FROM r.rank
+"""
+
+def refresh_monthly_leaderboard(cur, tournament_id):
+    cur.execute(REFRESH_MONTHLY_SQL, {'tid': tournament_id})
+    changed = cur.fetchall()
+    if changed:
+        cur.execute(RERANK_MONTHLY_SQL, {'month_start': changed[0]['month_start']})
+    return len(changed)
+
+# Турнир недели выбирается подзапросом, а не соединением: так условие
+# te.tournament_id = … попадает в индекс (tournament_id, rank) и первые
+# места читаются по индексу без сортировки всей таблицы недели.
+def weekly_leaderboard(cur, week_start, limit, character_id=None):
+    cur.execute(
+        "SELECT te.*, c.name as character_name, c.avatar_url, c.sport_type, c.level "
+        "FROM tournament_entries te "
+        "JOIN characters c ON te.character_id = c.id "
+        "WHERE te.tournament_id = (SELECT id FROM tournaments WHERE week_start = %s) "
+        "ORDER BY te.rank LIMIT %s",
+        (week_start, limit)
+    )
+    entries = cur.fetchall()
+    me = None
+    if character_id:
         cur.execute(
-            "UPDATE tournament_entries SET games_score=%s, tricks_score=%s, training_score=%s, score=%s WHERE id=%s",
-            (games * 10, tricks * 25, trainings * 30, total, entry['id'])
+            "SELECT te.*, c.name as character_name, c.avatar_url, c.sport_type, c.level "
+            "FROM tournament_entries te "
+            "JOIN characters c ON te.character_id = c.id "
+            "WHERE te.tournament_id = (SELECT id FROM tournaments WHERE week_start = %s) "
+            "AND te.character_id = %s",
+            (week_start, character_id)
         )
+        me = cur.fetchone()
+    return entries, me
+
+def monthly_leaderboard(cur, month_start, limit, character_id=None):
+    query = (
+        "SELECT ml.character_id, c.name as character_name, c.avatar_url, c.sport_type, c.level, "
+        "ml.total_score as score, ml.games_score, ml.tricks_score, ml.training_score, ml.rank "
+        "FROM monthly_leaderboards ml JOIN characters c ON ml.character_id = c.id "
+        "WHERE ml.month_start = %s "
+    )
+    cur.execute(query + "ORDER BY ml.rank LIMIT %s", (month_start, limit))
+    entries = cur.fetchall()
+    me = None
+    if character_id:
+        cur.execute(query + "AND ml.character_id = %s", (month_start, character_id))
+        me = cur.fetchone()
+    return entries, me
 
+def bump_character_stats(cur, character_id, tricks=0, trainings=0, achievements=0):
     cur.execute(
-        "SELECT id FROM tournament_entries WHERE tournament_id = %s ORDER BY score DESC",
-        (tournament_id,)
+        "INSERT INTO character_stats (character_id, tricks_count, trainings_count, achievements_count) "
+        "VALUES (%s, %s, %s, %s) ON CONFLICT (character_id) DO UPDATE SET "
+        "tricks_count = character_stats.tricks_count + EXCLUDED.tricks_count, "
+        "trainings_count = character_stats.trainings_count + EXCLUDED.trainings_count, "
+        "achievements_count = character_stats.achievements_count + EXCLUDED.achievements_count, "
+        "updated_at = NOW() RETURNING *",
+        (character_id, tricks, trainings, achievements)
     )
-    rows = cur.fetchall()
-    for i, row in enumerate(rows):
-        cur.execute("UPDATE tournament_entries SET rank = %s WHERE id = %s", (i + 1, row['id']))
+    return cur.fetchone()
+
+STATS_DRIFT_MAX_LIMIT = 1000
+STATS_REPAIR_BATCH = int(os.environ.get('STATS_REPAIR_BATCH', '1000'))
+
+# Фактические значения счётчиков, пересчитанные по исходным таблицам;
+# after/batch ограничивают персонажей диапазоном id для ремонта пачками
+STATS_ACTUAL_SQL = """
+actual AS (
+    SELECT c.id AS character_id,
+           (SELECT COUNT(*) FROM character_tricks ct WHERE ct.character_id = c.id) AS tricks_count,
+           (SELECT COUNT(*) FROM training_visits tv WHERE tv.character_id = c.id) AS trainings_count,
+           (SELECT COUNT(*) FROM character_achievements ca WHERE ca.character_id = c.id) AS achievements_count,
+           (SELECT COUNT(*) FROM character_notifications n
+            WHERE n.character_id = c.id AND n.is_read = false) AS unread_notifications
+    FROM characters c
+    WHERE (%(cid)s::int IS NULL OR c.id = %(cid)s::int) AND c.id > %(after)s
+    ORDER BY c.id
+    LIMIT %(batch)s
+)
+"""
+
+def find_stats_drift(cur, character_id=None, limit=100):
+    cur.execute(
+        "WITH " + STATS_ACTUAL_SQL +
+        "SELECT a.character_id, "
+        "a.tricks_count, s.tricks_count AS stored_tricks_count, "
+        "a.trainings_count, s.trainings_count AS stored_trainings_count, "
+        "a.achievements_count, s.achievements_count AS stored_achievements_count, "
+        "a.unread_notifications, s.unread_notifications AS stored_unread_notifications "
+        "FROM actual a LEFT JOIN character_stats s ON s.character_id = a.character_id "
+        "WHERE s.character_id IS NULL "
+        "OR (s.tricks_count, s.trainings_count, s.achievements_count, s.unread_notifications) "
+        "IS DISTINCT FROM (a.tricks_count::int, a.trainings_count::int, a.achievements_count::int, "
+        "a.unread_notifications::int) "
+        "ORDER BY a.character_id LIMIT %(limit)s",
+        {'cid': character_id, 'after': 0, 'batch': None, 'limit': limit}
+    )
+    return cur.fetchall()
 
-def check_achievements(cur, character_id):
-    cur.execute("SELECT * FROM characters WHERE id = %s", (character_id,))
-    char = cur.fetchone()
-    if not char:
+def repair_character_stats(cur, character_id=None, after_id=0, batch_size=None):
+    """Переписывает разошедшиеся счётчики персонажей с id > after_id, не больше batch_size за вызов.
+
+    Возвращает число исправленных строк и последний просмотренный id (None — персонажи кончились).
+    """
+    cur.execute(
+        "WITH " + STATS_ACTUAL_SQL + ", repaired AS ("
+        "INSERT INTO character_stats (character_id, tricks_count, trainings_count, achievements_count, unread_notifications) "
+        "SELECT character_id, tricks_count, trainings_count, achievements_count, unread_notifications FROM actual "
+        "ON CONFLICT (character_id) DO UPDATE SET "
+        "tricks_count = EXCLUDED.tricks_count, trainings_count = EXCLUDED.trainings_count, "
+        "achievements_count = EXCLUDED.achievements_count, "
+        "unread_notifications = EXCLUDED.unread_notifications, updated_at = NOW() "
+        "WHERE (character_stats.tricks_count, character_stats.trainings_count, "
+        "character_stats.achievements_count, character_stats.unread_notifications) "
+        "IS DISTINCT FROM (EXCLUDED.tricks_count, EXCLUDED.trainings_count, "
+        "EXCLUDED.achievements_count, EXCLUDED.unread_notifications) "
+        "RETURNING 1) "
+        "SELECT (SELECT COUNT(*) FROM repaired) AS repaired, (SELECT MAX(character_id) FROM actual) AS last_id",
+        {'cid': character_id, 'after': after_id, 'batch': batch_size}
+    )
+    return cur.fetchone()
+
+def achievement_index(cur):
+    """Достижения, сгруппированные по requirement_type и отсортированные по порогу."""
+    entry = catalog_cache.get(cur, 'achievements', 'all', load_achievements)
+    if 'index' not in entry:
+        index = {}
+        for ach in entry['rows']:
+            index.setdefault(ach['requirement_type'], []).append(ach)
+        for items in index.values():
+            items.sort(key=lambda a: a['requirement_value'])
+        entry['index'] = index
+    return entry['index']
+
+def crossed_achievements(index, events):
+    """events — {requirement_type: (было, стало)}; возвращает достижения с порогом в (было, стало]."""
+    crossed = []
+    for rtype, (old, new) in events.items():
+        items = index.get(rtype, [])
+        thresholds = [a['requirement_value'] for a in items]
+        lo = bisect_right(thresholds, old)
+        hi = bisect_right(thresholds, new)
+        crossed.extend(items[lo:hi])
+    return crossed
+
+# Выдача достижений, начисление наград, записи в историю и уведомления —
+# одним запросом с data-modifying CTE.
+AWARD_ACHIEVEMENTS_SQL = """
+WITH awarded AS (
+    INSERT INTO character_achievements (character_id, achievement_id)
+    SELECT %(cid)s, unnest(%(ids)s::int[])
+    ON CONFLICT (character_id, achievement_id) DO NOTHING
+    RETURNING achievement_id
+),
+won AS (
+    SELECT a.id, a.name, a.description, a.reward_kinetics
+    FROM achievements a JOIN awarded w ON w.achievement_id = a.id
+),
+entries AS (
+    SELECT %(cid)s::int AS character_id, reward_kinetics AS amount, 'achievement'::text AS source,
+           'Достижение: ' || name AS description, NULL::text AS created_by, id AS ord
+    FROM won WHERE reward_kinetics > 0
+),
+""" + ledger_ctes() + """,
+notes AS (
+    INSERT INTO character_notifications (character_id, title, message, notification_type)
+    SELECT %(cid)s, 'Достижение: ' || name || '!',
+           description || '. Награда: +' || reward_kinetics || ' кинетиков', 'achievement'
+    FROM won
+),
+stats AS (
+    INSERT INTO character_stats (character_id, achievements_count, unread_notifications)
+    SELECT %(cid)s, COUNT(*), COUNT(*) FROM awarded HAVING COUNT(*) > 0
+    ON CONFLICT (character_id) DO UPDATE
+    SET achievements_count = character_stats.achievements_count + EXCLUDED.achievements_count,
+        unread_notifications = character_stats.unread_notifications + EXCLUDED.unread_notifications,
+        updated_at = NOW()
+)
+SELECT id FROM won
+"""
+
+def check_achievements(cur, character_id, events=None):
+    """Проверяет только пороги, пересечённые событиями.
+
+    Без events пересчитывает всё с нуля по текущим показателям персонажа.
+    """
+    if events is None:
+        cur.execute(
+            "SELECT c.level, c.games_won, "
+            "(SELECT COUNT(*) FROM character_tricks ct WHERE ct.character_id = c.id) AS tricks_count "
+            "FROM characters c WHERE c.id = %s",
+            (character_id,)
+        )
+        char = cur.fetchone()
+        if not char:
+            return []
+        events = {
+            'character_created': (0, 1),
+            'tricks_count': (0, char['tricks_count']),
+            'level': (0, char['level']),
+            'games_won': (0, char['games_won']),
+        }
+    candidates = crossed_achievements(achievement_index(cur), events)
+    if not candidates:
         return []
-    cur.execute("SELECT achievement_id FROM character_achievements WHERE character_id = %s", (character_id,))
-    earned_ids = {r['achievement_id'] for r in cur.fetchall()}
-    cur.execute("SELECT * FROM achievements ORDER BY id")
-    all_achievements = cur.fetchall()
-    cur.execute("SELECT COUNT(*) as cnt FROM character_tricks WHERE character_id = %s", (character_id,))
-    tricks_count = cur.fetchone()['cnt']
-
-    newly_earned = []
-    for ach in all_achievements:
-        if ach['id'] in earned_ids:
-            continue
-        met = False
-        if ach['requirement_type'] == 'character_created':
-            met = True
-        elif ach['requirement_type'] == 'tricks_count':
-            met = tricks_count >= ach['requirement_value']
-        elif ach['requirement_type'] == 'level':
-            met = char['level'] >= ach['requirement_value']
-        elif ach['requirement_type'] == 'games_won':
-            met = char.get('games_won', 0) >= ach['requirement_value']
-        if met:
+    cur.execute(AWARD_ACHIEVEMENTS_SQL, {'cid': character_id, 'ids': [a['id'] for a in candidates]})
+    won_ids = {r['id'] for r in cur.fetchall()}
+    return sorted((a for a in candidates if a['id'] in won_ids), key=lambda a: a['id'])
+
+# Все пары (персонаж, трюк) проверяются по справочнику и вставляются одним
+# INSERT; наружу возвращаются суммы наград по каждому персонажу. Внешнего ключа
+# на characters у character_tricks нет, поэтому неизвестные персонажи
+# отсекаются соединением и остаются без наград.
+CONFIRM_TRICKS_SQL = """
+WITH pairs AS (
+    SELECT DISTINCT p.character_id, p.trick_id
+    FROM unnest(%(character_ids)s::int[], %(trick_ids)s::int[]) AS p(character_id, trick_id)
+    JOIN characters c ON c.id = p.character_id
+),
+resolved AS (
+    SELECT id FROM tricks WHERE id = ANY(%(trick_ids)s::int[])
+),
+inserted AS (
+    INSERT INTO character_tricks (character_id, trick_id, confirmed_by)
+    SELECT p.character_id, p.trick_id, %(confirmed_by)s
+    FROM pairs p JOIN resolved r ON r.id = p.trick_id
+    ON CONFLICT (character_id, trick_id) DO NOTHING
+    RETURNING character_id, trick_id
+)
+SELECT i.character_id, COUNT(*) AS new_tricks,
+       SUM(t.experience_reward) AS total_exp, SUM(t.kinetics_reward) AS total_kin
+FROM inserted i JOIN tricks t ON t.id = i.trick_id
+GROUP BY i.character_id
+"""
+
+CONFIRM_TRICKS_REWARD_SQL = """
+WITH d(character_id, xp, amount, description, created_by) AS (VALUES %s),
+entries AS (
+    SELECT character_id, amount, 'tricks'::text AS source, description, created_by, 1 AS ord, xp FROM d
+),
+""" + ledger_ctes(extra_set=LEDGER_XP_SET, sums=('xp',), returning=', prev.level AS prev_level') + """
+SELECT * FROM moved
+"""
+
+def confirm_tricks_batch(cur, sessions, confirmed_by=''):
+    """sessions — [{character_id, trick_ids}]; результат по каждому персонажу в порядке первого упоминания."""
+    requested = {}
+    for session in sessions:
+        requested.setdefault(session['character_id'], []).extend(session['trick_ids'])
+    char_ids = list(requested)
+    pair_chars = [cid for cid, tids in requested.items() for _ in tids]
+    pair_tricks = [tid for tids in requested.values() for tid in tids]
+
+    cur.execute(CONFIRM_TRICKS_SQL, {
+        'character_ids': pair_chars, 'trick_ids': pair_tricks, 'confirmed_by': confirmed_by
+    })
+    gained = {r['character_id']: r for r in cur.fetchall()}
+
+    tricks_counts = {}
+    if gained:
+        rows = execute_values(
+            cur,
+            "INSERT INTO character_stats (character_id, tricks_count) VALUES %s "
+            "ON CONFLICT (character_id) DO UPDATE SET "
+            "tricks_count = character_stats.tricks_count + EXCLUDED.tricks_count, updated_at = NOW() "
+            "RETURNING character_id, tricks_count",
+            [(cid, g['new_tricks']) for cid, g in gained.items()], fetch=True
+        )
+        tricks_counts = {r['character_id']: r['tricks_count'] for r in rows}
+
+    rewarded = [(cid, g['total_exp'], g['total_kin']) for cid, g in gained.items() if g['total_exp'] > 0 or g['total_kin'] > 0]
+    chars = {}
+    prev_levels = {}
+    if rewarded:
+        rows = execute_values(
+            cur,
+            CONFIRM_TRICKS_REWARD_SQL,
+            [(cid, exp, kin, f'Подтверждено {len(requested[cid])} трюков', confirmed_by) for cid, exp, kin in rewarded],
+            template='(%s::int, %s::int, %s::int, %s::text, %s::text)', fetch=True
+        )
+        for row in rows:
+            prev_levels[row['id']] = row.pop('prev_level')
+            chars[row['id']] = row
+        create_notifications(cur, [
+            (cid, f'Подтверждено {len(requested[cid])} трюков!', f'+{exp} XP, +{kin} кинетиков', 'tricks', None)
+            for cid, exp, kin in rewarded if cid in chars
+        ])
+    completed = {}
+    for cid, row in advance_quests(cur, [(cid, 'tricks_daily', g['new_tricks']) for cid, g in gained.items()]).items():
+        prev_levels.setdefault(cid, row.pop('prev_level'))
+        completed[cid] = row.pop('completed_quests')
+        chars[cid] = row
+    missing = [cid for cid in char_ids if cid not in chars]
+    if missing:
+        cur.execute("SELECT * FROM characters WHERE id = ANY(%s::int[])", (missing,))
+        chars.update({r['id']: r for r in cur.fetchall()})
+
+    results = []
+    for cid in char_ids:
+        g = gained.get(cid)
+        events = {}
+        if g:
+            events['tricks_count'] = (tricks_counts[cid] - g['new_tricks'], tricks_counts[cid])
+        if cid in prev_levels:
+            events['level'] = (prev_levels[cid], chars[cid]['level'])
+        results.append({
+            'character_id': cid,
+            'character': chars.get(cid),
+            'total_exp': g['total_exp'] if g else 0,
+            'total_kinetics': g['total_kin'] if g else 0,
+            'completed_quests': completed.get(cid, []),
+            'new_achievements': check_achievements(cur, cid, events),
+        })
+    return results
+
+
+# === Ежедневные задания ===
+#
+# Набор заданий дня выбирается один раз (отметка в quest_assignments) и
+# раздаётся всем персонажам одним INSERT ... SELECT. События игр, трюков и
+# тренировок продвигают задания upsert-приращением; награда за выполнение
+# проводится через ledger_ctes() в том же операторе, уведомления о ней —
+# через create_notifications().
+
+QUESTS_PER_DAY = 3
+# Типы заданий, которые продвигаются событиями API
+QUEST_TYPES = ('games_daily', 'wins_daily', 'tricks_daily', 'training_daily')
+
+# Задания дня: из отметки, а до раздачи — тот же детерминированный выбор
+DAY_QUEST_IDS = """
+COALESCE(
+    (SELECT quest_ids FROM quest_assignments WHERE quest_date = %(day)s),
+    ARRAY(
+        SELECT id FROM daily_quests WHERE is_active AND quest_type = ANY(%(quest_types)s)
+        ORDER BY md5(id || ':' || %(day)s::text) LIMIT %(per_day)s
+    )
+)"""
+
+ASSIGN_DAILY_QUESTS_SQL = """
+WITH marker AS (
+    INSERT INTO quest_assignments (quest_date, quest_ids)
+    SELECT %(day)s, """ + DAY_QUEST_IDS + """
+    ON CONFLICT (quest_date) DO NOTHING
+    RETURNING quest_date, quest_ids
+),
+assigned AS (
+    INSERT INTO character_quests (character_id, quest_id, quest_date)
+    SELECT c.id, q.quest_id, m.quest_date
+    FROM marker m CROSS JOIN unnest(m.quest_ids) AS q(quest_id) CROSS JOIN characters c
+    ON CONFLICT (character_id, quest_id, quest_date) DO NOTHING
+    RETURNING 1
+)
+SELECT m.quest_date, m.quest_ids, (SELECT COUNT(*) FROM assigned) AS assigned FROM marker m
+"""
+
+# Персонаж, созданный после раздачи, получает задания дня сразу
+ASSIGN_CHARACTER_QUESTS_SQL = """
+INSERT INTO character_quests (character_id, quest_id, quest_date)
+SELECT %(cid)s, unnest(quest_ids), quest_date FROM quest_assignments WHERE quest_date = %(day)s
+ON CONFLICT (character_id, quest_id, quest_date) DO NOTHING
+"""
+
+QUEST_PROGRESS_SQL = """
+WITH events AS (
+    SELECT character_id, quest_type, SUM(amount) AS amount
+    FROM unnest(%(cids)s::int[], %(types)s::text[], %(amounts)s::int[]) AS e(character_id, quest_type, amount)
+    GROUP BY character_id, quest_type
+),
+day_quests AS (
+    SELECT * FROM daily_quests WHERE id = ANY(""" + DAY_QUEST_IDS + """)
+),
+progressed AS (
+    INSERT INTO character_quests AS cq (character_id, quest_id, progress, completed, quest_date, completed_at)
+    SELECT e.character_id, q.id, LEAST(e.amount, q.requirement_value), e.amount >= q.requirement_value, %(day)s,
+           CASE WHEN e.amount >= q.requirement_value THEN NOW() END
+    FROM events e JOIN day_quests q ON q.quest_type = e.quest_type
+    JOIN characters c ON c.id = e.character_id
+    ON CONFLICT (character_id, quest_id, quest_date) DO UPDATE
+    SET (progress, completed, completed_at) = (
+        SELECT LEAST(cq.progress + EXCLUDED.progress, q.requirement_value),
+               cq.progress + EXCLUDED.progress >= q.requirement_value,
+               CASE WHEN cq.progress + EXCLUDED.progress >= q.requirement_value THEN NOW() END
+        FROM daily_quests q WHERE q.id = cq.quest_id
+    )
+    WHERE NOT cq.completed
+    RETURNING cq.character_id, cq.quest_id, cq.completed
+),
+entries AS (
+    SELECT p.character_id, q.reward_kinetics AS amount, 'quest'::text AS source,
+           'Задание: ' || q.name AS description, NULL::text AS created_by, q.id AS ord,
+           q.reward_experience AS xp, q.name
+    FROM progressed p JOIN day_quests q ON q.id = p.quest_id
+    WHERE p.completed
+),
+""" + ledger_ctes(extra_set=LEDGER_XP_SET, sums=('xp',), returning=', prev.level AS prev_level') + """
+SELECT m.*, (
+    SELECT json_agg(json_build_object(
+        'quest_id', e.ord, 'name', e.name, 'reward_kinetics', e.amount, 'reward_experience', e.xp
+    ) ORDER BY e.ord)
+    FROM entries e WHERE e.character_id = m.id
+) AS completed_quests
+FROM moved m
+"""
+
+# Задания дня с прогрессом: один поиск по (character_id, quest_date)
+CHARACTER_QUESTS_SQL = """
+SELECT cq.quest_id, q.name, q.description, q.quest_type, q.requirement_value, q.reward_kinetics,
+       q.reward_experience, cq.progress, cq.completed, cq.completed_at
+FROM character_quests cq JOIN daily_quests q ON q.id = cq.quest_id
+WHERE cq.character_id = %(cid)s AND cq.quest_date = %(day)s
+ORDER BY cq.quest_id
+"""
+
+def quest_params(day=None):
+    return {'day': day or date.today(), 'quest_types': list(QUEST_TYPES), 'per_day': QUESTS_PER_DAY}
+
+def assign_daily_quests(cur, day=None):
+    """Раздаёт задания дня всем персонажам; повторный вызов за ту же дату ничего не делает."""
+    params = quest_params(day)
+    cur.execute(ASSIGN_DAILY_QUESTS_SQL, params)
+    row = cur.fetchone()
+    if not row:
+        return {'quest_date': params['day'], 'assigned': 0, 'already_assigned': True}
+    return {**row, 'already_assigned': False}
+
+def advance_quests(cur, increments, day=None):
+    """increments — кортежи (character_id, quest_type, amount).
+
+    Возвращает {character_id: строка персонажа} только для тех, кто выполнил
+    задание: в строке prev_level и completed_quests.
+    """
+    increments = [(cid, qtype, amount) for cid, qtype, amount in increments if amount > 0]
+    if not increments:
+        return {}
+    cur.execute(QUEST_PROGRESS_SQL, {
+        **quest_params(day),
+        'cids': [i[0] for i in increments],
+        'types': [i[1] for i in increments],
+        'amounts': [i[2] for i in increments],
+    })
+    rewarded = {row['id']: row for row in cur.fetchall()}
+    create_notifications(cur, [
+        (cid, f"Задание выполнено: {q['name']}!",
+         f"Награда: +{q['reward_kinetics']} кинетиков, +{q['reward_experience']} XP", 'quest', None)
+        for cid, row in rewarded.items() for q in row['completed_quests']
+    ])
+    return rewarded
+
+def character_quests(cur, character_id, day=None):
+    cur.execute(CHARACTER_QUESTS_SQL, {'cid': character_id, 'day': day or date.today()})
+    return cur.fetchall()
+
+
+# === Кланы ===
+#
+# Очки клана за неделю и месяц лежат в clan_scores и растут триггером на
+# tournament_entries (V0021), поэтому таблица кланов — упорядоченное чтение
+# по индексу. При вступлении и выходе очки участника в активном турнире
+# переходят вместе с ним; прошедшие недели остаются за кланом, где набраны.
+
+CLAN_MAX_MEMBERS = 5000
+CLAN_LEADERBOARD_MAX_LIMIT = 100
+CLAN_MEMBERS_PAGE_SIZE = 100
+
+# Клан создаётся только для существующего персонажа вне клана; занятое имя —
+# пустой результат, вызывающий код выясняет причину.
+CREATE_CLAN_SQL = """
+WITH clan AS (
+    INSERT INTO clans (name, description, leader_character_id, max_members, member_count)
+    SELECT %(name)s, %(description)s, c.id, %(max_members)s, 1
+    FROM characters c
+    WHERE c.id = %(cid)s AND NOT EXISTS (SELECT 1 FROM clan_members WHERE character_id = c.id)
+    ON CONFLICT (name) DO NOTHING
+    RETURNING *
+),
+member AS (
+    INSERT INTO clan_members (clan_id, character_id, role)
+    SELECT id, leader_character_id, 'leader' FROM clan
+    ON CONFLICT (character_id) DO NOTHING
+    RETURNING *
+)
+SELECT cl.*, (SELECT row_to_json(m) FROM member m) AS member
+FROM (SELECT 1) one LEFT JOIN clan cl ON true
+"""
+
+# Лимит проверяется условным UPDATE; если персонаж уже в клане или его нет,
+# место занято зря — вызывающий код откатывает транзакцию.
+JOIN_CLAN_SQL = """
+WITH clan AS (
+    UPDATE clans SET member_count = member_count + 1
+    WHERE id = %(clan)s AND member_count < max_members
+    RETURNING *
+),
+member AS (
+    INSERT INTO clan_members (clan_id, character_id)
+    SELECT clan.id, c.id FROM clan, characters c WHERE c.id = %(cid)s
+    ON CONFLICT (character_id) DO NOTHING
+    RETURNING *
+)
+SELECT cl.*, (SELECT row_to_json(m) FROM member m) AS member
+FROM (SELECT 1) one LEFT JOIN clan cl ON true
+"""
+
+LEAVE_CLAN_SQL = """
+WITH member AS (
+    DELETE FROM clan_members WHERE character_id = %(cid)s RETURNING *
+)
+UPDATE clans c SET member_count = c.member_count - 1
+FROM member m WHERE c.id = m.clan_id
+RETURNING c.*, m.role AS member_role
+"""
+
+# Лидером становится самый давний участник
+PROMOTE_CLAN_LEADER_SQL = """
+WITH heir AS (
+    SELECT id, character_id FROM clan_members WHERE clan_id = %(clan)s ORDER BY joined_at, id LIMIT 1
+),
+promoted AS (
+    UPDATE clan_members cm SET role = 'leader' FROM heir WHERE cm.id = heir.id RETURNING cm.character_id
+)
+UPDATE clans c SET leader_character_id = p.character_id
+FROM promoted p WHERE c.id = %(clan)s
+RETURNING c.*
+"""
+
+DELETE_EMPTY_CLAN_SQL = """
+WITH clan AS (
+    DELETE FROM clans WHERE id = %(clan)s AND member_count = 0 RETURNING id
+)
+DELETE FROM clan_scores WHERE clan_id IN (SELECT id FROM clan)
+"""
+
+# Очки участника в активных турнирах переходят к клану (sign = 1) или уходят
+# из него (sign = -1) по текущему членству. Строка участника блокируется:
+# параллельный пересчёт либо уже учтён триггером, либо дождётся коммита и
+# увидит новое членство.
+MOVE_CLAN_SCORES_SQL = """
+SELECT add_clan_scores(array_agg(tournament_id), array_agg(character_id), array_agg(%(sign)s * score))
+FROM (
+    SELECT te.tournament_id, te.character_id, te.score
+    FROM tournament_entries te JOIN tournaments t ON t.id = te.tournament_id
+    WHERE te.character_id = %(cid)s AND t.status = 'active'
+    FOR NO KEY UPDATE OF te
+) e
+"""
+
+CLAN_LEADERBOARD_SQL = """
+SELECT cs.clan_id, c.name, c.member_count, c.leader_character_id, cs.score,
+       ROW_NUMBER() OVER (ORDER BY cs.score DESC, cs.clan_id) AS rank
+FROM clan_scores cs JOIN clans c ON c.id = cs.clan_id
+WHERE cs.period = %(period)s AND cs.period_start = %(start)s
+ORDER BY cs.score DESC, cs.clan_id
+LIMIT %(limit)s
+"""
+
+# Место одного клана: подсчёт по тому же индексу, без обхода всей таблицы
+CLAN_RANK_SQL = """
+SELECT cs.clan_id, c.name, c.member_count, c.leader_character_id, cs.score,
+       1 + (
+           SELECT COUNT(*) FROM clan_scores o
+           WHERE o.period = cs.period AND o.period_start = cs.period_start
+             AND (o.score > cs.score OR (o.score = cs.score AND o.clan_id < cs.clan_id))
+       ) AS rank
+FROM clan_scores cs JOIN clans c ON c.id = cs.clan_id
+WHERE cs.period = %(period)s AND cs.period_start = %(start)s AND cs.clan_id = %(clan)s
+"""
+
+CLAN_MEMBERS_SQL = """
+SELECT cm.id, cm.character_id, cm.role, cm.joined_at, c.name, c.avatar_url, c.sport_type, c.level,
+       COALESCE(te.score, 0) AS week_score
+FROM clan_members cm
+JOIN characters c ON c.id = cm.character_id
+LEFT JOIN tournaments t ON t.week_start = %(monday)s
+LEFT JOIN tournament_entries te ON te.tournament_id = t.id AND te.character_id = cm.character_id
+WHERE cm.clan_id = %(clan)s AND cm.id > %(after)s
+ORDER BY cm.id
+LIMIT %(limit)s
+"""
+
+def clan_periods():
+    monday, _ = get_current_week()
+    return {'weekly': monday, 'monthly': date.today().replace(day=1)}
+
+def move_clan_scores(cur, character_id, sign):
+    cur.execute(MOVE_CLAN_SCORES_SQL, {'cid': character_id, 'sign': sign})
+
+def clan_leaderboard(cur, period, limit, clan_id=None):
+    start = clan_periods()[period]
+    cur.execute(CLAN_LEADERBOARD_SQL, {'period': period, 'start': start, 'limit': limit})
+    entries = cur.fetchall()
+    mine = None
+    if clan_id:
+        cur.execute(CLAN_RANK_SQL, {'period': period, 'start': start, 'clan': clan_id})
+        mine = cur.fetchone()
+    return entries, mine
+
+def leave_clan(cur, character_id):
+    """Выход из клана: очки активной недели уходят с участником, лидерство переходит, пустой клан удаляется."""
+    move_clan_scores(cur, character_id, -1)
+    cur.execute(LEAVE_CLAN_SQL, {'cid': character_id})
+    clan = cur.fetchone()
+    if not clan:
+        return None
+    role = clan.pop('member_role')
+    if clan['member_count'] == 0:
+        cur.execute(DELETE_EMPTY_CLAN_SQL, {'clan': clan['id']})
+    elif role == 'leader':
+        cur.execute(PROMOTE_CLAN_LEADER_SQL, {'clan': clan['id']})
+        clan = cur.fetchone() or clan
+    return clan
+
+
+# === Каталог персонажей ===
+
+DIRECTORY_PAGE_SIZE = 100
+DIRECTORY_MAX_PAGE_SIZE = 500
+EXPORT_ITERSIZE = 2000
+
+# Только колонки списка: каталог не тянет широкие строки целиком
+DIRECTORY_COLUMNS = (
+    'id', 'user_id', 'name', 'sport_type', 'sport_types', 'riding_style', 'level', 'experience',
+    'kinetics', 'games_played', 'games_won', 'avatar_url', 'trainer_name', 'age',
+)
+
+DIRECTORY_SQL = (
+    "SELECT " + ', '.join(DIRECTORY_COLUMNS) + " FROM characters "
+    "WHERE (%(sport)s::text IS NULL OR sport_types @> ARRAY[%(sport)s::text]) "
+    "AND (%(trainer)s::text IS NULL OR trainer_name = %(trainer)s::text) "
+    "AND (%(level)s::int IS NULL OR (level, experience, id) < (%(level)s::int, %(experience)s::int, %(id)s::int)) "
+    "ORDER BY level DESC, experience DESC, id DESC"
+)
+
+def parse_directory_cursor(cursor):
+    """Курсор «level:experience:id» → кортеж или None."""
+    try:
+        level, experience, cid = (int(part) for part in cursor.split(':'))
+    except (AttributeError, ValueError):
+        return None
+    return level, experience, cid
+
+def directory_params(sport_type=None, trainer=None, cursor=None):
+    after = parse_directory_cursor(cursor) or (None, None, None)
+    return {
+        'sport': sport_type or None, 'trainer': trainer or None,
+        'level': after[0], 'experience': after[1], 'id': after[2],
+    }
+
+def directory_page(cur, sport_type=None, trainer=None, cursor=None, limit=DIRECTORY_PAGE_SIZE):
+    """Страница каталога от сильных к слабым; next_cursor = None на последней странице."""
+    cur.execute(DIRECTORY_SQL + " LIMIT %(limit)s", {**directory_params(sport_type, trainer, cursor), 'limit': limit + 1})
+    rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = f"{last['level']}:{last['experience']}:{last['id']}"
+    return rows, next_cursor
+
+def export_characters(conn, sport_type=None, trainer=None, itersize=EXPORT_ITERSIZE):
+    """NDJSON-строки каталога через серверный курсор: в памяти держится одна пачка строк.
+
+    HTTP-маршрута нет: ответ функции собирается целиком, выгрузка — tools/export_characters.py.
+    """
+    with conn.cursor(name='export_characters') as cur:
+        cur.itersize = itersize
+        cur.execute(DIRECTORY_SQL, directory_params(sport_type, trainer))
+        for row in cur:
+            yield json.dumps(row, default=str, ensure_ascii=False) + '\n'
+    conn.rollback()
+
+
+CHANGES_TIMEOUT = 20.0
+CHANGES_MAX_TIMEOUT = 25.0
+CHANGES_MAX_ROWS = 100
+
+
+class ChangeFeed:
+    """LISTEN/NOTIFY-слушатель: одно соединение на инстанс.
+
+    Ожидающие long-poll запросы не держат соединений пула — они спят на
+    Condition, пока фоновый поток не получит подходящее уведомление.
+    """
+
+    def __init__(self, channels, backlog=1000):
+        self.channels = channels
+        self._events = deque(maxlen=backlog)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._conn = None
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            conn = psycopg2.connect(os.environ['DATABASE_URL'])
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                for channel in self.channels:
+                    cur.execute(f'LISTEN {channel}')
+            self._conn = conn
+            self._thread = threading.Thread(target=self._run, args=(conn,), daemon=True)
+            self._thread.start()
+
+    def _run(self, conn):
+        try:
+            while True:
+                if select.select([conn], [], [], 5.0)[0]:
+                    conn.poll()
+                    with self._cond:
+                        while conn.notifies:
+                            n = conn.notifies.pop(0)
+                            self._seq += 1
+                            self._events.append((self._seq, n.channel, n.payload))
+                        self._cond.notify_all()
+        except (psycopg2.Error, OSError, ValueError):
+            # соединение потеряно: следующий start() поднимет новое
+            with self._cond:
+                self._conn = None
+                self._cond.notify_all()
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+    def mark(self):
+        with self._cond:
+            return self._seq
+
+    def wait(self, since, match, timeout):
+        """Ждёт уведомление новее since, для которого match(channel, payload) истинно."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if any(seq > since and match(channel, payload) for seq, channel, payload in self._events):
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._conn is None:
+                    return False
+                self._cond.wait(remaining)
+
+
+change_feed = ChangeFeed(['kinetic_notifications', 'kinetic_tournament'])
+
+
+def parse_changes_cursor(cursor):
+    """Курсор «notification_id:tournament_id:version» → кортеж int или None."""
+    try:
+        nid, tid, version = (int(part) for part in cursor.split(':'))
+        return nid, tid, version
+    except (AttributeError, ValueError):
+        return None
+
+
+def load_changes(cur, character_id, cursor):
+    """Изменения после курсора: новые уведомления персонажа и изменившиеся строки текущего турнира."""
+    monday, sunday = get_current_week()
+    cur.execute("SELECT id, version, status FROM tournaments WHERE week_start = %s", (monday,))
+    tournament = cur.fetchone()
+    since = parse_changes_cursor(cursor)
+    notifications, entries = [], []
+    if since is None:
+        # Без курсора отдаём только текущую позицию: начальное состояние клиент берёт обычными запросами
+        cur.execute(
+            "SELECT COALESCE(MAX(id), 0) AS id FROM character_notifications WHERE character_id = %s",
+            (character_id,)
+        )
+        last_id = cur.fetchone()['id']
+    else:
+        last_id = since[0]
+        if character_id:
+            cur.execute(
+                "SELECT * FROM character_notifications WHERE character_id = %s AND id > %s ORDER BY id LIMIT %s",
+                (character_id, last_id, CHANGES_MAX_ROWS)
+            )
+            notifications = cur.fetchall()
+            if notifications:
+                last_id = notifications[-1]['id']
+        if tournament:
+            since_version = since[2] if since[1] == tournament['id'] else -1
             cur.execute(
-                "INSERT INTO character_achievements (character_id, achievement_id) VALUES (%s, %s) ON CONFLICT DO NOTHING RETURNING id",
-                (character_id, ach['id'])
+                "SELECT te.*, c.name as character_name, c.avatar_url, c.sport_type, c.level "
+                "FROM tournament_entries te JOIN characters c ON te.character_id = c.id "
+                "WHERE te.tournament_id = %s AND te.version > %s ORDER BY te.rank NULLS LAST, te.id",
+                (tournament['id'], since_version)
             )
-            inserted = cur.fetchone()
-            if inserted:
-                newly_earned.append(ach)
-                if ach['reward_kinetics'] > 0:
-                    cur.execute("UPDATE characters SET kinetics = kinetics + %s WHERE id = %s", (ach['reward_kinetics'], character_id))
-                    cur.execute(
-                        "INSERT INTO kinetics_transactions (character_id, amount, transaction_type, source, description) "
-                        "VALUES (%s, %s, 'earn', 'achievement', %s)",
-                        (character_id, ach['reward_kinetics'], f'Достижение: {ach["name"]}')
-                    )
-                create_notification(cur, character_id,
-                    f'Достижение: {ach["name"]}!',
-                    f'{ach["description"]}. Награда: +{ach["reward_kinetics"]} кинетиков',
-                    'achievement')
-    return newly_earned
+            entries = cur.fetchall()
+    version = tournament['version'] if tournament else 0
+    tid = tournament['id'] if tournament else 0
+    tournament_changed = since is not None and tournament is not None and (since[1], since[2]) != (tid, version)
+    return {
+        'cursor': f'{last_id}:{tid}:{version}',
+        'changed': since is None or bool(notifications) or tournament_changed,
+        'notifications': notifications,
+        'tournament': tournament,
+        'entries': entries,
+    }
+
+
+ROUTES = {}
+
+
+def route(method, action, db=True):
+    """Регистрирует обработчик действия.
+
+    db=False — маршрут не трогает БД. JSON-тело разбирается у всех не-GET маршрутов.
+    """
+    def register(fn):
+        ROUTES[(method, action)] = {'fn': fn, 'db': db}
+        return fn
+    return register
+
+
+class Request:
+    """Контекст запроса: соединение с БД берётся из пула только при первом обращении."""
+
+    def __init__(self, event, qs, db=True):
+        self.event = event
+        self.qs = qs
+        self.headers = event.get('headers') or {}
+        self.db = db
+        self._body = None
+        self._conn = None
+        self._cur = None
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = json.loads(self.event.get('body') or '{}') or {}
+        return self._body
+
+    @property
+    def conn(self):
+        if not self.db:
+            raise RuntimeError('route is declared with db=False')
+        if self._conn is None:
+            self._conn = get_db()
+        return self._conn
+
+    @property
+    def cur(self):
+        if self._cur is None:
+            self._cur = self.conn.cursor()
+        return self._cur
+
+    def close(self):
+        if self._conn is not None:
+            release_db(self._conn)
+            self._conn = self._cur = None
+
+
+def cached_catalog(req, catalog, variant, loader):
+    """Свежая запись кэша отдаётся без соединения с БД."""
+    return catalog_cache.peek(f'{catalog}:{variant}') or catalog_cache.get(req.cur, catalog, variant, loader)
 
 
 def handler(event, context):
@@ -151,667 +1904,997 @@ def handler(event, context):
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Role',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Role, X-Admin-Token, If-None-Match, If-Modified-Since',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
 
     qs = event.get('queryStringParameters', {}) or {}
-    body = json.loads(event.get('body', '{}') or '{}')
-    action = qs.get('action', body.get('action', ''))
+    req = Request(event, qs)
+    metrics = _current.metrics = RequestMetrics(method, key='action')
+    try:
+        result = dispatch(req, method, metrics)
+    except Exception:
+        log_request(metrics, 500, 0)
+        raise
+    finally:
+        req.close()
+        _current.metrics = None
+    body = result.get('body') or ''
+    log_request(metrics, result['statusCode'], len(body) if result.get('isBase64Encoded') else len(body.encode()))
+    return result
+
+
+def dispatch(req, method, metrics):
+    qs = req.qs
+    try:
+        action = qs.get('action') or (req.body.get('action', '') if method != 'GET' else '')
+        spec = ROUTES.get((method, action))
+        if spec is None:
+            # произвольные action не плодят строк в гистограммах
+            metrics.label = '(unknown)'
+            return resp(404, {'error': 'unknown_action', 'action': action})
+        metrics.label = action
+        req.db = spec['db']
+        if method != 'GET':
+            # тело разбирается до выдачи соединения, битый JSON не занимает пул
+            req.body
+    except ValueError:
+        metrics.label = '(invalid_json)'
+        return resp(400, {'error': 'invalid_json'})
+
+    try:
+        return encode_response(spec['fn'](req), req.headers)
+    except PoolTimeout:
+        return resp(503, {'error': 'db_busy'})
+
+
+def log_request(metrics, status, response_bytes):
+    entry = metrics.finish(status, response_bytes)
+    action_stats.record(entry)
+    log_event('request', **entry)
+
+
+# === Профиль и достижения ===
+#
+# Чтения профиля друг от друга не зависят, поэтому собраны в один оператор:
+# ответ стоит одного обхода до БД, а не суммы задержек нескольких запросов.
+
+PUBLIC_PROFILE_SQL = """
+SELECT c.id, c.user_id, c.name, c.sport_type, c.sport_types, c.riding_style, c.level, c.experience,
+       c.balance, c.speed, c.courage, c.body_type, c.hairstyle, c.hair_color, c.avatar_url, c.kinetics,
+       c.games_won, c.games_played, c.age, c.trainer_name, c.created_at,
+       COALESCE(s.tricks_count, 0) AS tricks_count, COALESCE(s.trainings_count, 0) AS trainings_count,
+       COALESCE(s.achievements_count, 0) AS achievements_count,
+       COALESCE((
+           SELECT json_agg(h) FROM (
+               SELECT te.score, te.rank, t.week_start, t.week_end
+               FROM tournament_entries te JOIN tournaments t ON te.tournament_id = t.id
+               WHERE te.character_id = c.id ORDER BY t.week_start DESC LIMIT 10
+           ) h
+       ), '[]') AS tournament_history
+FROM characters c LEFT JOIN character_stats s ON s.character_id = c.id
+WHERE c.id = %(cid)s
+"""
+
+# Строка есть и для несуществующего персонажа: прогресс тогда нулевой
+ACHIEVEMENT_PROGRESS_SQL = """
+SELECT COALESCE(c.level, 0) AS level, COALESCE(c.games_won, 0) AS games_won,
+       COALESCE(s.tricks_count, 0) AS tricks_count,
+       ARRAY(SELECT achievement_id FROM character_achievements WHERE character_id = k.id ORDER BY achievement_id) AS earned_ids,
+       ARRAY(SELECT earned_at FROM character_achievements WHERE character_id = k.id ORDER BY achievement_id) AS earned_at
+FROM (SELECT %(cid)s::int AS id) k
+LEFT JOIN characters c ON c.id = k.id
+LEFT JOIN character_stats s ON s.character_id = k.id
+"""
+
+
+# === GET ENDPOINTS ===
+
+@route('GET', 'my_character')
+def get_my_character(req):
+    qs = req.qs
+    cur = req.cur
+    uid = qs.get('user_id', '')
+    cur.execute("SELECT * FROM characters WHERE user_id = %s", (uid,))
+    char = cur.fetchone()
+    if not char:
+        return resp(404, {'error': 'not_found'})
+    return resp(200, {'character': char})
 
-    conn = get_db()
-    cur = conn.cursor()
 
-    # === GET ENDPOINTS ===
+@route('GET', 'all_characters')
+def get_all_characters(req):
+    chars, next_cursor = directory_page(req.cur)
+    return resp(200, {'characters': chars, 'next_cursor': next_cursor})
 
-    if method == 'GET' and action == 'my_character':
-        uid = qs.get('user_id', '')
-        cur.execute("SELECT * FROM characters WHERE user_id = %s", (uid,))
-        char = cur.fetchone()
-        conn.close()
-        if not char:
-            return resp(404, {'error': 'not_found'})
-        return resp(200, {'character': char})
 
-    if method == 'GET' and action == 'all_characters':
-        cur.execute("SELECT * FROM characters ORDER BY level DESC, experience DESC LIMIT 100")
-        chars = cur.fetchall()
-        conn.close()
-        return resp(200, {'characters': chars})
+@route('GET', 'directory')
+def get_directory(req):
+    qs = req.qs
+    try:
+        limit = parse_limit(qs.get('limit'), DIRECTORY_PAGE_SIZE, DIRECTORY_MAX_PAGE_SIZE)
+    except ValueError:
+        return resp(400, {'error': 'invalid_limit'})
+    chars, next_cursor = directory_page(req.cur, qs.get('sport_type'), qs.get('trainer'), qs.get('cursor'), limit)
+    return resp(200, {'characters': chars, 'next_cursor': next_cursor})
 
-    if method == 'GET' and action == 'tricks':
-        sport = qs.get('sport_type', '')
-        if sport:
-            cur.execute("SELECT * FROM tricks WHERE sport_type = %s ORDER BY difficulty, id", (sport,))
-        else:
-            cur.execute("SELECT * FROM tricks ORDER BY sport_type, difficulty, id")
-        tricks = cur.fetchall()
-        conn.close()
-        return resp(200, {'tricks': tricks})
 
-    if method == 'GET' and action == 'mastered_tricks':
-        char_id = qs.get('character_id', '')
-        cur.execute(
-            "SELECT ct.*, t.name, t.sport_type, t.category, t.difficulty, t.experience_reward, t.kinetics_reward, t.description "
-            "FROM character_tricks ct JOIN tricks t ON ct.trick_id = t.id "
-            "WHERE ct.character_id = %s", (char_id,)
-        )
-        mastered = cur.fetchall()
-        conn.close()
-        return resp(200, {'mastered_tricks': mastered})
+@route('GET', 'tricks')
+def get_tricks(req):
+    sport = req.qs.get('sport_type', '')
+    entry = cached_catalog(req, 'tricks', sport or 'all', load_tricks(sport))
+    return catalog_resp(entry, 'tricks', req.headers)
 
-    if method == 'GET' and action == 'transactions':
-        char_id = qs.get('character_id', '')
-        cur.execute(
-            "SELECT * FROM kinetics_transactions WHERE character_id = %s ORDER BY created_at DESC LIMIT 100",
-            (char_id,)
-        )
-        txs = cur.fetchall()
-        conn.close()
-        return resp(200, {'transactions': txs})
 
-    if method == 'GET' and action == 'notifications':
-        char_id = qs.get('character_id', '')
-        cur.execute(
-            "SELECT * FROM character_notifications WHERE character_id = %s ORDER BY created_at DESC LIMIT 50",
-            (char_id,)
-        )
-        notifs = cur.fetchall()
-        cur.execute(
-            "SELECT COUNT(*) as cnt FROM character_notifications WHERE character_id = %s AND is_read = false",
-            (char_id,)
-        )
-        unread = cur.fetchone()['cnt']
-        conn.close()
-        return resp(200, {'notifications': notifs, 'unread_count': unread})
-
-    if method == 'GET' and action == 'achievements':
-        char_id = qs.get('character_id', '')
-        cur.execute("SELECT * FROM achievements ORDER BY id")
-        all_ach = cur.fetchall()
-        cur.execute("SELECT achievement_id, earned_at FROM character_achievements WHERE character_id = %s", (char_id,))
-        earned = {r['achievement_id']: r['earned_at'] for r in cur.fetchall()}
-        cur.execute("SELECT COUNT(*) as cnt FROM character_tricks WHERE character_id = %s", (char_id,))
-        tricks_count = cur.fetchone()['cnt']
-        cur.execute("SELECT * FROM characters WHERE id = %s", (char_id,))
-        char = cur.fetchone()
-        result = []
-        for ach in all_ach:
-            is_earned = ach['id'] in earned
-            progress = 0
-            if ach['requirement_type'] == 'character_created':
-                progress = 1
-            elif ach['requirement_type'] == 'tricks_count':
-                progress = min(tricks_count, ach['requirement_value'])
-            elif ach['requirement_type'] == 'level':
-                progress = min(char['level'] if char else 0, ach['requirement_value'])
-            elif ach['requirement_type'] == 'games_won':
-                progress = min(char.get('games_won', 0) if char else 0, ach['requirement_value'])
-            result.append({**ach, 'is_earned': is_earned, 'earned_at': str(earned[ach['id']]) if is_earned else None, 'progress': progress})
-        conn.close()
-        return resp(200, {'achievements': result})
-
-    if method == 'GET' and action == 'purchased_items':
-        char_id = qs.get('character_id', '')
-        cur.execute("SELECT * FROM purchased_items WHERE character_id = %s ORDER BY purchased_at DESC", (char_id,))
-        items = cur.fetchall()
-        conn.close()
-        return resp(200, {'items': items})
-
-    if method == 'GET' and action == 'current_tournament':
-        tournament = get_or_create_tournament(cur)
-        cur.execute(
-            "SELECT te.*, c.name as character_name, c.avatar_url, c.sport_type, c.level "
-            "FROM tournament_entries te JOIN characters c ON te.character_id = c.id "
-            "WHERE te.tournament_id = %s ORDER BY te.score DESC, te.joined_at ASC",
-            (tournament['id'],)
-        )
-        entries = cur.fetchall()
-        conn.commit()
-        conn.close()
-        return resp(200, {'tournament': tournament, 'entries': entries})
+@route('GET', 'mastered_tricks')
+def get_mastered_tricks(req):
+    qs = req.qs
+    cur = req.cur
+    char_id = qs.get('character_id', '')
+    cur.execute(
+        "SELECT ct.*, t.name, t.sport_type, t.category, t.difficulty, t.experience_reward, t.kinetics_reward, t.description "
+        "FROM character_tricks ct JOIN tricks t ON ct.trick_id = t.id "
+        "WHERE ct.character_id = %s", (char_id,)
+    )
+    mastered = cur.fetchall()
+    return resp(200, {'mastered_tricks': mastered})
+
+
+@route('GET', 'transactions')
+def get_transactions(req):
+    qs = req.qs
+    cur = req.cur
+    char_id = qs.get('character_id', '')
+    try:
+        limit = parse_limit(qs.get('limit'), TRANSACTIONS_PAGE_SIZE, TRANSACTIONS_MAX_PAGE_SIZE)
+    except ValueError:
+        return resp(400, {'error': 'invalid_limit'})
+    txs, next_cursor = transactions_page(cur, char_id, qs.get('cursor'), limit)
+    return resp(200, {'transactions': txs, 'next_cursor': next_cursor})
+
+
+@route('GET', 'balance_at')
+def get_balance_at(req):
+    """Остаток на момент по журналу. Только с X-Admin-Token."""
+    if not admin_authorized(req.headers):
+        return resp(403, {'error': 'forbidden'})
+    qs = req.qs
+    try:
+        char_id = int(qs['character_id'])
+    except KeyError:
+        return resp(400, {'error': 'character_id_required'})
+    except ValueError:
+        return resp(400, {'error': 'invalid_character_id'})
+    try:
+        at = datetime.fromisoformat(qs['at']) if qs.get('at') else datetime.now()
+    except ValueError:
+        return resp(400, {'error': 'invalid_at'})
+    row = balance_at(req.cur, char_id, at)
+    return resp(200, {'character_id': char_id, 'at': at, 'balance': row['balance'], 'snapshot_at': row['snapshot_at']})
+
+
+@route('GET', 'reconcile_ledger')
+def get_reconcile_ledger(req):
+    """Сверка журнала с остатками, без character_id — по всем персонажам. Только с X-Admin-Token."""
+    if not admin_authorized(req.headers):
+        return resp(403, {'error': 'forbidden'})
+    qs = req.qs
+    try:
+        char_id = int(qs['character_id']) if qs.get('character_id') else None
+    except ValueError:
+        return resp(400, {'error': 'invalid_character_id'})
+    try:
+        limit = parse_limit(qs.get('limit'), 100, RECONCILE_MAX_LIMIT)
+    except ValueError:
+        return resp(400, {'error': 'invalid_limit'})
+    return resp(200, reconcile_ledger(req.conn, char_id, limit))
+
+
+@route('GET', 'notifications')
+def get_notifications(req):
+    qs = req.qs
+    cur = req.cur
+    char_id = qs.get('character_id', '')
+    try:
+        limit = parse_limit(qs.get('limit'), NOTIFICATIONS_PAGE_SIZE, NOTIFICATIONS_MAX_PAGE_SIZE)
+    except ValueError:
+        return resp(400, {'error': 'invalid_limit'})
+    notifs, next_cursor = notifications_page(cur, char_id, qs.get('cursor'), limit)
+    unread = unread_notifications(cur, char_id)
+    return resp(200, {'notifications': notifs, 'unread_count': unread, 'next_cursor': next_cursor})
+
+
+@route('GET', 'unread_count')
+def get_unread_count(req):
+    return resp(200, {'unread_count': unread_notifications(req.cur, req.qs.get('character_id', ''))})
+
+
+@route('GET', 'achievements')
+def get_achievements(req):
+    qs = req.qs
+    cur = req.cur
+    char_id = qs.get('character_id', '')
+    all_ach = catalog_cache.get(cur, 'achievements', 'all', load_achievements)['rows']
+    cur.execute(ACHIEVEMENT_PROGRESS_SQL, {'cid': char_id})
+    char = cur.fetchone()
+    earned = dict(zip(char['earned_ids'], char['earned_at']))
+    tricks_count = char['tricks_count']
+    result = []
+    for ach in all_ach:
+        is_earned = ach['id'] in earned
+        progress = 0
+        if ach['requirement_type'] == 'character_created':
+            progress = 1
+        elif ach['requirement_type'] == 'tricks_count':
+            progress = min(tricks_count, ach['requirement_value'])
+        elif ach['requirement_type'] == 'level':
+            progress = min(char['level'], ach['requirement_value'])
+        elif ach['requirement_type'] == 'games_won':
+            progress = min(char['games_won'], ach['requirement_value'])
+        result.append({**ach, 'is_earned': is_earned, 'earned_at': str(earned[ach['id']]) if is_earned else None, 'progress': progress})
+    return resp(200, {'achievements': result})
 
-    if method == 'GET' and action == 'leaderboard':
-        period = qs.get('period', 'weekly')
-        if period == 'weekly':
-            monday, sunday = get_current_week()
-            cur.execute(
-                "SELECT te.*, c.name as character_name, c.avatar_url, c.sport_type, c.level "
-                "FROM tournament_entries te "
-                "JOIN tournaments t ON te.tournament_id = t.id "
-                "JOIN characters c ON te.character_id = c.id "
-                "WHERE t.week_start = %s ORDER BY te.score DESC LIMIT 50",
-                (monday,)
-            )
-        else:
-            month_key = date.today().strftime('%Y-%m')
-            cur.execute(
-                "SELECT c.id as character_id, c.name as character_name, c.avatar_url, c.sport_type, c.level, "
-                "SUM(te.score) as score, SUM(te.games_score) as games_score, "
-                "SUM(te.tricks_score) as tricks_score, SUM(te.training_score) as training_score "
-                "FROM tournament_entries te "
-                "JOIN tournaments t ON te.tournament_id = t.id "
-                "JOIN characters c ON te.character_id = c.id "
-                "WHERE t.month_key = %s "
-                "GROUP BY c.id, c.name, c.avatar_url, c.sport_type, c.level "
-                "ORDER BY score DESC LIMIT 50",
-                (month_key,)
-            )
-        entries = cur.fetchall()
-        conn.close()
-        return resp(200, {'entries': entries, 'period': period})
 
-    if method == 'GET' and action == 'public_profile':
-        char_id = qs.get('character_id', '')
-        cur.execute("SELECT id, user_id, name, sport_type, sport_types, riding_style, level, experience, balance, speed, courage, body_type, hairstyle, hair_color, avatar_url, kinetics, games_won, games_played, age, trainer_name, created_at FROM characters WHERE id = %s", (char_id,))
-        char = cur.fetchone()
-        if not char:
-            conn.close()
-            return resp(404, {'error': 'not_found'})
-        cur.execute("SELECT COUNT(*) as cnt FROM character_tricks WHERE character_id = %s", (char_id,))
-        tricks_count = cur.fetchone()['cnt']
-        cur.execute("SELECT achievement_id FROM character_achievements WHERE character_id = %s", (char_id,))
-        achievements_count = len(cur.fetchall())
-        cur.execute("SELECT COUNT(*) as cnt FROM training_visits WHERE character_id = %s", (char_id,))
-        training_count = cur.fetchone()['cnt']
-        cur.execute(
-            "SELECT te.score, te.rank, t.week_start, t.week_end "
-            "FROM tournament_entries te JOIN tournaments t ON te.tournament_id = t.id "
-            "WHERE te.character_id = %s ORDER BY t.week_start DESC LIMIT 10",
-            (char_id,)
-        )
-        tournament_history = cur.fetchall()
-        conn.close()
-        return resp(200, {
-            'character': char,
-            'stats': {
-                'tricks_learned': tricks_count,
-                'achievements_earned': achievements_count,
-                'training_visits': training_count,
-                'tournament_history': tournament_history
-            }
-        })
-
-    if method == 'GET' and action == 'training_visits':
-        char_id = qs.get('character_id', '')
-        cur.execute("SELECT * FROM training_visits WHERE character_id = %s ORDER BY visit_date DESC LIMIT 100", (char_id,))
-        visits = cur.fetchall()
-        conn.close()
-        return resp(200, {'visits': visits})
-
-    # === POST ENDPOINTS ===
-
-    if method == 'POST' and action == 'create_character':
-        cur.execute("SELECT id FROM characters WHERE user_id = %s", (body['user_id'],))
-        if cur.fetchone():
-            conn.close()
-            return resp(400, {'error': 'character_exists'})
-        sport = body['sport_type']
-        age = body.get('age')
-        cur.execute(
-            "INSERT INTO characters (user_id, name, sport_type, riding_style, body_type, hairstyle, hair_color, avatar_url, kinetics, sport_types, age) "
-            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 100, %s, %s) RETURNING *",
-            (
-                body['user_id'], body['name'], sport, body.get('riding_style', 'freestyle'),
-                body.get('body_type', 1), body.get('hairstyle', 1), body.get('hair_color', '#000000'),
-                body.get('avatar_url', ''), [sport], age
-            )
-        )
-        char = cur.fetchone()
-        create_notification(cur, char['id'], 'Добро пожаловать!', f'Персонаж {char["name"]} создан! Тебе начислено 100 кинетиков.', 'welcome')
-        check_achievements(cur, char['id'])
-        conn.commit()
-        conn.close()
-        return resp(201, {'character': char})
-
-    if method == 'POST' and action == 'update_character':
-        fields = []
-        values = []
-        for key in ['name', 'level', 'experience', 'balance', 'speed', 'courage', 'kinetics', 'avatar_url', 'body_type', 'hairstyle', 'hair_color', 'age', 'trainer_name']:
-            if key in body:
-                fields.append(f"{key} = %s")
-                values.append(body[key])
-        if 'sport_types' in body:
-            fields.append("sport_types = %s")
-            values.append(body['sport_types'])
-        if not fields:
-            conn.close()
-            return resp(400, {'error': 'no_fields'})
-        fields.append("updated_at = NOW()")
-        values.append(body.get('character_id', 0))
-        cur.execute(f"UPDATE characters SET {', '.join(fields)} WHERE id = %s RETURNING *", values)
-        char = cur.fetchone()
-        conn.commit()
-        conn.close()
-        return resp(200, {'character': char})
-
-    if method == 'POST' and action == 'add_kinetics':
-        char_id = body['character_id']
-        amount = body['amount']
-        source = body.get('source', 'admin')
-        desc = body.get('description', '')
-        created_by = body.get('created_by', '')
-        tx_type = 'earn' if amount > 0 else 'spend'
-        cur.execute("UPDATE characters SET kinetics = kinetics + %s, updated_at = NOW() WHERE id = %s RETURNING *", (amount, char_id))
-        char = cur.fetchone()
-        if not char:
-            conn.close()
-            return resp(404, {'error': 'character_not_found'})
-        cur.execute(
-            "INSERT INTO kinetics_transactions (character_id, amount, transaction_type, source, description, created_by) "
-            "VALUES (%s, %s, %s, %s, %s, %s) RETURNING *",
-            (char_id, amount, tx_type, source, desc, created_by)
-        )
-        tx = cur.fetchone()
-        if amount > 0:
-            create_notification(cur, char_id, f'+{amount} кинетиков!', desc or 'Начисление кинетиков', 'kinetics')
-        else:
-            create_notification(cur, char_id, f'{amount} кинетиков', desc or 'Списание кинетиков', 'kinetics')
-        conn.commit()
-        conn.close()
-        return resp(200, {'character': char, 'transaction': tx})
-
-    if method == 'POST' and action == 'confirm_tricks':
-        char_id = body['character_id']
-        trick_ids = body['trick_ids']
-        confirmed_by = body.get('confirmed_by', '')
-        total_exp = 0
-        total_kin = 0
-        for tid in trick_ids:
-            cur.execute("SELECT * FROM tricks WHERE id = %s", (tid,))
-            trick = cur.fetchone()
-            if not trick:
-                continue
-            cur.execute(
-                "INSERT INTO character_tricks (character_id, trick_id, confirmed_by) "
-                "VALUES (%s, %s, %s) ON CONFLICT (character_id, trick_id) DO NOTHING RETURNING id",
-                (char_id, tid, confirmed_by)
-            )
-            inserted = cur.fetchone()
-            if inserted:
-                total_exp += trick['experience_reward']
-                total_kin += trick['kinetics_reward']
-        if total_exp > 0 or total_kin > 0:
-            cur.execute(
-                "UPDATE characters SET experience = experience + %s, kinetics = kinetics + %s, "
-                "level = LEAST(FLOOR((experience + %s) / 100) + 1, 100), updated_at = NOW() "
-                "WHERE id = %s RETURNING *",
-                (total_exp, total_kin, total_exp, char_id)
-            )
-            char = cur.fetchone()
-            cur.execute(
-                "INSERT INTO kinetics_transactions (character_id, amount, transaction_type, source, description, created_by) "
-                "VALUES (%s, %s, 'earn', 'tricks', %s, %s)",
-                (char_id, total_kin, f'Подтверждено {len(trick_ids)} трюков', confirmed_by)
-            )
-            create_notification(cur, char_id, f'Подтверждено {len(trick_ids)} трюков!', f'+{total_exp} XP, +{total_kin} кинетиков', 'tricks')
-        else:
-            cur.execute("SELECT * FROM characters WHERE id = %s", (char_id,))
-            char = cur.fetchone()
-        newly = check_achievements(cur, char_id)
-        conn.commit()
-        conn.close()
-        return resp(200, {'character': char, 'total_exp': total_exp, 'total_kinetics': total_kin, 'new_achievements': newly})
-
-    if method == 'POST' and action == 'game_complete':
-        char_id = body['character_id']
-        earned_xp = body.get('earned_xp', 0)
-        earned_kin = body.get('earned_kinetics', 0)
-        game_name = body.get('game_name', 'game')
-        won = body.get('won', True)
-        score = body.get('score', 0)
-        won_increment = 1 if won else 0
-        cur.execute(
-            "UPDATE characters SET experience = experience + %s, kinetics = kinetics + %s, "
-            "games_played = games_played + 1, games_won = games_won + %s, "
-            "level = LEAST(FLOOR((experience + %s) / 100) + 1, 100), updated_at = NOW() "
-            "WHERE id = %s RETURNING *",
-            (earned_xp, earned_kin, won_increment, earned_xp, char_id)
-        )
-        char = cur.fetchone()
-        cur.execute(
-            "INSERT INTO game_results (character_id, game_name, won, earned_xp, earned_kinetics, score) "
-            "VALUES (%s, %s, %s, %s, %s, %s)",
-            (char_id, game_name, won, earned_xp, earned_kin, score)
-        )
-        if earned_kin > 0:
-            cur.execute(
-                "INSERT INTO kinetics_transactions (character_id, amount, transaction_type, source, description) "
-                "VALUES (%s, %s, 'earn', 'game', %s)",
-                (char_id, earned_kin, f'Мини-игра: {game_name}')
-            )
-        newly = check_achievements(cur, char_id)
-        conn.commit()
-        conn.close()
-        return resp(200, {'character': char, 'new_achievements': newly})
-
-    if method == 'POST' and action == 'mark_notifications_read':
-        char_id = body['character_id']
-        notif_ids = body.get('notification_ids', [])
-        if notif_ids:
-            placeholders = ','.join(['%s'] * len(notif_ids))
-            cur.execute(f"UPDATE character_notifications SET is_read = true WHERE id IN ({placeholders}) AND character_id = %s", notif_ids + [char_id])
-        else:
-            cur.execute("UPDATE character_notifications SET is_read = true WHERE character_id = %s AND is_read = false", (char_id,))
-        conn.commit()
-        conn.close()
-        return resp(200, {'ok': True})
+@route('GET', 'quests')
+def get_quests(req):
+    return resp(200, {'quests': character_quests(req.cur, req.qs.get('character_id', '')), 'quest_date': date.today()})
 
-    if method == 'POST' and action == 'purchase_item':
-        char_id = body['character_id']
-        item_type = body['item_type']
-        item_value = str(body.get('item_value', ''))
-        item_name = body.get('item_name', item_type)
-        cost = body.get('cost', 0)
 
-        cur.execute("SELECT * FROM characters WHERE id = %s", (char_id,))
-        char = cur.fetchone()
-        if not char:
-            conn.close()
-            return resp(404, {'error': 'character_not_found'})
-        if char['kinetics'] < cost:
-            conn.close()
-            return resp(400, {'error': 'not_enough_kinetics', 'needed': cost, 'have': char['kinetics']})
+@route('GET', 'purchased_items')
+def get_purchased_items(req):
+    qs = req.qs
+    cur = req.cur
+    char_id = qs.get('character_id', '')
+    cur.execute("SELECT * FROM purchased_items WHERE character_id = %s ORDER BY purchased_at DESC", (char_id,))
+    items = cur.fetchall()
+    return resp(200, {'items': items})
 
-        cur.execute(
-            "SELECT id FROM purchased_items WHERE character_id = %s AND item_type = %s AND item_value = %s",
-            (char_id, item_type, item_value)
-        )
-        if cur.fetchone():
-            conn.close()
-            return resp(400, {'error': 'already_purchased'})
 
+@route('GET', 'current_tournament')
+def get_current_tournament(req):
+    cur = req.cur
+    tournament = get_or_create_tournament(cur)
+    cur.execute(
+        "SELECT te.*, c.name as character_name, c.avatar_url, c.sport_type, c.level "
+        "FROM tournament_entries te JOIN characters c ON te.character_id = c.id "
+        "WHERE te.tournament_id = %s ORDER BY te.score DESC, te.joined_at ASC",
+        (tournament['id'],)
+    )
+    entries = cur.fetchall()
+    req.conn.commit()
+    return resp(200, {'tournament': tournament, 'entries': entries})
+
+
+@route('GET', 'changes')
+def get_changes(req):
+    qs = req.qs
+    char_id = qs.get('character_id') or None
+    cursor = qs.get('since', '')
+    try:
+        timeout = float(qs['timeout']) if qs.get('timeout') else CHANGES_TIMEOUT
+    except ValueError:
+        return resp(400, {'error': 'invalid_timeout'})
+    if not math.isfinite(timeout):
+        return resp(400, {'error': 'invalid_timeout'})
+    timeout = min(max(timeout, 0.0), CHANGES_MAX_TIMEOUT)
+    # Слушатель запускается до чтения — уведомление между чтением и ожиданием не потеряется
+    change_feed.start()
+    mark = change_feed.mark()
+    changes = load_changes(req.cur, char_id, cursor)
+    req.close()
+    def relevant(channel, payload):
+        if channel == 'kinetic_tournament':
+            return True
+        return payload == '*' or payload == str(char_id)
+
+    deadline = time.monotonic() + timeout
+    while not changes['changed'] and time.monotonic() < deadline:
+        if not change_feed.wait(mark, relevant, deadline - time.monotonic()):
+            break
+        mark = change_feed.mark()
+        changes = load_changes(req.cur, char_id, cursor)
+        req.close()
+    if not changes['changed']:
+        return {
+            'statusCode': 304,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'X-Changes-Cursor',
+                'X-Changes-Cursor': changes['cursor'],
+            },
+            'body': ''
+        }
+    return resp(200, changes)
+
+
+@route('GET', 'leaderboard')
+def get_leaderboard(req):
+    qs = req.qs
+    cur = req.cur
+    period = qs.get('period', 'weekly')
+    try:
+        limit = parse_limit(qs.get('limit'), 50, LEADERBOARD_MAX_LIMIT)
+    except ValueError:
+        return resp(400, {'error': 'invalid_limit'})
+    char_id = qs.get('character_id')
+    if period == 'weekly':
+        monday, sunday = get_current_week()
+        entries, me = weekly_leaderboard(cur, monday, limit, char_id)
+    else:
+        entries, me = monthly_leaderboard(cur, date.today().replace(day=1), limit, char_id)
+    result = {'entries': entries, 'period': period}
+    if char_id:
+        result['me'] = me
+    return resp(200, result)
+
+
+@route('GET', 'clan_leaderboard')
+def get_clan_leaderboard(req):
+    qs = req.qs
+    period = qs.get('period', 'weekly')
+    if period not in ('weekly', 'monthly'):
+        return resp(400, {'error': 'invalid_period'})
+    try:
+        limit = parse_limit(qs.get('limit'), 50, CLAN_LEADERBOARD_MAX_LIMIT)
+    except ValueError:
+        return resp(400, {'error': 'invalid_limit'})
+    try:
+        clan_id = int(qs['clan_id']) if qs.get('clan_id') else None
+    except ValueError:
+        return resp(400, {'error': 'invalid_clan_id'})
+    entries, mine = clan_leaderboard(req.cur, period, limit, clan_id)
+    result = {'entries': entries, 'period': period}
+    if clan_id:
+        result['clan'] = mine
+    return resp(200, result)
+
+
+@route('GET', 'clan')
+def get_clan(req):
+    qs = req.qs
+    try:
+        after = int(qs.get('cursor') or 0)
+    except ValueError:
+        return resp(400, {'error': 'invalid_cursor'})
+    try:
+        limit = parse_limit(qs.get('limit'), CLAN_MEMBERS_PAGE_SIZE, CLAN_MEMBERS_PAGE_SIZE)
+    except ValueError:
+        return resp(400, {'error': 'invalid_limit'})
+    cur = req.cur
+    if qs.get('clan_id'):
+        cur.execute("SELECT * FROM clans WHERE id = %s", (qs['clan_id'],))
+    else:
         cur.execute(
-            "INSERT INTO purchased_items (character_id, item_type, item_value, item_name, cost) "
-            "VALUES (%s, %s, %s, %s, %s) RETURNING *",
-            (char_id, item_type, item_value, item_name, cost)
+            "SELECT cl.* FROM clan_members cm JOIN clans cl ON cl.id = cm.clan_id WHERE cm.character_id = %s",
+            (qs.get('character_id', ''),)
         )
-        item = cur.fetchone()
-
-        cur.execute("UPDATE characters SET kinetics = kinetics - %s, updated_at = NOW() WHERE id = %s RETURNING *", (cost, char_id))
-        char = cur.fetchone()
-
-        cur.execute(
-            "INSERT INTO kinetics_transactions (character_id, amount, transaction_type, source, description) "
-            "VALUES (%s, %s, 'spend', 'shop', %s)",
-            (char_id, -cost, f'Покупка: {item_name}')
+    clan = cur.fetchone()
+    if not clan:
+        return resp(404, {'error': 'clan_not_found'})
+    periods = clan_periods()
+    cur.execute(
+        "SELECT period, score FROM clan_scores WHERE clan_id = %(clan)s AND ("
+        "(period = 'weekly' AND period_start = %(weekly)s) OR (period = 'monthly' AND period_start = %(monthly)s))",
+        {'clan': clan['id'], **periods}
+    )
+    scores = {'weekly': 0, 'monthly': 0}
+    scores.update({r['period']: r['score'] for r in cur.fetchall()})
+    cur.execute(CLAN_MEMBERS_SQL, {
+        'clan': clan['id'], 'monday': periods['weekly'], 'after': after, 'limit': limit,
+    })
+    members = cur.fetchall()
+    next_cursor = str(members[-1]['id']) if len(members) == limit else None
+    return resp(200, {'clan': clan, 'scores': scores, 'members': members, 'next_cursor': next_cursor})
+
+
+@route('GET', 'public_profile')
+def get_public_profile(req):
+    qs = req.qs
+    cur = req.cur
+    char_id = qs.get('character_id', '')
+    cur.execute(PUBLIC_PROFILE_SQL, {'cid': char_id})
+    char = cur.fetchone()
+    if not char:
+        return resp(404, {'error': 'not_found'})
+    tricks_count = char.pop('tricks_count')
+    training_count = char.pop('trainings_count')
+    achievements_count = char.pop('achievements_count')
+    tournament_history = char.pop('tournament_history')
+    return resp(200, {
+        'character': char,
+        'stats': {
+            'tricks_learned': tricks_count,
+            'achievements_earned': achievements_count,
+            'training_visits': training_count,
+            'tournament_history': tournament_history
+        }
+    })
+
+
+@route('GET', 'training_visits')
+def get_training_visits(req):
+    qs = req.qs
+    cur = req.cur
+    char_id = qs.get('character_id', '')
+    cur.execute("SELECT * FROM training_visits WHERE character_id = %s ORDER BY visit_date DESC LIMIT 100", (char_id,))
+    visits = cur.fetchall()
+    return resp(200, {'visits': visits})
+
+
+@route('GET', 'pool_stats', db=False)
+def get_pool_stats(req):
+    if not admin_authorized(req.headers):
+        return resp(403, {'error': 'forbidden'})
+    return resp(200, {'pool': db_pool.stats()})
+
+
+@route('GET', 'metrics', db=False)
+def get_metrics(req):
+    """Сводка по action с момента старта инстанса; reset=1 начинает окно заново. Только с X-Admin-Token."""
+    if not admin_authorized(req.headers):
+        return resp(403, {'error': 'forbidden'})
+    summary = action_stats.summary()
+    if req.qs.get('reset') == '1':
+        action_stats.reset()
+    return resp(200, {'actions': summary, 'pool': db_pool.stats(), 'slow_query_ms': SLOW_QUERY_MS})
+
+
+@route('GET', 'stats_drift')
+def get_stats_drift(req):
+    """Расхождения счётчиков с исходными таблицами. Только с X-Admin-Token."""
+    if not admin_authorized(req.headers):
+        return resp(403, {'error': 'forbidden'})
+    qs = req.qs
+    try:
+        character_id = int(qs['character_id']) if qs.get('character_id') else None
+    except ValueError:
+        return resp(400, {'error': 'invalid_character_id'})
+    try:
+        limit = parse_limit(qs.get('limit'), 100, STATS_DRIFT_MAX_LIMIT)
+    except ValueError:
+        return resp(400, {'error': 'invalid_limit'})
+    drift = find_stats_drift(req.cur, character_id, limit)
+    return resp(200, {'drift': drift, 'consistent': not drift})
+
+
+# === POST ENDPOINTS ===
+
+@route('POST', 'create_character')
+def post_create_character(req):
+    body = req.body
+    cur = req.cur
+    cur.execute("SELECT id FROM characters WHERE user_id = %s", (body['user_id'],))
+    if cur.fetchone():
+        return resp(400, {'error': 'character_exists'})
+    sport = body['sport_type']
+    age = body.get('age')
+    cur.execute(
+        "INSERT INTO characters (user_id, name, sport_type, riding_style, body_type, hairstyle, hair_color, avatar_url, kinetics, sport_types, age) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 0, %s, %s) RETURNING id",
+        (
+            body['user_id'], body['name'], sport, body.get('riding_style', 'freestyle'),
+            body.get('body_type', 1), body.get('hairstyle', 1), body.get('hair_color', '#000000'),
+            body.get('avatar_url', ''), [sport], age
         )
-        create_notification(cur, char_id, f'Покупка: {item_name}!', f'Куплено за {cost} кинетиков', 'purchase')
-        conn.commit()
-        conn.close()
-        return resp(200, {'character': char, 'item': item})
+    )
+    char, _ = post_transaction(cur, cur.fetchone()['id'], 100, 'welcome', 'Стартовый бонус')
+    cur.execute("INSERT INTO character_stats (character_id) VALUES (%s)", (char['id'],))
+    cur.execute(ASSIGN_CHARACTER_QUESTS_SQL, {'cid': char['id'], 'day': date.today()})
+    create_notification(cur, char['id'], 'Добро пожаловать!', f'Персонаж {char["name"]} создан! Тебе начислено 100 кинетиков.', 'welcome')
+    check_achievements(cur, char['id'], {'character_created': (0, 1), 'level': (0, char['level'])})
+    req.conn.commit()
+    return resp(201, {'character': char})
+
+
+@route('POST', 'update_character')
+def post_update_character(req):
+    body = req.body
+    cur = req.cur
+    char_id = body.get('character_id', 0)
+    fields = []
+    values = []
+    for key in ['name', 'level', 'experience', 'balance', 'speed', 'courage', 'avatar_url', 'body_type', 'hairstyle', 'hair_color', 'age', 'trainer_name']:
+        if key in body:
+            fields.append(f"{key} = %s")
+            values.append(body[key])
+    if 'sport_types' in body:
+        fields.append("sport_types = %s")
+        values.append(body['sport_types'])
+    if not fields and 'kinetics' not in body:
+        return resp(400, {'error': 'no_fields'})
+    if 'kinetics' in body:
+        # остаток меняется только операцией журнала на разницу
+        cur.execute("SELECT kinetics FROM characters WHERE id = %s FOR UPDATE", (char_id,))
+        current = cur.fetchone()
+        if current and body['kinetics'] != current['kinetics']:
+            moved, _ = post_transaction(
+                cur, char_id, body['kinetics'] - current['kinetics'], 'admin', 'Корректировка баланса',
+                body.get('created_by')
+            )
+            if not moved:
+                return resp(400, {'error': 'negative_kinetics'})
+    fields.append("updated_at = NOW()")
+    values.append(char_id)
+    cur.execute(f"UPDATE characters SET {', '.join(fields)} WHERE id = %s RETURNING *", values)
+    char = cur.fetchone()
+    req.conn.commit()
+    return resp(200, {'character': char})
+
+
+@route('POST', 'add_kinetics')
+def post_add_kinetics(req):
+    body = req.body
+    cur = req.cur
+    char_id = body['character_id']
+    amount = body['amount']
+    source = body.get('source', 'admin')
+    desc = body.get('description', '')
+    created_by = body.get('created_by', '')
+    char, tx = post_transaction(cur, char_id, amount, source, desc, created_by)
+    if not char:
+        cur.execute("SELECT kinetics FROM characters WHERE id = %s", (char_id,))
+        current = cur.fetchone()
+        if not current:
+            return resp(404, {'error': 'character_not_found'})
+        return resp(400, {'error': 'not_enough_kinetics', 'needed': -amount, 'have': current['kinetics']})
+    if amount > 0:
+        create_notification(cur, char_id, f'+{amount} кинетиков!', desc or 'Начисление кинетиков', 'kinetics')
+    else:
+        create_notification(cur, char_id, f'{amount} кинетиков', desc or 'Списание кинетиков', 'kinetics')
+    req.conn.commit()
+    return resp(200, {'character': char, 'transaction': tx})
+
+
+@route('POST', 'confirm_tricks')
+def post_confirm_tricks(req):
+    body = req.body
+    cur = req.cur
+    sessions = [{'character_id': int(body['character_id']), 'trick_ids': [int(tid) for tid in body['trick_ids']]}]
+    result = confirm_tricks_batch(cur, sessions, body.get('confirmed_by', ''))[0]
+    req.conn.commit()
+    return resp(200, {
+        'character': result['character'],
+        'total_exp': result['total_exp'],
+        'total_kinetics': result['total_kinetics'],
+        'completed_quests': result['completed_quests'],
+        'new_achievements': result['new_achievements'],
+    })
+
+
+@route('POST', 'confirm_tricks_batch')
+def post_confirm_tricks_batch(req):
+    body = req.body
+    cur = req.cur
+    # id из JSON могут прийти строками: сессии одного персонажа должны сложиться под одним ключом
+    sessions = [
+        {'character_id': int(s['character_id']), 'trick_ids': [int(tid) for tid in s['trick_ids']]}
+        for s in body.get('sessions', [])
+    ]
+    if not sessions:
+        return resp(400, {'error': 'no_sessions'})
+    results = confirm_tricks_batch(cur, sessions, body.get('confirmed_by', ''))
+    req.conn.commit()
+    return resp(200, {
+        'results': results,
+        'unknown_character_ids': [r['character_id'] for r in results if r['character'] is None],
+    })
+
+
+@route('POST', 'game_complete')
+def post_game_complete(req):
+    body = req.body
+    cur = req.cur
+    char_id = body['character_id']
+    earned_xp = body.get('earned_xp', 0)
+    earned_kin = body.get('earned_kinetics', 0)
+    game_name = body.get('game_name', 'game')
+    won = body.get('won', True)
+    score = body.get('score', 0)
+    won_increment = 1 if won else 0
+    cur.execute(GAME_COMPLETE_SQL, {
+        'cid': char_id, 'xp': earned_xp, 'kin': earned_kin, 'won': won_increment,
+        'won_flag': won, 'game': game_name, 'score': score,
+    })
+    char = cur.fetchone()
+    if not char:
+        cur.execute("SELECT kinetics FROM characters WHERE id = %s", (char_id,))
+        current = cur.fetchone()
+        if not current:
+            return resp(404, {'error': 'character_not_found'})
+        return resp(400, {'error': 'not_enough_kinetics', 'needed': -earned_kin, 'have': current['kinetics']})
+    completed = []
+    prev_level = char.pop('prev_level')
+    events = {'games_won': (char.pop('prev_games_won'), char['games_won'])}
+    progress = [(char['id'], 'games_daily', 1), (char['id'], 'wins_daily', won_increment)]
+    rewarded = advance_quests(cur, progress).get(char['id'])
+    if rewarded:
+        rewarded.pop('prev_level')
+        completed = rewarded.pop('completed_quests')
+        char = rewarded
+    events['level'] = (prev_level, char['level'])
+    newly = check_achievements(cur, char_id, events)
+    req.conn.commit()
+    return resp(200, {'character': char, 'completed_quests': completed, 'new_achievements': newly})
+
+
+@route('POST', 'mark_notifications_read')
+def post_mark_notifications_read(req):
+    body = req.body
+    unread = mark_notifications_read(req.cur, body['character_id'], body.get('notification_ids'))
+    req.conn.commit()
+    return resp(200, {'ok': True, 'unread_count': unread})
+
+
+@route('POST', 'purchase_item')
+def post_purchase_item(req):
+    body = req.body
+    cur = req.cur
+    char_id = body['character_id']
+    item_type = body['item_type']
+    item_value = str(body.get('item_value', ''))
+    item_name = body.get('item_name', item_type)
+    cost = body.get('cost', 0)
+
+    try:
+        cur.execute(PURCHASE_ITEM_SQL, {
+            'cid': char_id, 'item_type': item_type, 'item_value': item_value, 'item_name': item_name, 'cost': cost,
+        })
+    except ForeignKeyViolation:
+        return resp(404, {'error': 'character_not_found'})
+    char, item = split_row(cur.fetchone(), 'purchased')
+    if not item:
+        return resp(400, {'error': 'already_purchased'})
+    if not char:
+        req.conn.rollback()
+        cur.execute("SELECT kinetics FROM characters WHERE id = %s", (char_id,))
+        return resp(400, {'error': 'not_enough_kinetics', 'needed': cost, 'have': cur.fetchone()['kinetics']})
 
-    if method == 'POST' and action == 'purchase_customization':
-        char_id = body['character_id']
-        item_type = body['item_type']
-        item_value = body.get('item_value')
-        cost = body.get('cost', 0)
+    create_notification(cur, char_id, f'Покупка: {item_name}!', f'Куплено за {cost} кинетиков', 'purchase')
+    req.conn.commit()
+    return resp(200, {'character': char, 'item': item})
 
-        cur.execute("SELECT * FROM characters WHERE id = %s", (char_id,))
-        char = cur.fetchone()
-        if not char:
-            conn.close()
-            return resp(404, {'error': 'character_not_found'})
-        if char['kinetics'] < cost:
-            conn.close()
-            return resp(400, {'error': 'not_enough_kinetics'})
 
-        cur.execute(
-            "SELECT id FROM purchased_items WHERE character_id = %s AND item_type = %s AND item_value = %s",
-            (char_id, item_type, str(item_value))
-        )
-        already_owned = cur.fetchone()
+@route('POST', 'purchase_customization')
+def post_purchase_customization(req):
+    body = req.body
+    cur = req.cur
+    char_id = body['character_id']
+    item_type = body['item_type']
+    item_value = body.get('item_value')
+    cost = body.get('cost', 0)
 
-        actual_cost = 0 if already_owned else cost
+    if item_type not in CUSTOMIZATION_FIELDS:
+        return resp(400, {'error': 'invalid_item_type'})
 
-        if actual_cost > 0:
-            cur.execute(
-                "INSERT INTO purchased_items (character_id, item_type, item_value, item_name, cost) "
-                "VALUES (%s, %s, %s, %s, %s) ON CONFLICT (character_id, item_type, item_value) DO NOTHING",
-                (char_id, item_type, str(item_value), f'{item_type}:{item_value}', actual_cost)
-            )
+    try:
+        cur.execute(purchase_customization_sql(item_type), {
+            'cid': char_id, 'item_type': item_type, 'item_value': str(item_value),
+            'item_name': f'{item_type}:{item_value}', 'cost': cost, 'value': item_value,
+        })
+    except ForeignKeyViolation:
+        return resp(404, {'error': 'character_not_found'})
+    char, paid, owned = split_row(cur.fetchone(), 'paid', 'owned')
+    if not char:
+        if not paid:
+            return resp(404, {'error': 'character_not_found'})
+        req.conn.rollback()
+        return resp(400, {'error': 'not_enough_kinetics'})
 
-        update_field = None
-        if item_type == 'hairstyle':
-            update_field = 'hairstyle'
-        elif item_type == 'hair_color':
-            update_field = 'hair_color'
-        elif item_type == 'body_type':
-            update_field = 'body_type'
-        elif item_type == 'name':
-            update_field = 'name'
-        elif item_type == 'avatar_url':
-            update_field = 'avatar_url'
-
-        if not update_field:
-            conn.close()
-            return resp(400, {'error': 'invalid_item_type'})
-
-        if actual_cost > 0:
-            cur.execute(
-                f"UPDATE characters SET {update_field} = %s, kinetics = kinetics - %s, updated_at = NOW() WHERE id = %s RETURNING *",
-                (item_value, actual_cost, char_id)
-            )
-            cur.execute(
-                "INSERT INTO kinetics_transactions (character_id, amount, transaction_type, source, description) "
-                "VALUES (%s, %s, 'spend', 'shop', %s)",
-                (char_id, -actual_cost, f'Покупка: {item_type}')
-            )
-            create_notification(cur, char_id, 'Покупка в магазине!', f'Вы изменили {item_type} за {actual_cost} кинетиков', 'purchase')
-        else:
-            cur.execute(
-                f"UPDATE characters SET {update_field} = %s, updated_at = NOW() WHERE id = %s RETURNING *",
-                (item_value, char_id)
-            )
+    if paid:
+        create_notification(cur, char_id, 'Покупка в магазине!', f'Вы изменили {item_type} за {cost} кинетиков', 'purchase')
+    req.conn.commit()
+    return resp(200, {'character': char, 'was_free': not paid and (owned or cost > 0)})
 
-        char = cur.fetchone()
-        conn.commit()
-        conn.close()
-        return resp(200, {'character': char, 'was_free': already_owned is not None})
 
-    if method == 'POST' and action == 'add_sport':
-        char_id = body['character_id']
-        new_sport = body['sport_type']
-        cost = body.get('cost', 100)
+@route('POST', 'add_sport')
+def post_add_sport(req):
+    body = req.body
+    cur = req.cur
+    char_id = body['character_id']
+    new_sport = body['sport_type']
+    cost = body.get('cost', 100)
 
+    cur.execute(ADD_SPORT_SQL, {'cid': char_id, 'sport': new_sport, 'cost': cost})
+    char = cur.fetchone()
+    if not char:
         cur.execute("SELECT * FROM characters WHERE id = %s", (char_id,))
         char = cur.fetchone()
         if not char:
-            conn.close()
             return resp(404, {'error': 'character_not_found'})
-
-        current_sports = char.get('sport_types') or [char['sport_type']]
-        if new_sport in current_sports:
-            conn.close()
+        if new_sport in (char.get('sport_types') or [char['sport_type']]):
             return resp(400, {'error': 'sport_already_added'})
+        return resp(400, {'error': 'not_enough_kinetics'})
+
+    create_notification(cur, char_id, f'Новый вид спорта!', f'Добавлен {new_sport}. Новые трюки уже ждут тебя!', 'info')
+    req.conn.commit()
+    return resp(200, {'character': char})
+
+
+@route('POST', 'join_tournament')
+def post_join_tournament(req):
+    body = req.body
+    cur = req.cur
+    char_id = body['character_id']
+    tournament = get_or_create_tournament(cur)
+    tid = tournament['id']
+
+    try:
+        cur.execute(JOIN_TOURNAMENT_SQL, {'tid': tid, 'cid': char_id, 'fee': tournament['entry_fee']})
+    except ForeignKeyViolation:
+        return resp(404, {'error': 'character_not_found'})
+    char, entry = split_row(cur.fetchone(), 'entry')
+    if not entry:
+        return resp(400, {'error': 'already_joined'})
+    if not char:
+        req.conn.rollback()
+        return resp(400, {'error': 'not_enough_kinetics'})
 
-        if char['kinetics'] < cost:
-            conn.close()
-            return resp(400, {'error': 'not_enough_kinetics'})
-
-        new_sports = current_sports + [new_sport]
-        cur.execute(
-            "UPDATE characters SET sport_types = %s, kinetics = kinetics - %s, updated_at = NOW() WHERE id = %s RETURNING *",
-            (new_sports, cost, char_id)
-        )
-        char = cur.fetchone()
-
-        cur.execute(
-            "INSERT INTO kinetics_transactions (character_id, amount, transaction_type, source, description) "
-            "VALUES (%s, %s, 'spend', 'shop', %s)",
-            (char_id, -cost, f'Добавлен вид спорта: {new_sport}')
-        )
-        create_notification(cur, char_id, f'Новый вид спорта!', f'Добавлен {new_sport}. Новые трюки уже ждут тебя!', 'info')
-        conn.commit()
-        conn.close()
-        return resp(200, {'character': char})
-
-    if method == 'POST' and action == 'join_tournament':
-        char_id = body['character_id']
-        tournament = get_or_create_tournament(cur)
-        tid = tournament['id']
-
-        cur.execute("SELECT id FROM tournament_entries WHERE tournament_id = %s AND character_id = %s", (tid, char_id))
-        if cur.fetchone():
-            conn.commit()
-            conn.close()
-            return resp(400, {'error': 'already_joined'})
-
-        fee = tournament['entry_fee']
-        cur.execute("SELECT kinetics FROM characters WHERE id = %s", (char_id,))
-        char = cur.fetchone()
-        if not char or char['kinetics'] < fee:
-            conn.commit()
-            conn.close()
-            return resp(400, {'error': 'not_enough_kinetics'})
-
-        cur.execute("UPDATE characters SET kinetics = kinetics - %s, updated_at = NOW() WHERE id = %s RETURNING *", (fee, char_id))
-        char = cur.fetchone()
-        cur.execute(
-            "INSERT INTO tournament_entries (tournament_id, character_id) VALUES (%s, %s) RETURNING *",
-            (tid, char_id)
-        )
-        entry = cur.fetchone()
-
-        cur.execute(
-            "INSERT INTO kinetics_transactions (character_id, amount, transaction_type, source, description) "
-            "VALUES (%s, %s, 'spend', 'tournament', %s)",
-            (char_id, -fee, f'Вступление в турнир #{tid}')
-        )
-        create_notification(cur, char_id, 'Турнир!', f'Вы вступили в еженедельный турнир!', 'tournament')
+    create_notification(cur, char_id, 'Турнир!', f'Вы вступили в еженедельный турнир!', 'tournament')
 
-        recalc_tournament_scores(cur, tid)
-        conn.commit()
-        conn.close()
-        return resp(200, {'character': char, 'entry': entry})
+    recalc_tournament_scores(cur, tid)
+    req.conn.commit()
+    return resp(200, {'character': char, 'entry': entry})
 
-    if method == 'POST' and action == 'add_training_visit':
-        char_id = body['character_id']
-        visit_date = body.get('visit_date', str(date.today()))
-        confirmed_by = body.get('confirmed_by', '')
-        notes = body.get('notes', '')
 
-        cur.execute(
-            "INSERT INTO training_visits (character_id, visit_date, confirmed_by, notes) "
-            "VALUES (%s, %s, %s, %s) RETURNING *",
-            (char_id, visit_date, confirmed_by, notes)
-        )
-        visit = cur.fetchone()
-        create_notification(cur, char_id, 'Тренировка засчитана!', f'Посещение тренировки {visit_date} зачислено', 'info')
-        conn.commit()
-        conn.close()
-        return resp(200, {'visit': visit})
+@route('POST', 'add_training_visit')
+def post_add_training_visit(req):
+    body = req.body
+    cur = req.cur
+    char_id = body['character_id']
+    visit_date = body.get('visit_date', str(date.today()))
+    confirmed_by = body.get('confirmed_by', '')
+    notes = body.get('notes', '')
 
-    if method == 'POST' and action == 'set_trainer':
-        char_id = body['character_id']
-        trainer_name = body.get('trainer_name', '')
-        cur.execute("UPDATE characters SET trainer_name = %s, updated_at = NOW() WHERE id = %s RETURNING *", (trainer_name, char_id))
-        char = cur.fetchone()
-        conn.commit()
-        conn.close()
-        return resp(200, {'character': char})
-
-    if method == 'POST' and action == 'set_age':
-        char_id = body['character_id']
-        age = body.get('age', 0)
-        cur.execute("UPDATE characters SET age = %s, updated_at = NOW() WHERE id = %s RETURNING *", (age, char_id))
-        char = cur.fetchone()
-        conn.commit()
-        conn.close()
-        return resp(200, {'character': char})
-
-    if method == 'POST' and action == 'send_weekly_results':
-        monday, sunday = get_current_week()
-        prev_monday = monday - timedelta(days=7)
-        cur.execute("SELECT * FROM tournaments WHERE week_start = %s", (prev_monday,))
-        prev_tournament = cur.fetchone()
-        if not prev_tournament:
-            conn.close()
-            return resp(404, {'error': 'no_previous_tournament'})
+    visits = add_training_visits(cur, [char_id], visit_date, confirmed_by, notes, body.get('group_name'))
+    if not visits:
+        cur.execute("SELECT id FROM characters WHERE id = %s", (char_id,))
+        if not cur.fetchone():
+            return resp(404, {'error': 'character_not_found'})
+        return resp(400, {'error': 'already_visited'})
+    req.conn.commit()
+    return resp(200, {'visit': visits[0]})
+
+
+@route('POST', 'add_training_visits')
+def post_add_training_visits(req):
+    body = req.body
+    cur = req.cur
+    char_ids = [int(cid) for cid in body.get('character_ids', [])]
+    if not char_ids:
+        return resp(400, {'error': 'no_characters'})
+    visit_date = body.get('visit_date', str(date.today()))
+    visits = add_training_visits(
+        cur, char_ids, visit_date, body.get('confirmed_by', ''), body.get('notes', ''), body.get('group_name')
+    )
+    req.conn.commit()
+    added = {v['character_id'] for v in visits}
+    return resp(200, {
+        'visits': visits,
+        'added': len(visits),
+        'skipped': [cid for cid in dict.fromkeys(char_ids) if cid not in added],
+    })
+
+
+@route('POST', 'set_trainer')
+def post_set_trainer(req):
+    body = req.body
+    cur = req.cur
+    char_id = body['character_id']
+    trainer_name = body.get('trainer_name', '')
+    cur.execute("UPDATE characters SET trainer_name = %s, updated_at = NOW() WHERE id = %s RETURNING *", (trainer_name, char_id))
+    char = cur.fetchone()
+    req.conn.commit()
+    return resp(200, {'character': char})
 
-        recalc_tournament_scores(cur, prev_tournament['id'])
 
+@route('POST', 'set_age')
+def post_set_age(req):
+    body = req.body
+    cur = req.cur
+    char_id = body['character_id']
+    age = body.get('age', 0)
+    cur.execute("UPDATE characters SET age = %s, updated_at = NOW() WHERE id = %s RETURNING *", (age, char_id))
+    char = cur.fetchone()
+    req.conn.commit()
+    return resp(200, {'character': char})
+
+
+@route('POST', 'repair_stats')
+def post_repair_stats(req):
+    """Ремонт счётчиков одного персонажа. Только с X-Admin-Token; всю таблицу чинит tools/repair_stats.py."""
+    if not admin_authorized(req.headers):
+        return resp(403, {'error': 'forbidden'})
+    try:
+        character_id = int(req.body['character_id'])
+    except KeyError:
+        return resp(400, {'error': 'character_id_required'})
+    except (TypeError, ValueError):
+        return resp(400, {'error': 'invalid_character_id'})
+    result = repair_character_stats(req.cur, character_id)
+    req.conn.commit()
+    return resp(200, {'repaired': result['repaired']})
+
+
+@route('POST', 'archive_notifications')
+def post_archive_notifications(req):
+    """Перенос старых прочитанных уведомлений в архив. Только с X-Admin-Token."""
+    if not admin_authorized(req.headers):
+        return resp(403, {'error': 'forbidden'})
+    body = req.body
+    params = {}
+    for name, default, maximum in (
+        ('days', NOTIFICATION_RETENTION_DAYS, NOTIFICATION_MAX_RETENTION_DAYS),
+        ('batch_size', NOTIFICATION_ARCHIVE_BATCH, NOTIFICATION_ARCHIVE_MAX_BATCH),
+        ('max_batches', 100, NOTIFICATION_ARCHIVE_MAX_BATCHES),
+    ):
+        try:
+            params[name] = parse_limit(body.get(name), default, maximum)
+        except (TypeError, ValueError):
+            return resp(400, {'error': f'invalid_{name}'})
+    return resp(200, archive_notifications(req.conn, **params))
+
+
+@route('POST', 'snapshot_balances')
+def post_snapshot_balances(req):
+    """Снимки остатков всех персонажей. Только с X-Admin-Token."""
+    if not admin_authorized(req.headers):
+        return resp(403, {'error': 'forbidden'})
+    try:
+        batch_size = parse_limit(req.body.get('batch_size'), SNAPSHOT_BATCH, SNAPSHOT_MAX_BATCH)
+    except (TypeError, ValueError):
+        return resp(400, {'error': 'invalid_batch_size'})
+    return resp(200, snapshot_balances(req.conn, batch_size))
+
+
+@route('POST', 'send_weekly_results')
+def post_send_weekly_results(req):
+    """Закрытие прошлой недели. Только с X-Admin-Token; по расписанию — tools/weekly_close.py."""
+    if not admin_authorized(req.headers):
+        return resp(403, {'error': 'forbidden'})
+    cur = req.cur
+    monday, sunday = get_current_week()
+    prev_monday = monday - timedelta(days=7)
+    cur.execute("SELECT id FROM tournaments WHERE week_start = %s", (prev_monday,))
+    prev_tournament = cur.fetchone()
+    if not prev_tournament:
+        return resp(404, {'error': 'no_previous_tournament'})
+    req.conn.commit()
+    result = close_weekly_tournament(req.conn, prev_tournament['id'], deadline=time.monotonic() + WEEKLY_CLOSE_BUDGET)
+    return resp(200, result)
+
+
+@route('POST', 'close_weeks')
+def post_close_weeks(req):
+    """Закрытие всех прошедших недель. Только с X-Admin-Token; по расписанию — tools/weekly_close.py."""
+    if not admin_authorized(req.headers):
+        return resp(403, {'error': 'forbidden'})
+    results = close_weekly_tournaments(req.conn, deadline=time.monotonic() + WEEKLY_CLOSE_BUDGET)
+    return resp(200, {'tournaments': results, 'done': all(r['status'] == 'closed' for r in results)})
+
+
+@route('POST', 'assign_daily_quests')
+def post_assign_daily_quests(req):
+    """Раздача заданий дня всем персонажам. Только с X-Admin-Token."""
+    if not admin_authorized(req.headers):
+        return resp(403, {'error': 'forbidden'})
+    result = assign_daily_quests(req.cur)
+    req.conn.commit()
+    return resp(200, result)
+
+
+@route('GET', 'accessories')
+def get_accessories(req):
+    char_id = req.qs.get('character_id', '')
+    entry = cached_catalog(req, 'accessories', 'all', load_accessories)
+    if not char_id:
+        return catalog_resp(entry, 'accessories', req.headers)
+    cur = req.cur
+    cur.execute("SELECT accessory_id, is_equipped FROM character_accessories WHERE character_id = %s", (char_id,))
+    owned = {r['accessory_id']: r['is_equipped'] for r in cur.fetchall()}
+    items = [
+        {**item, 'owned': item['id'] in owned, 'equipped': owned.get(item['id'], False)}
+        for item in entry['rows']
+    ]
+    return resp(200, {'accessories': items})
+
+
+@route('POST', 'create_clan')
+def post_create_clan(req):
+    body = req.body
+    cur = req.cur
+    char_id = body['character_id']
+    name = (body.get('name') or '').strip()
+    if not name:
+        return resp(400, {'error': 'no_name'})
+    try:
+        max_members = parse_limit(body.get('max_members'), 10, CLAN_MAX_MEMBERS)
+    except (TypeError, ValueError):
+        return resp(400, {'error': 'invalid_max_members'})
+    cur.execute(CREATE_CLAN_SQL, {
+        'cid': char_id, 'name': name, 'description': body.get('description'), 'max_members': max_members,
+    })
+    clan, member = split_row(cur.fetchone(), 'member')
+    if not clan or not member:
+        req.conn.rollback()
         cur.execute(
-            "SELECT te.*, c.name as character_name FROM tournament_entries te "
-            "JOIN characters c ON te.character_id = c.id "
-            "WHERE te.tournament_id = %s ORDER BY te.score DESC",
-            (prev_tournament['id'],)
+            "SELECT EXISTS (SELECT 1 FROM characters WHERE id = %(cid)s) AS character_exists, "
+            "EXISTS (SELECT 1 FROM clan_members WHERE character_id = %(cid)s) AS in_clan",
+            {'cid': char_id}
         )
-        entries = cur.fetchall()
-        for entry in entries:
-            data = {
-                'type': 'weekly_results',
-                'tournament_id': prev_tournament['id'],
-                'rank': entry['rank'],
-                'score': entry['score'],
-                'games_score': entry['games_score'],
-                'tricks_score': entry['tricks_score'],
-                'training_score': entry['training_score'],
-                'total_participants': len(entries),
-                'week': f"{prev_monday.strftime('%d.%m')} - {(prev_monday + timedelta(days=6)).strftime('%d.%m')}"
-            }
-            place = entry['rank'] or 0
-            create_notification(cur, entry['character_id'],
-                f'Итоги недели: {place} место!',
-                f'Турнир {prev_monday.strftime("%d.%m")} - {(prev_monday + timedelta(days=6)).strftime("%d.%m")}: {entry["score"]} очков',
-                'weekly_results', data)
-
-        conn.commit()
-        conn.close()
-        return resp(200, {'sent': len(entries)})
-
-    if method == 'GET' and action == 'accessories':
-        char_id = qs.get('character_id', '')
-        cur.execute("SELECT * FROM accessories WHERE is_available = true ORDER BY price")
-        items = cur.fetchall()
-        if char_id:
-            cur.execute("SELECT accessory_id, is_equipped FROM character_accessories WHERE character_id = %s", (char_id,))
-            owned = {r['accessory_id']: r['is_equipped'] for r in cur.fetchall()}
-            for item in items:
-                item['owned'] = item['id'] in owned
-                item['equipped'] = owned.get(item['id'], False)
-        conn.close()
-        return resp(200, {'accessories': items})
-
-    if method == 'POST' and action == 'buy_accessory':
-        char_id = body['character_id']
-        acc_id = body['accessory_id']
-
-        cur.execute("SELECT * FROM characters WHERE id = %s", (char_id,))
-        char = cur.fetchone()
-        if not char:
-            conn.close()
+        found = cur.fetchone()
+        if not found['character_exists']:
             return resp(404, {'error': 'character_not_found'})
-
-        cur.execute("SELECT * FROM accessories WHERE id = %s AND is_available = true", (acc_id,))
-        acc = cur.fetchone()
-        if not acc:
-            conn.close()
-            return resp(404, {'error': 'accessory_not_found'})
-
-        cur.execute("SELECT id FROM character_accessories WHERE character_id = %s AND accessory_id = %s", (char_id, acc_id))
-        if cur.fetchone():
-            conn.close()
-            return resp(400, {'error': 'already_owned'})
-
-        if char['kinetics'] < acc['price']:
-            conn.close()
-            return resp(400, {'error': 'not_enough_kinetics', 'needed': acc['price'], 'have': char['kinetics']})
-
-        cur.execute("UPDATE characters SET kinetics = kinetics - %s, updated_at = NOW() WHERE id = %s RETURNING *", (acc['price'], char_id))
-        char = cur.fetchone()
-        cur.execute("INSERT INTO character_accessories (character_id, accessory_id) VALUES (%s, %s)", (char_id, acc_id))
+        if found['in_clan']:
+            return resp(400, {'error': 'already_in_clan'})
+        return resp(400, {'error': 'clan_name_taken'})
+    move_clan_scores(cur, char_id, 1)
+    req.conn.commit()
+    return resp(201, {'clan': clan, 'member': member})
+
+
+@route('POST', 'join_clan')
+def post_join_clan(req):
+    body = req.body
+    cur = req.cur
+    char_id = body['character_id']
+    cur.execute(JOIN_CLAN_SQL, {'clan': body['clan_id'], 'cid': char_id})
+    clan, member = split_row(cur.fetchone(), 'member')
+    if not member:
+        req.conn.rollback()
         cur.execute(
-            "INSERT INTO kinetics_transactions (character_id, amount, transaction_type, source, description) "
-            "VALUES (%s, %s, 'spend', 'shop', %s)",
-            (char_id, -acc['price'], f'Аксессуар: {acc["name"]}')
+            "SELECT EXISTS (SELECT 1 FROM characters WHERE id = %(cid)s) AS character_exists, "
+            "EXISTS (SELECT 1 FROM clan_members WHERE character_id = %(cid)s) AS in_clan, "
+            "EXISTS (SELECT 1 FROM clans WHERE id = %(clan)s) AS clan_exists",
+            {'cid': char_id, 'clan': body['clan_id']}
         )
-        create_notification(cur, char_id, f'Новый аксессуар: {acc["name"]}!', f'{acc["description"]}', 'purchase')
-        conn.commit()
-        conn.close()
-        return resp(200, {'character': char, 'accessory': acc})
+        found = cur.fetchone()
+        if not found['character_exists']:
+            return resp(404, {'error': 'character_not_found'})
+        if not found['clan_exists']:
+            return resp(404, {'error': 'clan_not_found'})
+        if found['in_clan']:
+            return resp(400, {'error': 'already_in_clan'})
+        return resp(400, {'error': 'clan_full'})
+    move_clan_scores(cur, char_id, 1)
+    req.conn.commit()
+    return resp(200, {'clan': clan, 'member': member})
+
+
+@route('POST', 'leave_clan')
+def post_leave_clan(req):
+    body = req.body
+    cur = req.cur
+    clan = leave_clan(cur, body['character_id'])
+    if not clan:
+        req.conn.rollback()
+        return resp(400, {'error': 'not_in_clan'})
+    req.conn.commit()
+    return resp(200, {'clan': clan if clan['member_count'] else None})
+
+
+@route('POST', 'buy_accessory')
+def post_buy_accessory(req):
+    body = req.body
+    cur = req.cur
+    char_id = body['character_id']
+    acc_id = body['accessory_id']
+
+    try:
+        cur.execute(BUY_ACCESSORY_SQL, {'cid': char_id, 'acc': acc_id})
+    except ForeignKeyViolation:
+        return resp(404, {'error': 'character_not_found'})
+    char, acc, acquired = split_row(cur.fetchone(), 'accessory', 'acquired')
+    if not acc:
+        return resp(404, {'error': 'accessory_not_found'})
+    if not acquired:
+        return resp(400, {'error': 'already_owned'})
+    if not char:
+        req.conn.rollback()
+        cur.execute("SELECT kinetics FROM characters WHERE id = %s", (char_id,))
+        return resp(400, {'error': 'not_enough_kinetics', 'needed': acc['price'], 'have': cur.fetchone()['kinetics']})
 
-    conn.close()
-    return resp(404, {'error': 'unknown_action', 'action': action})
\ No newline at end of file
+    create_notification(cur, char_id, f'Новый аксессуар: {acc["name"]}!', f'{acc["description"]}', 'purchase')
+    req.conn.commit()
+    return resp(200, {'character': char, 'accessory': acc})
@@ -1,7 +1,166 @@
+import ipaddress
 import json
 import os
-from datetime import datetime
-from typing import Dict, Any, Optional
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+from psycopg2.extras import RealDictCursor, execute_values
+
+from runtime import ConnectionPool
+
+
+db_pool = ConnectionPool.from_env(max_size=2, cursor_factory=RealDictCursor)
+
+# A client batch is written in one transaction, so its size is bounded
+MAX_BATCH_EVENTS = int(os.environ.get('MAX_BATCH_EVENTS', '100'))
+
+
+# Visitors are upserted once per batch, bumping visit_count by the number of hits
+UPSERT_VISITORS_SQL = '''
+INSERT INTO visitors (visitor_uuid, user_agent, ip_address, referrer, device_type, browser,
+                      visit_count, first_visit_at, last_visit_at)
+VALUES %s
+ON CONFLICT (visitor_uuid) DO UPDATE SET
+    user_agent = EXCLUDED.user_agent,
+    ip_address = COALESCE(EXCLUDED.ip_address, visitors.ip_address),
+    device_type = EXCLUDED.device_type,
+    browser = EXCLUDED.browser,
+    visit_count = visitors.visit_count + EXCLUDED.visit_count,
+    last_visit_at = GREATEST(visitors.last_visit_at, EXCLUDED.last_visit_at),
+    updated_at = NOW()
+RETURNING id, visitor_uuid, (xmax = 0) AS inserted
+'''
+
+# Page views of a session are appended to its page_views array
+UPSERT_SESSIONS_SQL = '''
+INSERT INTO visit_sessions (visitor_id, session_uuid, started_at, ended_at, duration_seconds, pages_visited,
+                            page_views, utm_source, utm_medium, utm_campaign, utm_content, utm_term,
+                            landing_page, exit_page, bounce)
+VALUES %s
+ON CONFLICT (session_uuid) DO UPDATE SET
+    page_views = visit_sessions.page_views || EXCLUDED.page_views,
+    pages_visited = visit_sessions.pages_visited + EXCLUDED.pages_visited,
+    ended_at = GREATEST(visit_sessions.ended_at, EXCLUDED.ended_at),
+    duration_seconds = EXTRACT(EPOCH FROM GREATEST(visit_sessions.ended_at, EXCLUDED.ended_at) - visit_sessions.started_at)::int,
+    exit_page = EXCLUDED.exit_page,
+    bounce = FALSE
+'''
+
+SESSION_TEMPLATE = (
+    '(%s, %s::uuid, %s::timestamptz, %s::timestamptz, %s, %s, %s::jsonb, '
+    '%s, %s, %s, %s, %s, %s, %s, %s)'
+)
+
+
+def to_uuid(value: str) -> str:
+    '''Client ids that are not UUIDs are mapped to a stable UUIDv5'''
+    try:
+        return str(uuid.UUID(value))
+    except (ValueError, TypeError, AttributeError):
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f'kinetic-visitor:{value}'))
+
+
+def to_ip(value: str) -> Optional[str]:
+    try:
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        return None
+
+
+def write_beacons(cur, beacons: List[Dict[str, Any]]) -> Dict[str, bool]:
+    '''
+    Writes a batch of beacons with two multi-row statements
+    Returns: dict visitor_uuid -> whether the visitor row was created by this batch
+    '''
+    visitors: Dict[str, Dict[str, Any]] = {}
+    sessions: Dict[str, Dict[str, Any]] = {}
+    for b in beacons:
+        v = visitors.get(b['visitor_uuid'])
+        if v is None:
+            visitors[b['visitor_uuid']] = {**b, 'hits': 1, 'first_at': b['at']}
+        else:
+            v.update({k: b[k] for k in ('user_agent', 'device', 'browser', 'at') if b[k]})
+            v['ip'] = b['ip'] or v['ip']
+            v['hits'] += 1
+        s = sessions.get(b['session_uuid'])
+        view = {'page': b['page'], 'at': b['at']}
+        if s is None:
+            sessions[b['session_uuid']] = {**b, 'views': [view], 'first_at': b['at']}
+        else:
+            s['views'].append(view)
+            s['at'] = max(s['at'], b['at'])
+            s['page'] = b['page']
+
+    rows = execute_values(cur, UPSERT_VISITORS_SQL, [
+        (uid, v['user_agent'], v['ip'], v['referrer'], v['device'], v['browser'],
+         v['hits'], v['first_at'], v['at'])
+        for uid, v in visitors.items()
+    ], template='(%s::uuid, %s, %s::inet, %s, %s, %s, %s, %s::timestamptz, %s::timestamptz)', fetch=True)
+    visitor_ids = {str(r['visitor_uuid']): r['id'] for r in rows}
+    created = {str(r['visitor_uuid']): r['inserted'] for r in rows}
+
+    execute_values(cur, UPSERT_SESSIONS_SQL, [
+        (visitor_ids[s['visitor_uuid']], sid, s['first_at'], s['at'],
+         int((datetime.fromisoformat(s['at']) - datetime.fromisoformat(s['first_at'])).total_seconds()),
+         len(s['views']), json.dumps(s['views']),
+         s['utm_source'], s['utm_medium'], s['utm_campaign'], s['utm_content'], s['utm_term'],
+         s['landing_page'], s['page'], len(s['views']) <= 1)
+        for sid, s in sessions.items()
+    ], template=SESSION_TEMPLATE)
+    return created
+
+
+def parse_beacon(data: Dict[str, Any], headers: Dict[str, Any]) -> Dict[str, Any]:
+    '''Normalizes one tracking payload into a beacon row'''
+    user_agent = headers.get('user-agent', '') or headers.get('User-Agent', '')
+    forwarded = headers.get('x-forwarded-for', '') or headers.get('X-Forwarded-For', '')
+    ip_address = forwarded.split(',')[0].strip() or headers.get('x-real-ip', 'unknown')
+
+    # Device detection (basic)
+    device_type = 'desktop'
+    if 'mobile' in user_agent.lower():
+        device_type = 'mobile'
+    elif 'tablet' in user_agent.lower():
+        device_type = 'tablet'
+
+    # Browser detection (basic)
+    browser = 'unknown'
+    if 'chrome' in user_agent.lower():
+        browser = 'Chrome'
+    elif 'firefox' in user_agent.lower():
+        browser = 'Firefox'
+    elif 'safari' in user_agent.lower():
+        browser = 'Safari'
+    elif 'edge' in user_agent.lower():
+        browser = 'Edge'
+
+    visitor_id = data.get('visitorId') or 'unknown-visitor'
+    visitor_uuid = to_uuid(visitor_id)
+    now = datetime.now(timezone.utc)
+    # Without a client session id, one session per visitor per day
+    session_id = data.get('sessionId') or str(uuid.uuid5(uuid.NAMESPACE_URL, f'{visitor_uuid}:{now.date()}'))
+    utm = data.get('utm') or {}
+    return {
+        'visitor_id': visitor_id,
+        'visitor_uuid': visitor_uuid,
+        'session_id': session_id,
+        'session_uuid': to_uuid(session_id),
+        'user_agent': user_agent,
+        'ip': to_ip(ip_address),
+        'device': device_type,
+        'browser': browser,
+        'referrer': data.get('referrer', ''),
+        'landing_page': data.get('landingPage', '/'),
+        'page': data.get('currentPage', '/'),
+        'at': now.isoformat(),
+        'utm_source': utm.get('source', ''),
+        'utm_medium': utm.get('medium', ''),
+        'utm_campaign': utm.get('campaign', ''),
+        'utm_content': utm.get('content', ''),
+        'utm_term': utm.get('term', ''),
+    }
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -11,7 +170,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     Returns: HTTP response dict with visitor tracking results
     '''
     method: str = event.get('httpMethod', 'GET')
-    
+
     # Handle CORS OPTIONS request
     if method == 'OPTIONS':
         return {
@@ -25,7 +184,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False,
             'body': ''
         }
-    
+
     # Only allow POST for tracking
     if method != 'POST':
         return {
@@ -34,58 +193,48 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False,
             'body': json.dumps({'error': 'Method not allowed'})
         }
-    
+
     try:
-        # Parse request data
-        body_data = json.loads(event.get('body', '{}'))
-        headers = event.get('headers', {})
-        
-        # Extract visitor data
-        visitor_uuid = body_data.get('visitorId', 'unknown-visitor')
-        user_agent = headers.get('user-agent', '')
-        ip_address = headers.get('x-forwarded-for', '').split(',')[0].strip() or headers.get('x-real-ip', 'unknown')
-        referrer = body_data.get('referrer', '')
-        landing_page = body_data.get('landingPage', '/')
-        current_page = body_data.get('currentPage', '/')
-        
-        # Parse UTM parameters
-        utm_params = body_data.get('utm', {})
-        utm_source = utm_params.get('source', '')
-        utm_medium = utm_params.get('medium', '')
-        utm_campaign = utm_params.get('campaign', '')
-        
-        # Device detection (basic)
-        device_type = 'desktop'
-        if 'mobile' in user_agent.lower():
-            device_type = 'mobile'
-        elif 'tablet' in user_agent.lower():
-            device_type = 'tablet'
-        
-        # Browser detection (basic)
-        browser = 'unknown'
-        if 'chrome' in user_agent.lower():
-            browser = 'Chrome'
-        elif 'firefox' in user_agent.lower():
-            browser = 'Firefox'
-        elif 'safari' in user_agent.lower():
-            browser = 'Safari'
-        elif 'edge' in user_agent.lower():
-            browser = 'Edge'
-        
-        # Simple analytics tracking without database for now
+        # Parse request data: a single beacon or a client-side batch in "events"
+        body_data = json.loads(event.get('body', '{}') or '{}')
+        headers = event.get('headers') or {}
+        payloads = body_data.get('events') or [body_data]
+        if not isinstance(payloads, list) or len(payloads) > MAX_BATCH_EVENTS:
+            return {
+                'statusCode': 413 if isinstance(payloads, list) else 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'isBase64Encoded': False,
+                'body': json.dumps({
+                    'success': False,
+                    'error': f'events must be a list of at most {MAX_BATCH_EVENTS} beacons'
+                })
+            }
+        beacons = [parse_beacon({**body_data, **p} if p is not body_data else p, headers) for p in payloads]
+        first = beacons[0]
+
+        # Beacons of the request are coalesced and written before the response:
+        # success is returned only for rows that are already committed
+        conn = db_pool.acquire()
+        try:
+            created = write_beacons(conn.cursor(), beacons)
+            conn.commit()
+        finally:
+            db_pool.release(conn)
+        is_new_visitor = created.get(first['visitor_uuid'], False)
+
         tracking_data = {
-            'visitor_id': visitor_uuid,
-            'page': current_page,
-            'timestamp': datetime.now().isoformat(),
-            'user_agent': user_agent,
-            'device': device_type,
-            'browser': browser,
-            'referrer': referrer,
-            'utm_source': utm_source,
-            'utm_medium': utm_medium,
-            'utm_campaign': utm_campaign
+            'visitor_id': first['visitor_id'],
+            'page': first['page'],
+            'timestamp': first['at'],
+            'user_agent': first['user_agent'],
+            'device': first['device'],
+            'browser': first['browser'],
+            'referrer': first['referrer'],
+            'utm_source': first['utm_source'],
+            'utm_medium': first['utm_medium'],
+            'utm_campaign': first['utm_campaign']
         }
-        
+
         return {
             'statusCode': 200,
             'headers': {
@@ -95,14 +244,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False,
             'body': json.dumps({
                 'success': True,
-                'visitorId': visitor_uuid,
-                'sessionId': f'session-{datetime.now().timestamp()}',
-                'isNewVisitor': True,
+                'visitorId': first['visitor_id'],
+                'sessionId': first['session_id'],
+                'isNewVisitor': is_new_visitor,
+                'accepted': len(beacons),
                 'message': 'Analytics data recorded successfully',
                 'data': tracking_data
             })
         }
-        
+
     except Exception as e:
         return {
             'statusCode': 500,
@@ -115,4 +265,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'success': False,
                 'error': str(e)
             })
-        }
\ No newline at end of file
+        }
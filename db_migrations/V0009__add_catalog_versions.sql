@@ -0,0 +1,32 @@
+-- Версии справочников (трюки, достижения, аксессуары) для инвалидации кэша API
+CREATE TABLE IF NOT EXISTS catalog_versions (
+    catalog TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO catalog_versions (catalog) VALUES ('tricks'), ('achievements'), ('accessories')
+ON CONFLICT (catalog) DO NOTHING;
+
+-- Любое изменение справочника поднимает его версию
+CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE catalog_versions SET version = version + 1, updated_at = NOW() WHERE catalog = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_tricks_catalog_version ON tricks;
+CREATE TRIGGER trg_tricks_catalog_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON tricks
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+
+DROP TRIGGER IF EXISTS trg_achievements_catalog_version ON achievements;
+CREATE TRIGGER trg_achievements_catalog_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON achievements
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+
+DROP TRIGGER IF EXISTS trg_accessories_catalog_version ON accessories;
+CREATE TRIGGER trg_accessories_catalog_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON accessories
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
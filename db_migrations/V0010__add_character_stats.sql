@@ -0,0 +1,21 @@
+-- Денормализованные счётчики персонажа: профиль читается одной строкой вместо COUNT(*)
+CREATE TABLE IF NOT EXISTS character_stats (
+    character_id INTEGER PRIMARY KEY REFERENCES characters(id),
+    tricks_count INTEGER NOT NULL DEFAULT 0,
+    trainings_count INTEGER NOT NULL DEFAULT 0,
+    achievements_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Первичное заполнение по существующим данным
+INSERT INTO character_stats (character_id, tricks_count, trainings_count, achievements_count)
+SELECT c.id,
+       (SELECT COUNT(*) FROM character_tricks ct WHERE ct.character_id = c.id),
+       (SELECT COUNT(*) FROM training_visits tv WHERE tv.character_id = c.id),
+       (SELECT COUNT(*) FROM character_achievements ca WHERE ca.character_id = c.id)
+FROM characters c
+ON CONFLICT (character_id) DO UPDATE SET
+    tricks_count = EXCLUDED.tricks_count,
+    trainings_count = EXCLUDED.trainings_count,
+    achievements_count = EXCLUDED.achievements_count,
+    updated_at = NOW();
@@ -0,0 +1,27 @@
+-- Материализованный месячный рейтинг: суммы по турнирам месяца и место
+ALTER TABLE monthly_leaderboards ADD COLUMN IF NOT EXISTS games_score INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE monthly_leaderboards ADD COLUMN IF NOT EXISTS tricks_score INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE monthly_leaderboards ADD COLUMN IF NOT EXISTS training_score INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE monthly_leaderboards ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT NOW();
+
+-- Недельный рейтинг — это места в tournament_entries, их пересчитывает recalc
+CREATE INDEX IF NOT EXISTS idx_tournament_entries_rank ON tournament_entries(tournament_id, rank);
+
+INSERT INTO monthly_leaderboards (character_id, month_start, total_score, games_score, tricks_score, training_score)
+SELECT te.character_id, to_date(t.month_key || '-01', 'YYYY-MM-DD'),
+       SUM(te.score), SUM(te.games_score), SUM(te.tricks_score), SUM(te.training_score)
+FROM tournament_entries te JOIN tournaments t ON t.id = te.tournament_id
+GROUP BY te.character_id, t.month_key
+ON CONFLICT (character_id, month_start) DO UPDATE SET
+    total_score = EXCLUDED.total_score,
+    games_score = EXCLUDED.games_score,
+    tricks_score = EXCLUDED.tricks_score,
+    training_score = EXCLUDED.training_score,
+    updated_at = NOW();
+
+UPDATE monthly_leaderboards ml SET rank = r.rank
+FROM (
+    SELECT id, ROW_NUMBER() OVER (PARTITION BY month_start ORDER BY total_score DESC, character_id) AS rank
+    FROM monthly_leaderboards
+) r
+WHERE ml.id = r.id;
@@ -0,0 +1,7 @@
+-- Медиа подгружаются пачкой по списку записей
+CREATE INDEX IF NOT EXISTS idx_diary_media_entry ON diary_media(diary_entry_id);
+
+-- Keyset-пагинация дневника по (entry_date, id)
+CREATE INDEX IF NOT EXISTS idx_diary_entries_student_page ON diary_entries(student_id, entry_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_diary_entries_trainer_page ON diary_entries(trainer_id, entry_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_diary_entries_page ON diary_entries(entry_date DESC, id DESC);
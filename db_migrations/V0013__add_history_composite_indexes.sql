@@ -0,0 +1,18 @@
+-- Пересчёт турнира считает историю персонажа за неделю: (character_id, время)
+CREATE INDEX IF NOT EXISTS idx_game_results_character_created ON game_results(character_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_character_tricks_character_confirmed ON character_tricks(character_id, confirmed_at);
+CREATE INDEX IF NOT EXISTS idx_training_visits_character_date ON training_visits(character_id, visit_date DESC);
+
+-- Ленты персонажа отдаются от новых к старым без сортировки
+CREATE INDEX IF NOT EXISTS idx_char_notif_character_created ON character_notifications(character_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_kinetics_character_created ON kinetics_transactions(character_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_purchased_items_character_date ON purchased_items(character_id, purchased_at DESC);
+
+-- История турниров в публичном профиле
+CREATE INDEX IF NOT EXISTS idx_tournament_entries_character ON tournament_entries(character_id);
+
+-- Одноколоночные индексы по character_id покрываются составными
+DROP INDEX IF EXISTS idx_game_results_character;
+DROP INDEX IF EXISTS idx_character_tricks_character;
+DROP INDEX IF EXISTS idx_char_notif_character;
+DROP INDEX IF EXISTS idx_kinetics_character;
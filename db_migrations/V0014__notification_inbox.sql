@@ -0,0 +1,28 @@
+-- Счётчик непрочитанных уведомлений: значок читается из character_stats вместо COUNT(*)
+ALTER TABLE character_stats ADD COLUMN IF NOT EXISTS unread_notifications INTEGER NOT NULL DEFAULT 0;
+
+UPDATE character_stats s
+SET unread_notifications = n.cnt
+FROM (
+    SELECT character_id, COUNT(*) AS cnt
+    FROM character_notifications WHERE is_read = false
+    GROUP BY character_id
+) n
+WHERE n.character_id = s.character_id;
+
+-- Холодное хранилище прочитанных уведомлений старше срока хранения
+CREATE TABLE IF NOT EXISTS character_notifications_archive (
+    id INTEGER PRIMARY KEY,
+    character_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    message TEXT NOT NULL,
+    notification_type TEXT NOT NULL,
+    data TEXT NULL,
+    created_at TIMESTAMP NOT NULL,
+    archived_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_char_notif_archive_character ON character_notifications_archive(character_id, created_at DESC);
+
+-- Поиск кандидатов на архивацию без прохода по непрочитанным
+CREATE INDEX IF NOT EXISTS idx_char_notif_read_created ON character_notifications(created_at) WHERE is_read = true;
@@ -0,0 +1,46 @@
+-- Версия турнирной таблицы: растёт при каждом изменении очков или мест
+ALTER TABLE tournaments ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+
+-- Версия, в которой строка участника менялась последний раз: лента изменений отдаёт только новые строки
+ALTER TABLE tournament_entries ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_tournament_entries_version ON tournament_entries(tournament_id, version);
+
+-- Новые уведомления персонажа после курсора ленты изменений
+CREATE INDEX IF NOT EXISTS idx_char_notif_character_id ON character_notifications(character_id, id);
+
+-- Лента изменений: новые уведомления будят ожидающих через LISTEN/NOTIFY.
+-- Массовая рассылка сигналит один раз ('*'), а не по каждому персонажу.
+CREATE OR REPLACE FUNCTION notify_character_notifications() RETURNS trigger AS $$
+DECLARE
+    targets INTEGER;
+BEGIN
+    SELECT COUNT(DISTINCT character_id) INTO targets FROM new_rows;
+    IF targets > 100 THEN
+        PERFORM pg_notify('kinetic_notifications', '*');
+    ELSE
+        PERFORM pg_notify('kinetic_notifications', character_id::text)
+        FROM (SELECT DISTINCT character_id FROM new_rows) n;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_character_notifications_feed ON character_notifications;
+CREATE TRIGGER trg_character_notifications_feed
+    AFTER INSERT ON character_notifications
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_character_notifications();
+
+-- Новый турнир или новая версия таблицы: payload «tournament_id:version»
+CREATE OR REPLACE FUNCTION notify_tournament_version() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('kinetic_tournament', NEW.id || ':' || NEW.version);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_tournaments_feed ON tournaments;
+CREATE TRIGGER trg_tournaments_feed
+    AFTER INSERT OR UPDATE OF version ON tournaments
+    FOR EACH ROW EXECUTE FUNCTION notify_tournament_version();
@@ -0,0 +1,75 @@
+-- Журнал кинетиков: помесячные секции по created_at и остаток после каждой операции
+ALTER TABLE kinetics_transactions RENAME TO kinetics_transactions_legacy;
+ALTER SEQUENCE kinetics_transactions_id_seq OWNED BY NONE;
+
+CREATE TABLE kinetics_transactions (
+    id INTEGER NOT NULL DEFAULT nextval('kinetics_transactions_id_seq'),
+    character_id INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    transaction_type TEXT NOT NULL CHECK (transaction_type IN ('earn', 'spend')),
+    source TEXT NOT NULL,
+    description TEXT,
+    created_by TEXT,
+    balance_after INTEGER NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Страховка на случай, если секция месяца не создана заранее
+CREATE TABLE IF NOT EXISTS kinetics_transactions_default PARTITION OF kinetics_transactions DEFAULT;
+
+-- Создаёт недостающие месячные секции начиная с месяца from_date
+CREATE OR REPLACE FUNCTION ensure_kinetics_partitions(from_date DATE, months INTEGER) RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    FOR i IN 0..months - 1 LOOP
+        month_start := (date_trunc('month', from_date) + make_interval(months => i))::date;
+        partition_name := 'kinetics_transactions_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF kinetics_transactions FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, (month_start + INTERVAL '1 month')::date
+            );
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Секции от месяца самой старой операции до трёх месяцев вперёд
+SELECT ensure_kinetics_partitions(
+    f.first_month,
+    ((EXTRACT(YEAR FROM CURRENT_DATE) - EXTRACT(YEAR FROM f.first_month)) * 12
+     + EXTRACT(MONTH FROM CURRENT_DATE) - EXTRACT(MONTH FROM f.first_month))::int + 4
+)
+FROM (
+    SELECT date_trunc('month', COALESCE(MIN(created_at), NOW()))::date AS first_month
+    FROM kinetics_transactions_legacy
+) f;
+
+INSERT INTO kinetics_transactions (id, character_id, amount, transaction_type, source, description, created_by, created_at)
+SELECT id, character_id, amount, transaction_type, source, description, created_by, created_at
+FROM kinetics_transactions_legacy;
+
+DROP TABLE kinetics_transactions_legacy;
+ALTER SEQUENCE kinetics_transactions_id_seq OWNED BY kinetics_transactions.id;
+
+CREATE INDEX IF NOT EXISTS idx_kinetics_character_created ON kinetics_transactions(character_id, created_at DESC, id DESC);
+
+-- Периодические снимки остатка: баланс на момент и сверка не читают журнал целиком.
+-- 'opening' — остаток на момент ввода журнала, более ранняя история неполна.
+CREATE TABLE IF NOT EXISTS kinetics_balance_snapshots (
+    character_id INTEGER NOT NULL REFERENCES characters(id),
+    snapshot_at TIMESTAMP NOT NULL,
+    balance INTEGER NOT NULL,
+    kind TEXT NOT NULL DEFAULT 'periodic' CHECK (kind IN ('opening', 'periodic')),
+    PRIMARY KEY (character_id, snapshot_at)
+);
+
+INSERT INTO kinetics_balance_snapshots (character_id, snapshot_at, balance, kind)
+SELECT id, NOW(), kinetics, 'opening' FROM characters
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,39 @@
+-- Групповая отметка посещений: группа тренера и одно посещение персонажа в день
+ALTER TABLE training_visits ADD COLUMN IF NOT EXISTS group_name TEXT NULL;
+
+-- Повторные отметки одного дня, убранные ради уникального ключа. Награды за них
+-- остались в журнале кинетиков и в training_score прошлых турниров: архив хранит
+-- исходные строки и самую раннюю отметку того же дня, которая осталась в таблице.
+CREATE TABLE IF NOT EXISTS training_visits_duplicates (
+    LIKE training_visits INCLUDING DEFAULTS,
+    kept_visit_id INTEGER NOT NULL,
+    archived_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Повторные отметки одного дня схлопываются в самую раннюю, остальные уходят в архив
+WITH ranked AS (
+    SELECT id, MIN(id) OVER (PARTITION BY character_id, visit_date) AS kept_visit_id
+    FROM training_visits
+),
+moved AS (
+    DELETE FROM training_visits tv
+    USING ranked r
+    WHERE r.id = tv.id AND r.kept_visit_id < tv.id
+    RETURNING tv.*, r.kept_visit_id
+)
+INSERT INTO training_visits_duplicates
+SELECT * FROM moved;
+
+-- Счётчик тренировок после переноса дублей
+UPDATE character_stats s
+SET trainings_count = COALESCE(v.cnt, 0), updated_at = NOW()
+FROM character_stats s2
+LEFT JOIN (
+    SELECT character_id, COUNT(*) AS cnt FROM training_visits GROUP BY character_id
+) v ON v.character_id = s2.character_id
+WHERE s2.character_id = s.character_id
+  AND s.trainings_count IS DISTINCT FROM COALESCE(v.cnt, 0);
+
+-- Уникальный ключ заменяет индекс (character_id, visit_date DESC): он читается и в обратном порядке
+ALTER TABLE training_visits ADD CONSTRAINT training_visits_character_date_key UNIQUE (character_id, visit_date);
+DROP INDEX IF EXISTS idx_training_visits_character_date;
@@ -0,0 +1,8 @@
+-- Закрытие недели: active → closing (очки и места заморожены) → closed (итоги разосланы).
+-- results_sent_through — место последнего участника, которому ушли итоги: повторный запуск продолжает с него.
+ALTER TABLE tournaments ADD COLUMN IF NOT EXISTS participants INTEGER NULL;
+ALTER TABLE tournaments ADD COLUMN IF NOT EXISTS results_sent_through INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE tournaments ADD COLUMN IF NOT EXISTS closed_at TIMESTAMP NULL;
+
+-- Поиск незакрытых прошедших недель
+CREATE INDEX IF NOT EXISTS idx_tournaments_open ON tournaments(week_start) WHERE status <> 'closed';
@@ -0,0 +1,12 @@
+-- Каталог персонажей: keyset-пагинация по (level, experience, id) от сильных к слабым
+CREATE INDEX IF NOT EXISTS idx_characters_directory ON characters(level DESC, experience DESC, id DESC);
+
+-- Фильтр по виду спорта: членство в массиве sport_types
+CREATE INDEX IF NOT EXISTS idx_characters_sport_types ON characters USING GIN (sport_types);
+
+-- Ученики тренера в порядке каталога
+CREATE INDEX IF NOT EXISTS idx_characters_trainer_directory ON characters(trainer_name, level DESC, experience DESC, id DESC)
+    WHERE trainer_name IS NOT NULL;
+
+-- Префикс составного индекса каталога
+DROP INDEX IF EXISTS idx_characters_level;
@@ -0,0 +1,17 @@
+-- Задания дня: набор выбирается один раз на дату и раздаётся всем персонажам одним запросом.
+-- Строка в quest_assignments — отметка, что раздача за день уже прошла.
+CREATE TABLE IF NOT EXISTS quest_assignments (
+  quest_date DATE PRIMARY KEY,
+  quest_ids INTEGER[] NOT NULL,
+  assigned_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Задания, прогресс которых считают игры и тренировки
+INSERT INTO daily_quests (name, description, quest_type, requirement_value, reward_kinetics, reward_experience)
+SELECT v.name, v.description, v.quest_type, v.requirement_value, v.reward_kinetics, v.reward_experience
+FROM (VALUES
+  ('Игрок дня', 'Сыграй 3 мини-игры', 'games_daily', 3, 30, 50),
+  ('Победитель', 'Выиграй 2 мини-игры', 'wins_daily', 2, 40, 60),
+  ('На тренировке', 'Посети тренировку', 'training_daily', 1, 40, 80)
+) AS v(name, description, quest_type, requirement_value, reward_kinetics, reward_experience)
+WHERE NOT EXISTS (SELECT 1 FROM daily_quests q WHERE q.quest_type = v.quest_type);
@@ -0,0 +1,81 @@
+-- Число участников клана: вступление проверяет лимит условным UPDATE, без подсчёта строк
+ALTER TABLE clans ADD COLUMN IF NOT EXISTS member_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE clans c SET member_count = m.cnt
+FROM (SELECT clan_id, COUNT(*) AS cnt FROM clan_members GROUP BY clan_id) m
+WHERE c.id = m.clan_id AND c.member_count <> m.cnt;
+
+-- Очки кланов за неделю (week_start турнира) и месяц (month_key турнира).
+-- Поддерживаются приращениями: таблица клана читается готовой, по индексу.
+CREATE TABLE IF NOT EXISTS clan_scores (
+    clan_id INTEGER NOT NULL,
+    period TEXT NOT NULL CHECK (period IN ('weekly', 'monthly')),
+    period_start DATE NOT NULL,
+    score INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (period, period_start, clan_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_clan_scores_rank ON clan_scores(period, period_start, score DESC, clan_id);
+CREATE INDEX IF NOT EXISTS idx_clan_scores_clan ON clan_scores(clan_id);
+
+-- Участники клана страницами по id; заменяет индекс по одному clan_id
+CREATE INDEX IF NOT EXISTS idx_clan_members_clan_id ON clan_members(clan_id, id);
+DROP INDEX IF EXISTS idx_clan_members_clan;
+
+-- Приращения очков участников — в недельную и месячную строку их клана.
+-- Строки кланов обновляются в одном порядке, параллельные пересчёты не встают в deadlock.
+CREATE OR REPLACE FUNCTION add_clan_scores(tids INTEGER[], cids INTEGER[], deltas INTEGER[]) RETURNS void AS $$
+    INSERT INTO clan_scores (clan_id, period, period_start, score)
+    SELECT cm.clan_id, p.period, p.period_start, SUM(d.delta)
+    FROM unnest(tids, cids, deltas) AS d(tournament_id, character_id, delta)
+    JOIN clan_members cm ON cm.character_id = d.character_id
+    JOIN tournaments t ON t.id = d.tournament_id
+    CROSS JOIN LATERAL (
+        VALUES ('weekly', t.week_start), ('monthly', to_date(t.month_key || '-01', 'YYYY-MM-DD'))
+    ) AS p(period, period_start)
+    WHERE d.delta <> 0
+    GROUP BY cm.clan_id, p.period, p.period_start
+    ORDER BY p.period, p.period_start, cm.clan_id
+    ON CONFLICT (period, period_start, clan_id) DO UPDATE
+    SET score = clan_scores.score + EXCLUDED.score, updated_at = NOW()
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION tournament_entries_clan_scores() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM add_clan_scores(array_agg(tournament_id), array_agg(character_id), array_agg(score))
+        FROM new_rows WHERE score <> 0;
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM add_clan_scores(array_agg(n.tournament_id), array_agg(n.character_id), array_agg(n.score - o.score))
+        FROM new_rows n JOIN old_rows o ON o.id = n.id WHERE n.score <> o.score;
+    ELSE
+        PERFORM add_clan_scores(array_agg(tournament_id), array_agg(character_id), array_agg(-score))
+        FROM old_rows WHERE score <> 0;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_tournament_entries_clan_insert ON tournament_entries;
+CREATE TRIGGER trg_tournament_entries_clan_insert
+    AFTER INSERT ON tournament_entries
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tournament_entries_clan_scores();
+
+DROP TRIGGER IF EXISTS trg_tournament_entries_clan_update ON tournament_entries;
+CREATE TRIGGER trg_tournament_entries_clan_update
+    AFTER UPDATE ON tournament_entries
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tournament_entries_clan_scores();
+
+DROP TRIGGER IF EXISTS trg_tournament_entries_clan_delete ON tournament_entries;
+CREATE TRIGGER trg_tournament_entries_clan_delete
+    AFTER DELETE ON tournament_entries
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tournament_entries_clan_scores();
+
+-- Очки существующих участников
+SELECT add_clan_scores(array_agg(te.tournament_id), array_agg(te.character_id), array_agg(te.score))
+FROM tournament_entries te JOIN clan_members cm ON cm.character_id = te.character_id
+WHERE te.score <> 0 AND NOT EXISTS (SELECT 1 FROM clan_scores);
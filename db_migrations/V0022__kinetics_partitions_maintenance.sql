@@ -0,0 +1,60 @@
+-- Журнал кинетиков ссылается на персонажа, как и остальные таблицы персонажа
+ALTER TABLE kinetics_transactions DROP CONSTRAINT IF EXISTS kinetics_transactions_character_id_fkey;
+ALTER TABLE kinetics_transactions ADD CONSTRAINT kinetics_transactions_character_id_fkey
+    FOREIGN KEY (character_id) REFERENCES characters(id);
+
+-- Секция месяца создаётся и тогда, когда его строки уже попали в секцию по умолчанию:
+-- они переносятся в новую таблицу, и та подключается секцией месяца.
+-- Без этого CREATE TABLE ... PARTITION OF падает на конфликтующих строках.
+CREATE OR REPLACE FUNCTION ensure_kinetics_partitions(from_date DATE, months INTEGER) RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE;
+    month_end DATE;
+    partition_name TEXT;
+    moved INTEGER;
+    created INTEGER := 0;
+BEGIN
+    FOR i IN 0..months - 1 LOOP
+        month_start := (date_trunc('month', from_date) + make_interval(months => i))::date;
+        month_end := (month_start + INTERVAL '1 month')::date;
+        partition_name := 'kinetics_transactions_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            -- Новые строки не попадут в секцию по умолчанию между переносом и подключением
+            LOCK TABLE kinetics_transactions_default IN ACCESS EXCLUSIVE MODE;
+            IF EXISTS (
+                SELECT 1 FROM kinetics_transactions_default
+                WHERE created_at >= month_start AND created_at < month_end
+            ) THEN
+                EXECUTE format(
+                    'CREATE TABLE %I (LIKE kinetics_transactions INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                    partition_name
+                );
+                EXECUTE format(
+                    'WITH m AS (DELETE FROM kinetics_transactions_default WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                    'INSERT INTO %I SELECT * FROM m',
+                    month_start, month_end, partition_name
+                );
+                GET DIAGNOSTICS moved = ROW_COUNT;
+                EXECUTE format(
+                    'ALTER TABLE kinetics_transactions ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, month_end
+                );
+                RAISE NOTICE '%: % rows moved from kinetics_transactions_default', partition_name, moved;
+            ELSE
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF kinetics_transactions FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, month_end
+                );
+            END IF;
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Месяцы, строки которых уже лежат в секции по умолчанию, и три месяца вперёд
+SELECT ensure_kinetics_partitions(m.month_start, 1)
+FROM (SELECT DISTINCT date_trunc('month', created_at)::date AS month_start FROM kinetics_transactions_default) m;
+
+SELECT ensure_kinetics_partitions(CURRENT_DATE, 4);
@@ -1,4 +1,4 @@
-import { useState, useEffect, useCallback } from 'react';
+import { useState, useEffect, useCallback, useRef } from 'react';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import Icon from '@/components/ui/icon';
@@ -16,23 +16,31 @@ const NotificationBell = ({ characterId }: NotificationBellProps) => {
   const [showPanel, setShowPanel] = useState(false);
   const [selectedNotif, setSelectedNotif] = useState<CharacterNotification | null>(null);
 
+  const lastCount = useRef<number | null>(null);
+
   const loadNotifications = useCallback(async () => {
     const { notifications: notifs, unread_count } = await api.getNotifications(characterId);
     setNotifications(notifs);
     setUnreadCount(unread_count);
+    lastCount.current = unread_count;
   }, [characterId]);
 
   useEffect(() => {
     loadNotifications();
-    const interval = setInterval(loadNotifications, 15000);
+    // Опрашиваем только счётчик; список перечитываем, когда он изменился
+    const interval = setInterval(async () => {
+      const count = await api.getUnreadCount(characterId);
+      if (count !== lastCount.current) loadNotifications();
+    }, 15000);
     return () => clearInterval(interval);
-  }, [loadNotifications]);
+  }, [characterId, loadNotifications]);
 
   const handleOpen = async () => {
     setShowPanel(true);
     if (unreadCount > 0) {
       await api.markNotificationsRead(characterId);
       setUnreadCount(0);
+      lastCount.current = 0;
       setNotifications(prev => prev.map(n => ({ ...n, is_read: true })));
     }
   };
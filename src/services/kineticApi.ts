@@ -43,6 +43,16 @@ export async function getAllCharacters() {
   return data.characters || [];
 }
 
+export async function getCharacterDirectory(filters: { sportType?: string; trainer?: string; cursor?: string; limit?: number } = {}) {
+  const params: Record<string, string> = { action: 'directory' };
+  if (filters.sportType) params.sport_type = filters.sportType;
+  if (filters.trainer) params.trainer = filters.trainer;
+  if (filters.cursor) params.cursor = filters.cursor;
+  if (filters.limit) params.limit = String(filters.limit);
+  const { data } = await request('GET', params);
+  return { characters: data.characters || [], nextCursor: data.next_cursor as string | null };
+}
+
 export async function getTricks(sportType: string) {
   const { data } = await request('GET', { action: 'tricks', sport_type: sportType });
   return data.tricks || [];
@@ -110,9 +120,16 @@ export async function getTransactions(characterId: number): Promise<KineticsTran
   return data.transactions || [];
 }
 
-export async function getNotifications(characterId: number): Promise<{ notifications: CharacterNotification[]; unread_count: number }> {
-  const { data } = await request('GET', { action: 'notifications', character_id: String(characterId) });
-  return { notifications: data.notifications || [], unread_count: data.unread_count || 0 };
+export async function getNotifications(characterId: number, cursor?: string): Promise<{ notifications: CharacterNotification[]; unread_count: number; next_cursor: string | null }> {
+  const params: Record<string, string> = { action: 'notifications', character_id: String(characterId) };
+  if (cursor) params.cursor = cursor;
+  const { data } = await request('GET', params);
+  return { notifications: data.notifications || [], unread_count: data.unread_count || 0, next_cursor: data.next_cursor || null };
+}
+
+export async function getUnreadCount(characterId: number): Promise<number> {
+  const { data } = await request('GET', { action: 'unread_count', character_id: String(characterId) });
+  return data.unread_count || 0;
 }
 
 export async function markNotificationsRead(characterId: number, notificationIds?: number[]) {
@@ -201,6 +218,18 @@ export async function addTrainingVisit(characterId: number, visitDate: string, c
   return data;
 }
 
+export async function addTrainingVisits(characterIds: number[], visitDate: string, groupName?: string, confirmedBy?: string, notes?: string) {
+  const { data } = await request('POST', {}, {
+    action: 'add_training_visits',
+    character_ids: characterIds,
+    visit_date: visitDate,
+    group_name: groupName,
+    confirmed_by: confirmedBy,
+    notes,
+  });
+  return data;
+}
+
 export async function getTrainingVisits(characterId: number): Promise<TrainingVisit[]> {
   const { data } = await request('GET', { action: 'training_visits', character_id: String(characterId) });
   return data.visits || [];
@@ -246,11 +275,11 @@ export async function sendWeeklyResults() {
 }
 
 export default {
-  getMyCharacter, getAllCharacters, getTricks, getMasteredTricks,
+  getMyCharacter, getAllCharacters, getCharacterDirectory, getTricks, getMasteredTricks,
   createCharacter, updateCharacter, addKinetics, confirmTricks,
-  gameComplete, getTransactions, getNotifications, markNotificationsRead,
+  gameComplete, getTransactions, getNotifications, getUnreadCount, markNotificationsRead,
   getAchievements, purchaseCustomization, purchaseItem, getPurchasedItems,
   addSport, getCurrentTournament, joinTournament, getLeaderboard,
-  getPublicProfile, addTrainingVisit, getTrainingVisits, setTrainer, setAge,
+  getPublicProfile, addTrainingVisit, addTrainingVisits, getTrainingVisits, setTrainer, setAge,
   getAccessories, buyAccessory, sendWeeklyResults, getAvatarForSport,
 };
\ No newline at end of file
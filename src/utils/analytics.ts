@@ -1,6 +1,7 @@
 // Analytics utility for tracking website visitors
 export interface VisitorData {
   visitorId?: string;
+  sessionId?: string;
   referrer?: string;
   landingPage?: string;
   currentPage?: string;
@@ -67,6 +68,7 @@ class Analytics {
     try {
       const visitorData: VisitorData = {
         visitorId: this.visitorId || undefined,
+        sessionId: this.sessionId || undefined,
         referrer: document.referrer || undefined,
         landingPage: window.location.pathname,
         currentPage: window.location.pathname,
@@ -0,0 +1,106 @@
+"""Нагрузочный бенчмарк visitor-analytics: поток маяков из одного воркера.
+
+Вызывает handler напрямую: по --beacons маяков для каждого размера пачки
+(один маяк в запросе или массив events от клиента), печатает маяков в секунду
+и p50/p95 запроса. Каждый ответ 200 означает, что маяки уже в БД, поэтому в
+конце visit_count посетителей и pages_visited их сессий сверяются с числом
+отправленных маяков; при расхождении код выхода 1.
+
+Только для одноразовой БД с применёнными миграциями:
+
+    DATABASE_URL=... python tools/beacon_bench.py --beacons 5000 --batch 1,10,50
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from functions import load_function  # tools/functions.py
+
+PAGES = ['/', '/shop', '/tricks', '/profile', '/tournament']
+
+CHECK_SQL = """
+WITH v AS (SELECT id, visit_count FROM visitors WHERE visitor_uuid = ANY(%s::uuid[]))
+SELECT (SELECT COALESCE(SUM(visit_count), 0) FROM v) AS visits,
+       (SELECT COALESCE(SUM(pages_visited), 0) FROM visit_sessions WHERE visitor_id IN (SELECT id FROM v)) AS page_views
+"""
+
+
+def make_event(rng, visitors, sessions, size):
+    visitor = rng.choice(visitors)
+    events = [{'currentPage': rng.choice(PAGES)} for _ in range(size)]
+    body = {'visitorId': visitor, 'sessionId': sessions[visitor], 'referrer': '', 'landingPage': '/'}
+    if size == 1:
+        body.update(events[0])
+    else:
+        body['events'] = events
+    headers = {'User-Agent': 'Mozilla/5.0 Chrome/120', 'X-Forwarded-For': f'10.1.{rng.randint(0, 255)}.{rng.randint(1, 254)}'}
+    return {'httpMethod': 'POST', 'headers': headers, 'body': json.dumps(body)}
+
+
+def run(handler, rng, visitors, sessions, beacons, size):
+    samples, errors, sent = [], 0, 0
+    started = time.perf_counter()
+    while sent < beacons:
+        n = min(size, beacons - sent)
+        event = make_event(rng, visitors, sessions, n)
+        t0 = time.perf_counter()
+        result = handler(event, None)
+        samples.append((time.perf_counter() - t0) * 1000)
+        if result['statusCode'] == 200:
+            sent += n
+        else:
+            errors += 1
+            if errors > 10:
+                print(f"too many errors: {result['body']}", file=sys.stderr)
+                raise SystemExit(2)
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    return {
+        'beacons_per_s': beacons / elapsed,
+        'p50': statistics.median(samples),
+        'p95': samples[max(int(len(samples) * 0.95) - 1, 0)],
+        'requests': len(samples),
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк приёма маяков visitor-analytics.')
+    parser.add_argument('--beacons', type=int, default=5000, help='маяков на каждый размер пачки')
+    parser.add_argument('--batch', default='1,10,50', help='размеры пачек events через запятую')
+    parser.add_argument('--visitors', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    visitors = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(args.visitors)]
+    sessions = {v: str(uuid.UUID(int=rng.getrandbits(128), version=4)) for v in visitors}
+    handler = load_function('visitor-analytics').handler
+    sizes = [int(s) for s in args.batch.split(',')]
+
+    print(f"{'batch':>6}{'beacons/s':>12}{'p50 ms':>9}{'p95 ms':>9}{'requests':>10}")
+    for size in sizes:
+        r = run(handler, rng, visitors, sessions, args.beacons, size)
+        print(f"{size:>6}{r['beacons_per_s']:>12.0f}{r['p50']:>9.2f}{r['p95']:>9.2f}{r['requests']:>10}")
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=RealDictCursor)
+    cur = conn.cursor()
+    cur.execute(CHECK_SQL, (visitors,))
+    row = cur.fetchone()
+    conn.close()
+    expected = args.beacons * len(sizes)
+    ok = row['visits'] == expected and row['page_views'] == expected
+    print(f"stored: {row['visits']} visits, {row['page_views']} page views, sent {expected}: {'ok' if ok else 'MISMATCH'}")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Проверка ленты изменений kinetic-api (action=changes) на локальной Postgres.
+
+Нужна БД с применёнными миграциями; персонаж создаётся скриптом.
+
+    DATABASE_URL=... python tools/changefeed_check.py
+"""
+import json
+import sys
+import threading
+import time
+import uuid
+
+from functions import load_api  # tools/functions.py
+
+
+def call(api, method, params):
+    event = {'httpMethod': method, 'queryStringParameters': {}}
+    if method == 'GET':
+        event['queryStringParameters'] = {k: str(v) for k, v in params.items()}
+    else:
+        event['body'] = json.dumps(params)
+    result = api.handler(event, None)
+    body = json.loads(result['body']) if result.get('body') else None
+    return result['statusCode'], body, result.get('headers', {})
+
+
+def check(name, condition, detail=''):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}{': ' + str(detail) if detail else ''}")
+    return condition
+
+
+def main():
+    api = load_api()
+    status, body, _ = call(api, 'POST', {
+        'action': 'create_character', 'user_id': f'feed-{uuid.uuid4()}', 'name': 'Feed', 'sport_type': 'skate',
+    })
+    cid = body['character']['id']
+    results = []
+
+    status, body, _ = call(api, 'GET', {'action': 'changes', 'character_id': cid})
+    results.append(check('без курсора — текущая позиция', status == 200 and body['cursor'], body and body['cursor']))
+    cursor = body['cursor']
+
+    started = time.monotonic()
+    status, _, headers = call(api, 'GET', {'action': 'changes', 'character_id': cid, 'since': cursor, 'timeout': 1})
+    waited = time.monotonic() - started
+    results.append(check('нет изменений — 304 по таймауту', status == 304 and 0.9 <= waited < 2, f'{waited:.2f}s'))
+    results.append(check('курсор в заголовке 304', headers.get('X-Changes-Cursor') == cursor))
+
+    polled = {}
+
+    def long_poll():
+        t0 = time.monotonic()
+        polled['status'], polled['body'], _ = call(api, 'GET', {
+            'action': 'changes', 'character_id': cid, 'since': cursor, 'timeout': 10,
+        })
+        polled['latency'] = time.monotonic() - t0
+
+    thread = threading.Thread(target=long_poll)
+    thread.start()
+    time.sleep(0.5)
+    pool_in_use = api.db_pool.stats()['in_use']
+    results.append(check('ожидание не держит соединение пула', pool_in_use == 0, f'in_use={pool_in_use}'))
+    call(api, 'POST', {'action': 'add_kinetics', 'character_id': cid, 'amount': 5, 'description': 'feed'})
+    thread.join(15)
+    results.append(check(
+        'уведомление будит ожидание',
+        polled.get('status') == 200 and len(polled['body']['notifications']) == 1 and polled['latency'] < 2,
+        f"{polled.get('latency', 0):.2f}s",
+    ))
+    cursor = polled['body']['cursor']
+
+    thread = threading.Thread(target=long_poll)
+    thread.start()
+    time.sleep(0.5)
+    call(api, 'POST', {'action': 'join_tournament', 'character_id': cid})
+    thread.join(15)
+    entries = polled['body']['entries'] if polled.get('status') == 200 else []
+    results.append(check(
+        'пересчёт турнира отдаёт изменившиеся строки',
+        any(e['character_id'] == cid for e in entries),
+        f'{len(entries)} entries',
+    ))
+
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Бенчмарк кланов: большие кланы, вступления, пересчёт очков и таблица кланов.
+
+Создаёт --clans кланов по --members участников из персонажей вне кланов
+(вступление — через handler), затем меняет очки участников пересчётом турнира
+и пачкой посещений и сравнивает чтение таблицы кланов из clan_scores с
+подсчётом на лету по clan_members и tournament_entries. В конце сверяет
+недельные очки с подсчётом на лету, а месячные — с суммой недель; при
+расхождении код выхода 1.
+
+Для одноразовой БД с данными (например, после tools/datagen.py):
+
+    DATABASE_URL=... python tools/datagen.py --characters 50000
+    DATABASE_URL=... python tools/clan_bench.py --clans 10 --members 2500
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+
+from functions import load_api  # tools/functions.py
+
+# Прежний способ: очки кланов собираются из участников на каждом запросе
+ON_THE_FLY_SQL = """
+SELECT cm.clan_id, SUM(te.score) AS score
+FROM clan_members cm
+JOIN tournament_entries te ON te.character_id = cm.character_id
+JOIN tournaments t ON t.id = te.tournament_id
+WHERE t.week_start = %(monday)s
+GROUP BY cm.clan_id
+ORDER BY score DESC, cm.clan_id
+LIMIT %(limit)s
+"""
+
+# Кланы, у которых очки недели не совпадают с суммой по текущим участникам
+WEEKLY_DRIFT_SQL = """
+WITH actual AS (
+    SELECT cm.clan_id, SUM(te.score) AS score
+    FROM clan_members cm
+    JOIN tournament_entries te ON te.character_id = cm.character_id
+    JOIN tournaments t ON t.id = te.tournament_id
+    WHERE t.week_start = %(monday)s
+    GROUP BY cm.clan_id
+),
+stored AS (
+    SELECT clan_id, score FROM clan_scores WHERE period = 'weekly' AND period_start = %(monday)s
+)
+SELECT COALESCE(a.clan_id, s.clan_id) AS clan_id, a.score AS actual, s.score AS stored
+FROM actual a FULL JOIN stored s ON s.clan_id = a.clan_id
+WHERE COALESCE(a.score, 0) <> COALESCE(s.score, 0)
+"""
+
+# Месяц клана — сумма его недель
+MONTHLY_DRIFT_SQL = """
+SELECT m.clan_id, m.period_start, m.score, COALESCE(SUM(w.score), 0) AS weeks
+FROM clan_scores m
+LEFT JOIN clan_scores w ON w.clan_id = m.clan_id AND w.period = 'weekly'
+    AND date_trunc('month', w.period_start)::date = m.period_start
+WHERE m.period = 'monthly'
+GROUP BY m.clan_id, m.period_start, m.score
+HAVING m.score <> COALESCE(SUM(w.score), 0)
+"""
+
+
+def call(api, method, action, **params):
+    event = {'httpMethod': method, 'queryStringParameters': {'action': action}}
+    if method == 'GET':
+        event['queryStringParameters'].update({k: str(v) for k, v in params.items()})
+    else:
+        event['body'] = json.dumps({'action': action, **params})
+    started = time.perf_counter()
+    result = api.handler(event, None)
+    elapsed = (time.perf_counter() - started) * 1000
+    return result['statusCode'], json.loads(result['body']) if result['body'] else None, elapsed
+
+
+def timings(samples):
+    samples = sorted(samples)
+    return f'p50 {statistics.median(samples):.2f} ms, p95 {samples[int(len(samples) * 0.95) - 1]:.2f} ms, n={len(samples)}'
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк кланов.')
+    parser.add_argument('--clans', type=int, default=10)
+    parser.add_argument('--members', type=int, default=2000, help='участников в клане, до CLAN_MAX_MEMBERS')
+    parser.add_argument('--visits', type=int, default=500, help='посещений в пачке add_training_visits')
+    parser.add_argument('--games', type=int, default=200, help='игр участников перед пересчётом турнира')
+    parser.add_argument('--reads', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    api = load_api()
+    rng = random.Random(args.seed)
+    members = min(args.members, api.CLAN_MAX_MEMBERS)
+    conn = api.db_pool.acquire()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT id FROM characters c WHERE NOT EXISTS (SELECT 1 FROM clan_members WHERE character_id = c.id) "
+        "ORDER BY id LIMIT %s",
+        (args.clans * members,)
+    )
+    free = [r['id'] for r in cur.fetchall()]
+    conn.rollback()
+    if len(free) < args.clans * members:
+        print(f'only {len(free)} characters outside clans, need {args.clans * members}', file=sys.stderr)
+        raise SystemExit(2)
+    rng.shuffle(free)
+
+    joins, clan_ids = [], []
+    for n in range(args.clans):
+        group = free[n * members:(n + 1) * members]
+        status, body, _ = call(api, 'POST', 'create_clan', character_id=group[0],
+                               name=f'bench-{args.seed}-{n}-{int(time.time())}', max_members=members)
+        if status != 201:
+            print(f'create_clan: {status} {body}', file=sys.stderr)
+            raise SystemExit(2)
+        clan_ids.append(body['clan']['id'])
+        for cid in group[1:]:
+            status, body, elapsed = call(api, 'POST', 'join_clan', character_id=cid, clan_id=clan_ids[-1])
+            if status != 200:
+                print(f'join_clan {cid}: {status} {body}', file=sys.stderr)
+                raise SystemExit(2)
+            joins.append(elapsed)
+        print(f'clan {clan_ids[-1]}: {members} members', file=sys.stderr, flush=True)
+    print(f'join_clan: {timings(joins)}')
+
+    bench_members = free[:args.clans * members]
+    tournament = api.get_or_create_tournament(cur)
+    conn.commit()
+    for cid in rng.sample(bench_members, min(args.games, len(bench_members))):
+        call(api, 'POST', 'game_complete', character_id=cid, earned_xp=5, earned_kinetics=1)
+    started = time.perf_counter()
+    updated = api.recalc_tournament_scores(cur, tournament['id'])
+    conn.commit()
+    print(f"recalc_tournament_scores: {(time.perf_counter() - started) * 1000:.1f} ms, {updated} entries changed")
+
+    visitors = rng.sample(bench_members, min(args.visits, len(bench_members)))
+    status, body, elapsed = call(api, 'POST', 'add_training_visits', character_ids=visitors, group_name='clan-bench')
+    print(f"add_training_visits: {elapsed:.1f} ms, {body['added'] if body else status} visits")
+
+    for period in ('weekly', 'monthly'):
+        samples = [call(api, 'GET', 'clan_leaderboard', period=period, limit=50)[2] for _ in range(args.reads)]
+        print(f'clan_leaderboard {period}: {timings(samples)}')
+    mine = [call(api, 'GET', 'clan_leaderboard', period='weekly', clan_id=rng.choice(clan_ids))[2] for _ in range(args.reads)]
+    print(f'clan_leaderboard with rank: {timings(mine)}')
+    monday, _ = api.get_current_week()
+    on_the_fly = timed(lambda: (cur.execute(ON_THE_FLY_SQL, {'monday': monday, 'limit': 50}), cur.fetchall()), args.reads)
+    conn.rollback()
+    print(f'on-the-fly aggregate: {timings(on_the_fly)}')
+
+    cur.execute(WEEKLY_DRIFT_SQL, {'monday': monday})
+    weekly = cur.fetchall()
+    cur.execute(MONTHLY_DRIFT_SQL)
+    monthly = cur.fetchall()
+    conn.rollback()
+    api.db_pool.release(conn)
+    print(f'weekly drift: {len(weekly)} clans, monthly drift: {len(monthly)} clans')
+    for row in (weekly + monthly)[:10]:
+        print(f'  {dict(row)}')
+    raise SystemExit(1 if weekly or monthly else 0)
+
+
+if __name__ == '__main__':
+    main()
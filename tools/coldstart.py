@@ -0,0 +1,87 @@
+"""Замер холодного старта функции: время импорта модуля и латентность первого запроса.
+
+Каждый прогон — отдельный процесс python, как у свежего инстанса облачной функции.
+
+    DATABASE_URL=... python tools/coldstart.py --runs 20 --function kinetic-api
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Выполняется в дочернем процессе: импорт модуля и первые запросы по сценарию
+PROBE = r'''
+import importlib.util, json, os, sys, time
+path, scenario = sys.argv[1], json.loads(sys.argv[2])
+t0 = time.perf_counter()
+sys.path.insert(0, os.path.dirname(path))
+spec = importlib.util.spec_from_file_location('fn', path)
+mod = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mod)
+result = {'import_ms': (time.perf_counter() - t0) * 1000}
+for name, event in scenario:
+    t = time.perf_counter()
+    status = mod.handler(event, None)['statusCode']
+    result[name] = {'ms': (time.perf_counter() - t) * 1000, 'status': status}
+print(json.dumps(result))
+'''
+
+SCENARIOS = {
+    'kinetic-api': [
+        ('options', {'httpMethod': 'OPTIONS'}),
+        ('unknown', {'httpMethod': 'GET', 'queryStringParameters': {'action': 'unknown'}}),
+        ('tricks_first', {'httpMethod': 'GET', 'queryStringParameters': {'action': 'tricks'}}),
+        ('tricks_cached', {'httpMethod': 'GET', 'queryStringParameters': {'action': 'tricks'}}),
+        ('all_characters', {'httpMethod': 'GET', 'queryStringParameters': {'action': 'all_characters'}}),
+    ],
+    'diary': [
+        ('options', {'httpMethod': 'OPTIONS'}),
+        ('entries', {'httpMethod': 'GET', 'path': '/entries', 'headers': {'X-User-Id': '1'}}),
+    ],
+    'visitor-analytics': [
+        ('options', {'httpMethod': 'OPTIONS'}),
+        ('beacon', {'httpMethod': 'POST', 'body': json.dumps({'visitorId': 'coldstart'})}),
+    ],
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run(function, runs):
+    path = os.path.join(ROOT, 'backend', function, 'index.py')
+    scenario = json.dumps(SCENARIOS[function])
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', PROBE, path, scenario],
+                             check=True, capture_output=True, text=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    report = {}
+    for key in samples[0]:
+        values = [s[key] if key == 'import_ms' else s[key]['ms'] for s in samples]
+        report[key] = {
+            'p50_ms': round(statistics.median(values), 2),
+            'p95_ms': round(percentile(values, 95), 2),
+            'max_ms': round(max(values), 2),
+        }
+        if key != 'import_ms':
+            report[key]['status'] = samples[0][key]['status']
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--function', default='kinetic-api', choices=sorted(SCENARIOS))
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps({'function': args.function, 'runs': args.runs, 'results': run(args.function, args.runs)}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
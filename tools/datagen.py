@@ -0,0 +1,691 @@
+"""Генератор данных масштаба для схем Kinetic Universe, дневника и аналитики.
+
+Заполняет все таблицы из db_migrations (справочники трюков, достижений,
+заданий и аксессуаров берутся из миграций как есть). Активность персонажа
+распределена по степенному закону: немногие «ядровые» игроки дают большую
+часть игр, трюков и посещений. Журнал кинетиков проигрывается по времени,
+поэтому остатки, покупки и взносы за турниры согласованы с историей, а счётчики
+персонажа и character_stats сходятся с таблицами активности.
+
+Строки за один проход пишутся во временные файлы по таблицам и загружаются
+через COPY в порядке внешних ключей; производные данные (очки и места турниров,
+месячный рейтинг, снимки остатков) досчитываются SQL и кодом kinetic-api.
+Одинаковый --rng-seed даёт одинаковые данные.
+
+Это единственный сидер: loadtest.py и explain_check.py наполняют БД через
+generate(options(...)) с теми же параметрами, что и флаги командной строки.
+
+Только для одноразовой БД с применёнными миграциями:
+
+    DATABASE_URL=... python tools/datagen.py --characters 20000
+    DATABASE_URL=... python tools/datagen.py --characters 1000000 --games 40 --weeks 52 --students 50000
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from functions import load_api  # tools/functions.py
+
+SPORTS = ('skate', 'rollers', 'bmx', 'scooter', 'bike')
+SPORT_WEIGHTS = (35, 15, 20, 20, 10)
+STYLES = ('aggressive', 'technical', 'freestyle')
+GAMES = ('simulator', 'arena', 'cards')
+HAIR_COLORS = ('#000000', '#5a3825', '#d4a017', '#b22222', '#1e90ff')
+SHOP_ITEMS = (
+    [('hairstyle', str(i), f'Причёска {i}', 150) for i in range(2, 11)]
+    + [('hair_color', c, f'Цвет {c}', 100) for c in HAIR_COLORS[1:]]
+    + [('body_type', str(i), f'Телосложение {i}', 200) for i in range(2, 6)]
+)
+INVENTORY_TYPES = ('outfit', 'equipment', 'booster', 'animation')
+RARITIES = ('common', 'rare', 'epic', 'legendary')
+RARITY_WEIGHTS = (70, 20, 8, 2)
+NOTIFICATION_KINDS = (
+    ('info', 'Тренировка засчитана!', 'Посещение тренировки зачислено'),
+    ('tournament', 'Новый турнир начался!', 'Еженедельный турнир. Вступи за 100 кинетиков!'),
+    ('achievement', 'Достижение!', 'Награда зачислена'),
+    ('weekly_results', 'Итоги недели', 'Турнир завершён'),
+)
+PAGES = ('/', '/shop', '/tricks', '/profile', '/tournament', '/diary', '/about')
+UTM_SOURCES = (None, None, None, 'vk', 'telegram', 'yandex', 'google')
+COMMENTS = (
+    'Отработка ollie и kickflip', 'Работа над балансом на рампе', 'Прыжки через препятствия',
+    'Разбор техники падений', 'Скоростной заезд по кругу', 'Слайды на бордюре',
+)
+
+
+def stream(seed, key, stream_no=0):
+    """Отдельный детерминированный генератор для сущности key."""
+    return random.Random((seed << 40) ^ (key << 6) ^ stream_no)
+
+def activity(rng, alpha, cap=200.0):
+    """Вес активности с распределением Парето и средним 1: длинный хвост «ядровых» игроков."""
+    return min(rng.paretovariate(alpha) * (alpha - 1) / alpha, cap)
+
+def count(rng, mean):
+    """Целое со средним mean."""
+    n = int(mean)
+    return n + (rng.random() < mean - n)
+
+
+class Spool:
+    """Строки таблиц во временных файлах в текстовом формате COPY."""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.files = {}
+        self.rows = {}
+
+    def write(self, table, columns, values):
+        f = self.files.get(table)
+        if f is None:
+            f = tempfile.TemporaryFile('w+', encoding='utf-8', dir=self.directory)
+            self.files[table] = f
+            self.rows[table] = 0
+            f.columns = columns
+        f.write('\t'.join(map(copy_value, values)) + '\n')
+        self.rows[table] += 1
+
+    def load(self, cur, table):
+        f = self.files.pop(table, None)
+        if f is None:
+            return 0
+        f.seek(0)
+        cur.copy_expert(f"COPY {table} ({', '.join(f.columns)}) FROM STDIN", f, size=1 << 20)
+        f.close()
+        return self.rows[table]
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, (list, tuple)):
+        value = '{' + ','.join(value) + '}'
+    elif isinstance(value, dict):
+        value = json.dumps(value, ensure_ascii=False)
+    else:
+        value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def next_id(cur, table):
+    cur.execute(f"SELECT COALESCE(MAX(id), 0) + 1 AS id FROM {table}")
+    return cur.fetchone()['id']
+
+def load_context(cur, args, api):
+    cur.execute("SELECT LOCALTIMESTAMP(0) AS now")
+    now = cur.fetchone()['now']
+    monday = now.date() - timedelta(days=now.date().weekday())
+    start = datetime.combine(monday - timedelta(weeks=args.weeks - 1), datetime.min.time())
+    cur.execute("SELECT id, sport_type, experience_reward, kinetics_reward FROM tricks ORDER BY id")
+    tricks = {}
+    for t in cur.fetchall():
+        tricks.setdefault(t['sport_type'], []).append((t['id'], t['experience_reward'], t['kinetics_reward']))
+    cur.execute("SELECT id, name, requirement_type, requirement_value, reward_kinetics FROM achievements ORDER BY id")
+    achievements = cur.fetchall()
+    cur.execute("SELECT * FROM daily_quests WHERE is_active AND quest_type = ANY(%s) ORDER BY id", (list(api.QUEST_TYPES),))
+    quests = cur.fetchall()
+    cur.execute("SELECT quest_date, quest_ids FROM quest_assignments")
+    assigned = {r['quest_date']: r['quest_ids'] for r in cur.fetchall()}
+    cur.execute("SELECT id, name, price FROM accessories WHERE is_available ORDER BY id")
+    accessories = cur.fetchall()
+    cur.execute("SELECT id, week_start FROM tournaments")
+    existing = {r['week_start']: r['id'] for r in cur.fetchall()}
+    return {
+        'now': now, 'start': start, 'monday': monday, 'tricks': tricks, 'achievements': achievements,
+        'quest_days': quest_days(now.date(), args.quest_days, quests, assigned, api.QUESTS_PER_DAY),
+        'accessories': accessories, 'existing_weeks': existing,
+        # средняя доля истории, которую застал персонаж (регистрация ~ u ** 0.7)
+        'mean_life': 1 / 1.7,
+    }
+
+def quest_days(today, days, quests, assigned, per_day):
+    """Задания последних дней: уже розданные или тот же выбор по md5, что и в kinetic-api."""
+    result = []
+    by_id = {q['id']: q for q in quests}
+    for n in range(days):
+        day = today - timedelta(days=n)
+        if day in assigned:
+            result.append((day, [by_id[i] for i in assigned[day] if i in by_id], False))
+            continue
+        picked = sorted(quests, key=lambda q: hashlib.md5(f"{q['id']}:{day}".encode()).hexdigest())[:per_day]
+        result.append((day, picked, True))
+    return result
+
+
+# === Дневник ===
+
+def generate_diary(spool, cur, args, ctx):
+    seed, now = args.rng_seed, ctx['now']
+    trainers = max(1, args.students // args.students_per_trainer)
+    user_id = next_id(cur, 'users')
+    group_id = next_id(cur, 'student_groups')
+    plan_id = next_id(cur, 'lesson_plans')
+    entry_id = next_id(cur, 'diary_entries')
+    cols = ('id', 'email', 'name', 'role', 'phone', 'created_at')
+
+    def add_user(role, n):
+        nonlocal user_id
+        spool.write('users', cols, (user_id, f'gen{seed}-{role}-{n}@example.com', f'{role.title()} {n}', role,
+                                    None, ctx['start']))
+        user_id += 1
+        return user_id - 1
+
+    add_user('director', 1)
+    trainer_ids = [add_user('trainer', n) for n in range(1, trainers + 1)]
+    student_ids = [add_user('student', n) for n in range(1, args.students + 1)]
+    for n in range(1, args.students // 2 + 1):
+        add_user('parent', n)
+
+    rng = stream(seed, 0, 1)
+    groups = []
+    for trainer in trainer_ids:
+        for _ in range(args.groups_per_trainer):
+            sport = rng.choices(SPORTS, SPORT_WEIGHTS)[0]
+            spool.write('student_groups', ('id', 'name', 'trainer_id', 'sport_type', 'created_at'),
+                        (group_id, f'Группа {group_id}', trainer, sport, ctx['start']))
+            # у тренера свой темп фото: медиа на запись распределены неравномерно
+            groups.append({'id': group_id, 'trainer': trainer, 'weekday': group_id % 6,
+                           'media': activity(rng, args.skew, cap=10.0)})
+            group_id += 1
+
+    members = {}
+    for student in student_ids:
+        chosen = [rng.choice(groups)]
+        if rng.random() < 0.1:
+            chosen.append(rng.choice(groups))
+        for group in {g['id']: g for g in chosen}.values():
+            members.setdefault(group['id'], []).append(student)
+            spool.write('student_group_members', ('student_id', 'group_id', 'joined_at'),
+                        (student, group['id'], ctx['start']))
+
+    lesson_cols = ('id', 'group_id', 'trainer_id', 'lesson_date', 'topic', 'goals', 'status')
+    entry_cols = ('id', 'student_id', 'trainer_id', 'lesson_plan_id', 'entry_date', 'comment', 'homework',
+                  'grade', 'attendance', 'created_at')
+    media_cols = ('diary_entry_id', 'media_type', 'media_url', 'thumbnail_url', 'uploaded_at')
+    today = now.date()
+    for group in groups:
+        grng = stream(seed, group['id'], 2)
+        first = ctx['start'].date() + timedelta(days=group['weekday'])
+        lesson_date = first
+        while lesson_date <= today + timedelta(weeks=2):
+            past = lesson_date <= today
+            spool.write('lesson_plans', lesson_cols, (
+                plan_id, group['id'], group['trainer'], lesson_date, grng.choice(COMMENTS), None,
+                'completed' if past else 'planned'))
+            if past:
+                for student in members.get(group['id'], ()):
+                    srng = stream(seed, student * 1000 + plan_id % 1000, 3)
+                    roll = srng.random()
+                    if roll < 0.08:
+                        attendance = 'absent'
+                    elif roll < 0.12:
+                        attendance = 'excused'
+                    elif roll < 0.2:
+                        attendance = 'late'
+                    else:
+                        attendance = 'present'
+                    created = datetime.combine(lesson_date, datetime.min.time()) + timedelta(hours=19)
+                    spool.write('diary_entries', entry_cols, (
+                        entry_id, student, group['trainer'], plan_id, lesson_date, srng.choice(COMMENTS),
+                        'Повторить разобранные элементы' if srng.random() < 0.3 else None,
+                        str(srng.randint(3, 5)) if attendance != 'absent' else None, attendance, created))
+                    if attendance != 'absent':
+                        for n in range(count(srng, args.media * group['media'])):
+                            kind = 'video' if srng.random() < 0.2 else 'photo'
+                            url = f'https://cdn.example/diary/{entry_id}/{n}.{"mp4" if kind == "video" else "jpg"}'
+                            spool.write('diary_media', media_cols, (entry_id, kind, url, url + '.thumb.jpg', created))
+                    entry_id += 1
+            plan_id += 1
+            lesson_date += timedelta(weeks=1)
+    return [f'Тренер {n}' for n in range(1, trainers + 1)]
+
+
+# === Аналитика посещений ===
+
+def generate_visitors(spool, cur, args, ctx):
+    seed, now, start = args.rng_seed, ctx['now'], ctx['start']
+    span = (now - start).total_seconds()
+    visitor_id = next_id(cur, 'visitors')
+    visitor_cols = ('id', 'visitor_uuid', 'user_agent', 'ip_address', 'first_visit_at', 'last_visit_at',
+                    'visit_count', 'referrer', 'device_type', 'browser', 'os')
+    session_cols = ('visitor_id', 'session_uuid', 'started_at', 'ended_at', 'duration_seconds', 'pages_visited',
+                    'page_views', 'utm_source', 'utm_medium', 'utm_campaign', 'landing_page', 'exit_page', 'bounce')
+    for n in range(args.visitors):
+        rng = stream(seed, n, 4)
+        sessions = max(1, count(rng, args.sessions * activity(rng, args.skew)))
+        first = start + timedelta(seconds=int(span * rng.random()))
+        starts = sorted(first + timedelta(seconds=int((now - first).total_seconds() * rng.random()))
+                        for _ in range(sessions - 1))
+        starts.insert(0, first)
+        device = rng.choices(('desktop', 'mobile', 'tablet'), (45, 50, 5))[0]
+        browser = rng.choice(('Chrome', 'Safari', 'Firefox', 'Edge'))
+        spool.write('visitors', visitor_cols, (
+            visitor_id, str(rng_uuid(rng)), f'Mozilla/5.0 ({device}) {browser}', f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}',
+            first, starts[-1], sessions, rng.choice((None, 'https://vk.com/', 'https://yandex.ru/')), device, browser,
+            rng.choice(('Windows', 'Android', 'iOS', 'macOS'))))
+        for started in starts:
+            pages = max(1, count(rng, 2.5))
+            views, at = [], started
+            for _ in range(pages):
+                views.append({'page': rng.choice(PAGES), 'at': at.isoformat()})
+                at += timedelta(seconds=rng.randint(5, 240))
+            source = rng.choice(UTM_SOURCES)
+            spool.write('visit_sessions', session_cols, (
+                visitor_id, str(rng_uuid(rng)), started, at, int((at - started).total_seconds()), pages,
+                json.dumps(views), source, 'social' if source else None, 'spring' if source else None,
+                views[0]['page'], views[-1]['page'], pages == 1))
+        visitor_id += 1
+
+def rng_uuid(rng):
+    return '%032x' % rng.getrandbits(128)
+
+
+# === Kinetic Universe ===
+
+def tournament_weeks(spool, cur, args, ctx):
+    """Турнир на каждую неделю истории; уже существующие недели переиспользуются."""
+    tid = next_id(cur, 'tournaments')
+    weeks = []
+    for i in range(args.weeks):
+        week_start = ctx['monday'] - timedelta(weeks=args.weeks - 1 - i)
+        week_end = week_start + timedelta(days=6)
+        current = week_start == ctx['monday']
+        if week_start in ctx['existing_weeks']:
+            weeks.append((week_start, ctx['existing_weeks'][week_start], 100))
+            continue
+        spool.write('tournaments', ('id', 'week_start', 'week_end', 'month_key', 'status', 'entry_fee', 'created_at', 'closed_at'), (
+            tid, week_start, week_end, week_start.strftime('%Y-%m'), 'active' if current else 'closed', 100,
+            datetime.combine(week_start, datetime.min.time()),
+            None if current else datetime.combine(week_end + timedelta(days=1), datetime.min.time()) + timedelta(minutes=10)))
+        weeks.append((week_start, tid, 100))
+        tid += 1
+    return weeks
+
+
+def generate_characters(spool, cur, args, ctx, trainer_names, weeks):
+    seed, now, start = args.rng_seed, ctx['now'], ctx['start']
+    span_days = (now - start).days + 1
+    first_id = next_id(cur, 'characters')
+    notification_id = max(next_id(cur, 'character_notifications'), next_id(cur, 'character_notifications_archive'))
+    clan_id = next_id(cur, 'clans')
+    clan, clan_size = None, 0
+    last_id = first_id + args.characters - 1
+
+    char_cols = ('id', 'user_id', 'name', 'sport_type', 'riding_style', 'level', 'experience', 'balance', 'speed',
+                 'courage', 'body_type', 'hairstyle', 'hair_color', 'kinetics', 'games_won', 'games_played', 'age',
+                 'trainer_name', 'sport_types', 'created_at', 'updated_at')
+    game_cols = ('character_id', 'game_name', 'won', 'earned_xp', 'earned_kinetics', 'score', 'created_at')
+    ledger_cols = ('character_id', 'amount', 'transaction_type', 'source', 'description', 'created_by',
+                   'balance_after', 'created_at')
+    notification_cols = ('id', 'character_id', 'title', 'message', 'notification_type', 'is_read', 'created_at')
+    archive_cols = ('id', 'character_id', 'title', 'message', 'notification_type', 'created_at', 'archived_at')
+
+    for cid in range(first_id, last_id + 1):
+        rng = stream(seed, cid)
+        weight = activity(rng, args.skew)
+        sport = rng.choices(SPORTS, SPORT_WEIGHTS)[0]
+        sports = [sport] + ([rng.choice([s for s in SPORTS if s != sport])] if rng.random() < 0.2 else [])
+        created = start + timedelta(seconds=int((now - start).total_seconds() * rng.random() ** 0.7))
+        life = (now - created).total_seconds()
+        scale = weight * life / (now - start).total_seconds() / ctx['mean_life']
+
+        def moment():
+            return created + timedelta(seconds=int(life * rng.random()))
+
+        # События журнала: (время, порядок, сумма, источник, описание, кто подтвердил, что создать при успехе)
+        events = [(created, 0, 100, 'welcome', 'Стартовый бонус', None, None)]
+        experience = games_won = 0
+
+        games = count(rng, args.games * scale)
+        for _ in range(games):
+            at = moment()
+            won = rng.random() < 0.4 + 0.2 * min(weight, 2.0) / 2
+            xp, kin = rng.randint(10, 50), rng.randint(5, 25)
+            name = rng.choice(GAMES)
+            experience += xp
+            games_won += won
+            spool.write('game_results', game_cols, (cid, name, won, xp, kin, rng.randint(0, 1000) * (2 if won else 1), at))
+            events.append((at, 1, kin, 'game', f'Мини-игра: {name}', None, None))
+
+        pool = [t for s in sports for t in ctx['tricks'].get(s, ())]
+        mastered = rng.sample(pool, min(len(pool), count(rng, args.tricks * scale)))
+        for trick_id, xp, kin in mastered:
+            at = moment()
+            experience += xp
+            by = rng.choice(trainer_names) if rng.random() < 0.7 else None
+            spool.write('character_tricks', ('character_id', 'trick_id', 'confirmed_by', 'confirmed_at'), (cid, trick_id, by, at))
+            events.append((at, 1, kin, 'tricks', 'Подтверждено 1 трюков', by, None))
+
+        # задания дня розданы всем, кто уже был; выполняют их активные игроки
+        for quest_date, day_quests, _ in ctx['quest_days']:
+            if quest_date < created.date():
+                continue
+            active = rng.random() < min(0.95, 0.3 * weight)
+            day_start = datetime.combine(quest_date, datetime.min.time())
+            for quest in day_quests:
+                progress = rng.randint(0, quest['requirement_value']) if active else 0
+                done = progress >= quest['requirement_value']
+                at = max(created, min(day_start + timedelta(seconds=rng.randint(28800, 79200)), now)) if done else None
+                spool.write('character_quests', ('character_id', 'quest_id', 'progress', 'completed', 'quest_date', 'completed_at'),
+                            (cid, quest['id'], progress, done, quest_date, at))
+                if done:
+                    experience += quest['reward_experience']
+                    events.append((at, 1, quest['reward_kinetics'], 'quest', f"Задание: {quest['name']}", None, None))
+
+        level = min(experience // 100 + 1, 100)
+        for a in ctx['achievements']:
+            kind, need = a['requirement_type'], a['requirement_value']
+            reached = (kind == 'character_created' or (kind == 'tricks_count' and len(mastered) >= need)
+                       or (kind == 'level' and level >= need) or (kind == 'daily_streak' and rng.random() < 0.3 * min(weight, 3.0)))
+            if reached:
+                at = created if kind == 'character_created' else moment()
+                events.append((at, 2, a['reward_kinetics'], 'achievement', f"Достижение: {a['name']}", None, ('achievement', a['id'])))
+
+        for week_start, tid, fee in weeks:
+            joined = max(created, datetime.combine(week_start, datetime.min.time())) + timedelta(seconds=rng.randint(0, 172800))
+            if joined < now and joined.date() <= week_start + timedelta(days=6) and rng.random() < min(0.9, args.tournament_share * weight):
+                events.append((joined, 3, -fee, 'tournament', f'Вступление в турнир #{tid}', None, ('tournament', tid)))
+
+        for item in rng.sample(SHOP_ITEMS, min(len(SHOP_ITEMS), count(rng, args.purchases * weight))):
+            events.append((moment(), 3, -item[3], 'shop', f'Покупка: {item[2]}', None, ('item', item)))
+        if ctx['accessories']:
+            for acc in rng.sample(ctx['accessories'], min(len(ctx['accessories']), count(rng, args.purchases * weight / 2))):
+                events.append((moment(), 3, -acc['price'], 'shop', f"Аксессуар: {acc['name']}", None, ('accessory', acc)))
+
+        # Журнал проигрывается по времени: покупка без денег не состоялась
+        events.sort(key=lambda e: (e[0], e[1]))
+        balance = achievements = 0
+        equipped = False
+        for at, _, amount, source, description, by, effect in events:
+            if balance + amount < 0:
+                continue
+            balance += amount
+            if amount:
+                spool.write('kinetics_transactions', ledger_cols, (
+                    cid, amount, 'earn' if amount > 0 else 'spend', source, description, by, balance, at))
+            if effect is None:
+                continue
+            kind, payload = effect
+            if kind == 'achievement':
+                achievements += 1
+                spool.write('character_achievements', ('character_id', 'achievement_id', 'earned_at'), (cid, payload, at))
+            elif kind == 'tournament':
+                spool.write('tournament_entries', ('tournament_id', 'character_id', 'joined_at'), (payload, cid, at))
+            elif kind == 'item':
+                spool.write('purchased_items', ('character_id', 'item_type', 'item_value', 'item_name', 'cost', 'purchased_at'),
+                            (cid, payload[0], payload[1], payload[2], payload[3], at))
+            else:
+                spool.write('character_accessories', ('character_id', 'accessory_id', 'is_equipped', 'purchased_at'),
+                            (cid, payload['id'], not equipped, at))
+                equipped = True
+
+        spool.write('characters', char_cols, (
+            cid, f'gen{seed}-{cid}', f'Райдер {cid}', sport, rng.choice(STYLES), level, experience,
+            rng.randint(1, 100), rng.randint(1, 100), rng.randint(1, 100), rng.randint(1, 5), rng.randint(1, 10),
+            rng.choice(HAIR_COLORS), balance, games_won, games, rng.randint(8, 25) if rng.random() < 0.8 else None,
+            rng.choice(trainer_names) if rng.random() < 0.5 else None, sports, created, max(e[0] for e in events)))
+
+        visit_days = min(int(life // 86400), count(rng, args.visits * scale))
+        for offset in rng.sample(range(int(life // 86400)), visit_days):
+            day = now.date() - timedelta(days=offset + 1)
+            spool.write('training_visits', ('character_id', 'visit_date', 'confirmed_by', 'group_name', 'created_at'), (
+                cid, day, rng.choice(trainer_names), None, datetime.combine(day, datetime.min.time()) + timedelta(hours=19)))
+
+        unread = 0
+        for _ in range(count(rng, args.notifications * scale)):
+            at = moment()
+            kind, title, message = rng.choice(NOTIFICATION_KINDS)
+            age = (now - at).days
+            is_read = rng.random() < (0.95 if age > 3 else 0.4)
+            if is_read and age > args.archive_days:
+                spool.write('character_notifications_archive', archive_cols, (
+                    notification_id, cid, title, message, kind, at, at + timedelta(days=args.archive_days)))
+            else:
+                unread += not is_read
+                spool.write('character_notifications', notification_cols, (notification_id, cid, title, message, kind, is_read, at))
+            notification_id += 1
+
+        spool.write('character_stats', ('character_id', 'tricks_count', 'trainings_count', 'achievements_count',
+                                        'unread_notifications', 'updated_at'),
+                    (cid, len(mastered), visit_days, achievements, unread, now))
+
+        for _ in range(count(rng, weight)):
+            rarity = rng.choices(RARITIES, RARITY_WEIGHTS)[0]
+            spool.write('inventory_items', ('character_id', 'item_type', 'item_name', 'item_rarity', 'stats', 'acquired_at'), (
+                cid, rng.choice(INVENTORY_TYPES), f'Предмет {rng.randint(1, 500)}', rarity,
+                {'bonus': RARITIES.index(rarity) + 1}, moment()))
+
+        friends = {rng.randint(first_id, last_id) for _ in range(min(200, count(rng, args.friends * weight)))} - {cid}
+        for friend in friends:
+            spool.write('friendships', ('character_id', 'friend_character_id', 'status', 'created_at'), (
+                cid, friend, rng.choices(('accepted', 'pending', 'blocked'), (80, 15, 5))[0], moment()))
+
+        if rng.random() < args.clan_share:
+            if clan is None:
+                clan, clan_size = clan_id, rng.randint(3, 10)
+                clan_id += 1
+                spool.write('clans', ('id', 'name', 'description', 'leader_character_id', 'max_members', 'created_at'),
+                            (clan, f'Клан {seed}-{clan}', None, cid, 10, created))
+            spool.write('clan_members', ('clan_id', 'character_id', 'role', 'joined_at'),
+                        (clan, cid, 'leader' if clan_size == 0 else 'member', created))
+            clan_size -= 1
+            if clan_size <= 0:
+                clan = None
+
+        if cid % 10000 == 0:
+            print(f'generated characters up to {cid}', file=sys.stderr, flush=True)
+    return first_id, last_id
+
+
+# Очки недель считаются по той же формуле, что RECALC_TOURNAMENT_SQL, но сразу для всех
+# сгенерированных турниров: неделя события — date_trunc('week'), соединение по равенству.
+SCORE_TOURNAMENTS_SQL = """
+WITH t AS (
+    SELECT id, week_start FROM tournaments WHERE id = ANY(%(tids)s)
+),
+games AS (
+    SELECT character_id, date_trunc('week', created_at)::date AS week_start, COUNT(*) AS cnt
+    FROM game_results WHERE character_id BETWEEN %(first)s AND %(last)s GROUP BY 1, 2
+),
+tricks AS (
+    SELECT character_id, date_trunc('week', confirmed_at)::date AS week_start, COUNT(*) AS cnt
+    FROM character_tricks WHERE character_id BETWEEN %(first)s AND %(last)s GROUP BY 1, 2
+),
+trainings AS (
+    SELECT character_id, date_trunc('week', visit_date)::date AS week_start, COUNT(*) AS cnt
+    FROM training_visits WHERE character_id BETWEEN %(first)s AND %(last)s GROUP BY 1, 2
+),
+scored AS (
+    SELECT te.id, te.tournament_id, te.joined_at,
+           COALESCE(g.cnt, 0) * %(game_points)s AS games_score,
+           COALESCE(tr.cnt, 0) * %(trick_points)s AS tricks_score,
+           COALESCE(tv.cnt, 0) * %(training_points)s AS training_score
+    FROM tournament_entries te
+    JOIN t ON t.id = te.tournament_id
+    LEFT JOIN games g ON g.character_id = te.character_id AND g.week_start = t.week_start
+    LEFT JOIN tricks tr ON tr.character_id = te.character_id AND tr.week_start = t.week_start
+    LEFT JOIN trainings tv ON tv.character_id = te.character_id AND tv.week_start = t.week_start
+),
+ranked AS (
+    SELECT id, games_score, tricks_score, training_score, games_score + tricks_score + training_score AS score,
+           ROW_NUMBER() OVER (
+               PARTITION BY tournament_id
+               ORDER BY games_score + tricks_score + training_score DESC, joined_at ASC, id ASC
+           ) AS rank
+    FROM scored
+)
+UPDATE tournament_entries te
+SET games_score = r.games_score, tricks_score = r.tricks_score, training_score = r.training_score,
+    score = r.score, rank = r.rank, version = 1
+FROM ranked r
+WHERE te.id = r.id
+"""
+
+# Закрытые недели: итоги уже разосланы
+CLOSE_TOURNAMENTS_SQL = """
+UPDATE tournaments t
+SET participants = p.cnt, results_sent_through = CASE WHEN t.status = 'closed' THEN p.cnt ELSE 0 END,
+    version = version + 1
+FROM (
+    SELECT tournament_id, COUNT(*) AS cnt FROM tournament_entries
+    WHERE tournament_id = ANY(%(tids)s) GROUP BY tournament_id
+) p
+WHERE t.id = p.tournament_id AND t.status <> 'active'
+"""
+
+# Размер кланов известен только после раздачи участников; очки кланов
+# (clan_scores) набирает триггер V0021 при расстановке очков турниров
+CLAN_MEMBER_COUNTS_SQL = """
+UPDATE clans c SET member_count = m.cnt
+FROM (SELECT clan_id, COUNT(*) AS cnt FROM clan_members GROUP BY clan_id) m
+WHERE c.id = m.clan_id AND c.member_count <> m.cnt
+"""
+
+# Сезонная таблица (квартал) из месячного рейтинга
+SEASONAL_SQL = """
+INSERT INTO leaderboard_entries (character_id, leaderboard_type, period_start, period_end, score, rank, metadata)
+SELECT character_id, 'seasonal', season, (season + INTERVAL '3 months' - INTERVAL '1 day')::date, score,
+       ROW_NUMBER() OVER (PARTITION BY season ORDER BY score DESC, character_id),
+       jsonb_build_object('months', months)
+FROM (
+    SELECT character_id, date_trunc('quarter', month_start)::date AS season, SUM(total_score) AS score, COUNT(*) AS months
+    FROM monthly_leaderboards WHERE character_id BETWEEN %(first)s AND %(last)s
+    GROUP BY 1, 2
+) s
+ON CONFLICT (character_id, leaderboard_type, period_start) DO NOTHING
+"""
+
+# Порядок загрузки: родительские таблицы раньше дочерних
+LOAD_ORDER = (
+    'users', 'student_groups', 'student_group_members', 'lesson_plans', 'diary_entries', 'diary_media',
+    'visitors', 'visit_sessions',
+    'tournaments', 'characters', 'character_stats', 'clans', 'clan_members', 'friendships',
+    'game_results', 'character_tricks', 'training_visits', 'character_notifications',
+    'character_notifications_archive', 'kinetics_transactions', 'purchased_items', 'character_accessories',
+    'character_achievements', 'inventory_items', 'quest_assignments', 'character_quests', 'tournament_entries',
+)
+
+# Таблицы, куда id писались явно: последовательности догоняются после загрузки
+EXPLICIT_IDS = (
+    'users', 'student_groups', 'lesson_plans', 'diary_entries', 'visitors', 'tournaments', 'characters',
+    'clans', 'character_notifications',
+)
+
+
+def step(label, started):
+    print(f'{label}: {time.perf_counter() - started:.1f}s', file=sys.stderr, flush=True)
+    return time.perf_counter()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rng-seed', type=int, default=1)
+    parser.add_argument('--characters', type=int, default=20000)
+    parser.add_argument('--weeks', type=int, default=26, help='недель истории')
+    parser.add_argument('--skew', type=float, default=1.5, help='показатель Парето для активности (меньше — длиннее хвост)')
+    parser.add_argument('--games', type=float, default=40, help='игр на персонажа в среднем')
+    parser.add_argument('--tricks', type=float, default=8, help='освоенных трюков в среднем')
+    parser.add_argument('--visits', type=float, default=12, help='посещений тренировок в среднем')
+    parser.add_argument('--notifications', type=float, default=30, help='уведомлений в среднем')
+    parser.add_argument('--archive-days', type=int, default=90, help='прочитанные старше — в архиве')
+    parser.add_argument('--tournament-share', type=float, default=0.25, help='доля недель, в которых участвует средний игрок')
+    parser.add_argument('--purchases', type=float, default=2, help='покупок в магазине в среднем')
+    parser.add_argument('--friends', type=float, default=5)
+    parser.add_argument('--clan-share', type=float, default=0.4)
+    parser.add_argument('--quest-days', type=int, default=7)
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--students-per-trainer', type=int, default=25)
+    parser.add_argument('--groups-per-trainer', type=int, default=2)
+    parser.add_argument('--media', type=float, default=0.5, help='медиа на запись дневника в среднем')
+    parser.add_argument('--visitors', type=int, default=20000)
+    parser.add_argument('--sessions', type=float, default=3, help='сессий на посетителя в среднем')
+    parser.add_argument('--tmpdir', help='каталог для промежуточных файлов')
+    return parser
+
+
+def options(**overrides):
+    """Параметры по умолчанию с заменами — для инструментов, которые наполняют БД через generate()."""
+    args = build_parser().parse_args([])
+    for key, value in overrides.items():
+        if not hasattr(args, key):
+            raise TypeError(f'unknown datagen option: {key}')
+        setattr(args, key, value)
+    return args
+
+
+def generate(args):
+    """Наполняет БД из DATABASE_URL; возвращает диапазон id новых персонажей и число строк по таблицам."""
+    api = load_api()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=RealDictCursor)
+    cur = conn.cursor()
+    cur.execute("SET synchronous_commit = off")
+    ctx = load_context(cur, args, api)
+    spool = Spool(args.tmpdir)
+
+    started = time.perf_counter()
+    trainer_names = generate_diary(spool, cur, args, ctx)
+    generate_visitors(spool, cur, args, ctx)
+    weeks = tournament_weeks(spool, cur, args, ctx)
+    for quest_date, day_quests, new in ctx['quest_days']:
+        if new:
+            spool.write('quest_assignments', ('quest_date', 'quest_ids', 'assigned_at'),
+                        (quest_date, [str(q['id']) for q in day_quests], datetime.combine(quest_date, datetime.min.time())))
+    first, last = generate_characters(spool, cur, args, ctx, trainer_names, weeks)
+    started = step('generate', started)
+
+    # секции журнала с первой недели истории, чтобы строки не легли в DEFAULT
+    cur.execute("SELECT ensure_kinetics_partitions(%s::date, %s)", (ctx['start'].date(), args.weeks // 4 + 6))
+    for table in LOAD_ORDER:
+        rows = spool.load(cur, table)
+        conn.commit()
+        if rows:
+            rate = rows / max(time.perf_counter() - started, 1e-6)
+            started = step(f'{table} {rows} rows, {rate:.0f} rows/s', started)
+
+    for table in EXPLICIT_IDS:
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))")
+    conn.commit()
+
+    cur.execute(CLAN_MEMBER_COUNTS_SQL)
+    tids = [tid for _, tid, _ in weeks]
+    cur.execute(SCORE_TOURNAMENTS_SQL, {
+        'tids': tids, 'first': first, 'last': last, 'game_points': api.GAME_POINTS,
+        'trick_points': api.TRICK_POINTS, 'training_points': api.TRAINING_POINTS,
+    })
+    cur.execute(CLOSE_TOURNAMENTS_SQL, {'tids': tids})
+    for tid in tids:
+        api.refresh_monthly_leaderboard(cur, tid)
+    cur.execute(SEASONAL_SQL, {'first': first, 'last': last})
+    conn.commit()
+    started = step('tournaments and leaderboards', started)
+
+    snapshots = api.snapshot_balances(conn)
+    started = step(f"balance snapshots {snapshots['snapshots']}", started)
+
+    conn.autocommit = True
+    cur.execute("ANALYZE")
+    step('analyze', started)
+    conn.close()
+    return {'characters': [first, last], 'rows': spool.rows}
+
+
+def main():
+    result = generate(build_parser().parse_args())
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Микробенчмарк кодирования ответов kinetic-api на типичных размерах тел.
+
+Сравнивает прежний json.dumps(default=str) с dumps() модуля (orjson, если
+установлен, и запасной путь на json), вставку кэшированного справочника через
+RawJSON и стоимость сжатия gzip/br. БД не нужна.
+
+    python tools/encode_bench.py --repeat 200
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import functions  # tools/functions.py
+
+
+def load_api():
+    os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/unused')
+    return functions.load_api()
+
+
+def payloads(rng):
+    now = datetime(2025, 5, 1, 12, 0, 0, 123456)
+    sports = ['skate', 'bmx', 'scooter', 'bike', 'roller']
+    tricks = [{
+        'id': i, 'name': f'Трюк {i}', 'sport_type': rng.choice(sports), 'category': 'basic',
+        'difficulty': rng.randint(1, 5), 'experience_reward': 50, 'kinetics_reward': 10,
+        'description': 'Описание трюка ' * 3, 'created_at': now - timedelta(days=i),
+    } for i in range(300)]
+    leaderboard = [{
+        'id': i, 'tournament_id': 7, 'character_id': i, 'score': rng.randint(0, 900),
+        'games_score': 100, 'tricks_score': 250, 'training_score': 90, 'rank': i + 1,
+        'joined_at': now, 'version': 12, 'character_name': f'Райдер {i}', 'avatar_url': '',
+        'sport_type': rng.choice(sports), 'level': rng.randint(1, 40),
+    } for i in range(200)]
+    notifications = [{
+        'id': i, 'character_id': 1, 'title': 'Итоги недели: 3 место!', 'message': 'Турнир 01.05 - 07.05: 420 очков',
+        'notification_type': 'weekly_results', 'is_read': False, 'data': None, 'created_at': now - timedelta(hours=i),
+    } for i in range(50)]
+    directory = [{
+        'id': i, 'user_id': f'user-{i}', 'name': f'Райдер {i}', 'sport_type': 'skate', 'sport_types': ['skate', 'bmx'],
+        'riding_style': 'freestyle', 'level': 40 - i // 20, 'experience': 4000 - i, 'kinetics': 120,
+        'games_played': 30, 'games_won': 12, 'avatar_url': '', 'trainer_name': 'Тренер', 'age': 14,
+    } for i in range(500)]
+    diary = [{
+        'id': i, 'student_id': 3, 'trainer_id': 2, 'entry_date': date(2025, 5, 1) - timedelta(days=i),
+        'title': 'Тренировка', 'content': 'Отработка ollie и kickflip. ' * 5, 'grade': Decimal('4.5'),
+        'created_at': now, 'updated_at': now, 'student_name': 'Ученик', 'trainer_name': 'Тренер',
+        'media': [{'id': i, 'diary_entry_id': i, 'url': f'https://cdn.example/{i}.jpg', 'created_at': now}],
+    } for i in range(100)]
+    return {
+        'tricks': {'tricks': tricks},
+        'leaderboard': {'entries': leaderboard, 'me': leaderboard[5]},
+        'notifications': {'notifications': notifications, 'unread_count': 12, 'next_cursor': None},
+        'directory': {'characters': directory, 'next_cursor': '15:3500:500'},
+        'diary': {'entries': diary, 'next_cursor': '2025-01-21:1'},
+    }
+
+
+def measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Микробенчмарк кодирования ответов.')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    api = load_api()
+    runtime = importlib.import_module('runtime')  # общий модуль функции: там выбираются orjson и brotli
+    fast = runtime.orjson
+    print(f"orjson: {'yes' if fast else 'no'}, brotli: {'yes' if runtime.brotli else 'no'}")
+    print(f"{'payload':<14}{'bytes':>9}{'default=str':>14}{'dumps':>10}{'dumps/json':>12}{'gzip':>10}{'gz bytes':>10}")
+    for name, body in payloads(random.Random(args.seed)).items():
+        baseline = measure(lambda: json.dumps(body, default=str), args.repeat)
+        current = measure(lambda: api.dumps(body), args.repeat)
+        runtime.orjson = None
+        fallback = measure(lambda: api.dumps(body), args.repeat)
+        runtime.orjson = fast
+        text = api.dumps(body)
+        result = {'statusCode': 200, 'headers': {}, 'body': text}
+        gzip_time = measure(lambda: api.encode_response(result, {'Accept-Encoding': 'gzip'}), args.repeat)
+        compressed = len(api.encode_response(result, {'Accept-Encoding': 'gzip'})['body']) * 3 // 4
+        print(f'{name:<14}{len(text.encode()):>9}{baseline:>12.0f}us{current:>8.0f}us{fallback:>10.0f}us'
+              f'{gzip_time:>8.0f}us{compressed:>10}')
+
+    rows_json = json.dumps(payloads(random.Random(args.seed))['tricks']['tricks'], default=str)
+    rows = json.loads(rows_json)
+    spliced = measure(lambda: api.dumps({'tricks': api.RawJSON(rows_json)}), args.repeat)
+    reencoded = measure(lambda: api.dumps({'tricks': rows}), args.repeat)
+    print(f'catalog splice: {spliced:.0f}us vs re-encode {reencoded:.0f}us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Регрессия планов запросов kinetic-api.
+
+Наполняет локальную БД генератором tools/datagen.py, прогоняет горячие действия
+через handler, перехватывает каждый выполненный SQL и проверяет его EXPLAIN:
+Seq Scan по большой таблице или Sort большого входа — ошибка.
+
+Только для одноразовой БД с применёнными миграциями:
+
+    DATABASE_URL=... python tools/explain_check.py --seed --characters 20000
+"""
+import argparse
+import json
+import os
+import secrets
+import sys
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+import datagen  # tools/datagen.py — единственный сидер
+import functions  # tools/functions.py
+
+# Таблицы меньше этого числа строк можно читать целиком
+MIN_SCAN_ROWS = 5000
+# Сортировка такого числа строк без индекса считается регрессией
+MAX_SORT_ROWS = 1000
+# Осознанные полные проходы: (начало запроса, таблица)
+ALLOWED_SCANS = [
+    # рассылка о новом турнире адресована всем персонажам
+    ('WITH ins AS (INSERT INTO character_notifications', 'characters'),
+    # клиенту нужен весь список участников: их число и своё место
+    ('SELECT te.*, c.name as character_name, c.avatar_url, c.sport_type, c.level '
+     'FROM tournament_entries te JOIN characters c ON te.character_id = c.id WHERE te.tournament_id =', 'characters'),
+]
+# Осознанные сортировки всего турнира или месяца: начало запроса
+ALLOWED_SORTS = [
+    # список участников текущего турнира целиком
+    'SELECT te.*, c.name as character_name, c.avatar_url, c.sport_type, c.level '
+    'FROM tournament_entries te JOIN characters c ON te.character_id = c.id WHERE te.tournament_id =',
+    # места турнира: ROW_NUMBER по всем участникам
+    'WITH t AS ( SELECT id, version FROM tournaments WHERE id =',
+    # месячные суммы участников турнира группируются по персонажу
+    'WITH t AS ( SELECT id, month_key,',
+    # места месяца: ROW_NUMBER по всей таблице месяца
+    'UPDATE monthly_leaderboards ml SET rank',
+]
+
+
+def seed(characters):
+    """Наполняет БД генератором tools/datagen.py: степенной закон даёт персонажей с длинной историей."""
+    datagen.generate(datagen.options(characters=characters, students=200, visitors=2000))
+
+
+class RecordingCursor(RealDictCursor):
+    """Курсор, запоминающий каждый выполненный DML-запрос с подставленными параметрами."""
+
+    recorded = []
+    current = ''
+
+    def execute(self, query, vars=None):
+        sql = self.mogrify(query, vars).decode()
+        if sql.lstrip().split(None, 1)[0].upper() in ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE'):
+            RecordingCursor.recorded.append((RecordingCursor.current, sql))
+        return super().execute(query, vars)
+
+
+def load_api():
+    # служебные действия (сверка журнала, остаток на момент) требуют X-Admin-Token
+    os.environ.setdefault('ADMIN_TOKEN', secrets.token_hex(16))
+    api = functions.load_api()
+    api.db_pool._connect = lambda: psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=RecordingCursor)
+    return api
+
+
+def scenario(cid, user_id):
+    """Горячие действия: (метод, action, параметры)."""
+    return [
+        ('GET', 'my_character', {'user_id': user_id}),
+        ('GET', 'all_characters', {}),
+        ('GET', 'directory', {'sport_type': 'skate', 'cursor': '5:450:10000'}),
+        ('GET', 'mastered_tricks', {'character_id': cid}),
+        ('GET', 'transactions', {'character_id': cid}),
+        ('GET', 'notifications', {'character_id': cid}),
+        ('GET', 'unread_count', {'character_id': cid}),
+        ('GET', 'achievements', {'character_id': cid}),
+        ('GET', 'quests', {'character_id': cid}),
+        ('GET', 'purchased_items', {'character_id': cid}),
+        ('GET', 'public_profile', {'character_id': cid}),
+        ('GET', 'training_visits', {'character_id': cid}),
+        ('GET', 'accessories', {'character_id': cid}),
+        ('POST', 'join_tournament', {'character_id': cid}),
+        ('GET', 'current_tournament', {}),
+        ('GET', 'leaderboard', {'period': 'weekly', 'character_id': cid}),
+        ('GET', 'leaderboard', {'period': 'monthly', 'character_id': cid}),
+        ('GET', 'clan_leaderboard', {'period': 'weekly'}),
+        ('GET', 'clan', {'character_id': cid}),
+        ('POST', 'game_complete', {'character_id': cid, 'earned_xp': 10, 'earned_kinetics': 5}),
+        ('POST', 'confirm_tricks', {'character_id': cid, 'trick_ids': [1, 2]}),
+        ('POST', 'add_training_visit', {'character_id': cid}),
+        ('POST', 'add_training_visits', {'character_ids': [cid, cid - 1, cid - 2], 'group_name': 'explain'}),
+        ('POST', 'mark_notifications_read', {'character_id': cid}),
+        ('POST', 'purchase_item', {'character_id': cid, 'item_type': 'badge', 'item_value': 'explain', 'cost': 1}),
+        ('POST', 'add_kinetics', {'character_id': cid, 'amount': 5}),
+        ('GET', 'balance_at', {'character_id': cid}),
+        ('GET', 'reconcile_ledger', {'character_id': cid}),
+    ]
+
+
+def walk(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from walk(child)
+
+
+def check_plan(cur, sql, table_rows):
+    cur.execute('EXPLAIN (FORMAT JSON) ' + sql)
+    plan = cur.fetchone()['QUERY PLAN'][0]['Plan']
+    text = ' '.join(sql.split())
+    allowed = {table for prefix, table in ALLOWED_SCANS if text.startswith(prefix)}
+    sorts_allowed = any(text.startswith(prefix) for prefix in ALLOWED_SORTS)
+    problems = []
+    for node in walk(plan):
+        relation = node.get('Relation Name')
+        if relation in allowed:
+            continue
+        if node['Node Type'] == 'Seq Scan' and table_rows.get(relation, 0) >= MIN_SCAN_ROWS:
+            problems.append(f"Seq Scan on {relation} ({table_rows[relation]} rows)")
+        if node['Node Type'] == 'Sort' and not sorts_allowed:
+            child_rows = node['Plans'][0]['Plan Rows'] if node.get('Plans') else node['Plan Rows']
+            if child_rows > MAX_SORT_ROWS:
+                problems.append(f"Sort of {child_rows} rows by {', '.join(node.get('Sort Key', []))}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seed', action='store_true', help='наполнить БД перед проверкой')
+    parser.add_argument('--characters', type=int, default=20000)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.characters)
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=RealDictCursor)
+    cur = conn.cursor()
+    cur.execute("SELECT relname, reltuples::bigint AS rows FROM pg_class WHERE relkind IN ('r', 'p')")
+    table_rows = {r['relname']: r['rows'] for r in cur.fetchall()}
+    # Самый активный персонаж: на его истории проверяются сортировки
+    cur.execute("SELECT id, user_id, games_played FROM characters ORDER BY games_played DESC, id LIMIT 1")
+    target = cur.fetchone()
+    conn.rollback()
+    if target['games_played'] <= MAX_SORT_ROWS:
+        print(f"warning: most active character has {target['games_played']} games, "
+              f"sorts over {MAX_SORT_ROWS} rows are not exercised", file=sys.stderr)
+
+    api = load_api()
+    for method, action, params in scenario(target['id'], target['user_id']):
+        RecordingCursor.current = action
+        event = {
+            'httpMethod': method, 'queryStringParameters': {'action': action},
+            'headers': {'X-Admin-Token': os.environ['ADMIN_TOKEN']},
+        }
+        if method == 'GET':
+            event['queryStringParameters'].update({k: str(v) for k, v in params.items()})
+        else:
+            event['body'] = json.dumps(params)
+        status = api.handler(event, None)['statusCode']
+        if status >= 500:
+            print(f'{action}: HTTP {status}', file=sys.stderr)
+
+    failures = 0
+    seen = set()
+    for action, sql in RecordingCursor.recorded:
+        if sql in seen:
+            continue
+        seen.add(sql)
+        problems = check_plan(cur, sql, table_rows)
+        conn.rollback()
+        if problems:
+            failures += 1
+            print(f'FAIL {action}: {"; ".join(problems)}\n    {" ".join(sql.split())[:300]}')
+        elif args.verbose:
+            print(f'ok   {action}: {" ".join(sql.split())[:120]}')
+    print(f'{len(seen)} queries checked, {failures} with regressions')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""Выгрузка каталога персонажей в NDJSON через серверный курсор.
+
+Строки пишутся в stdout по мере чтения, память не зависит от числа персонажей.
+
+    DATABASE_URL=... python tools/export_characters.py --sport skate > skate.ndjson
+"""
+import argparse
+import sys
+
+from functions import load_api  # tools/functions.py
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Выгрузка персонажей в NDJSON.')
+    parser.add_argument('--sport', help='только персонажи с этим видом спорта')
+    parser.add_argument('--trainer', help='только ученики тренера')
+    parser.add_argument('--itersize', type=int, default=2000)
+    args = parser.parse_args()
+
+    api = load_api()
+    conn = api.db_pool.acquire()
+    written = 0
+    try:
+        for line in api.export_characters(conn, args.sport, args.trainer, args.itersize):
+            sys.stdout.write(line)
+            written += 1
+    finally:
+        api.db_pool.release(conn)
+    print(f'{written} characters exported', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
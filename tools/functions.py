@@ -0,0 +1,31 @@
+"""Загрузка облачных функций из backend/ для инструментов.
+
+Функция деплоится из своего каталога, поэтому общий runtime.py лежит рядом
+с index.py: каталог функции добавляется в sys.path перед импортом. Журнал
+запросов по умолчанию выключен — инструменты печатают свои отчёты.
+
+    from functions import load_api, load_function
+
+    api = load_api()                                   # backend/kinetic-api/index.py
+    handler = load_function('visitor-analytics').handler
+"""
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_function(function, name=None):
+    """Модуль backend/<function>/index.py; name — имя модуля, по умолчанию из имени функции."""
+    os.environ.setdefault('REQUEST_LOG', '0')
+    directory = os.path.join(ROOT, 'backend', function)
+    sys.path.insert(0, directory)
+    spec = importlib.util.spec_from_file_location(name or function.replace('-', '_'), os.path.join(directory, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_api():
+    return load_function('kinetic-api')
@@ -0,0 +1,157 @@
+"""Бенчмарк материализованных рейтингов: обновление месячной таблицы и чтение.
+
+Берёт турнир текущей недели и замеряет refresh_monthly_leaderboard отдельно от
+пересчёта очков: без изменений и после изменения очков у --changed участников
+(каждый прогон — в откатываемой транзакции, так что все повторы стартуют с
+одного состояния). Затем замеряет recalc_tournament_scores целиком, чтение
+leaderboard через handler и прежнюю сборку месяца SUM … GROUP BY на каждом
+запросе. В конце сверяет месячную таблицу с суммой недель и местами по очкам;
+при расхождении код выхода 1.
+
+Для одноразовой БД с данными (например, после tools/datagen.py):
+
+    DATABASE_URL=... python tools/datagen.py --characters 20000
+    DATABASE_URL=... python tools/leaderboard_bench.py --changed 1,100,1000
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import date
+
+from functions import load_api  # tools/functions.py
+
+# Прежний способ: месяц собирается из недельных строк на каждом запросе
+ON_THE_FLY_SQL = """
+SELECT c.id as character_id, c.name as character_name, c.avatar_url, c.sport_type, c.level,
+       SUM(te.score) as score, SUM(te.games_score) as games_score,
+       SUM(te.tricks_score) as tricks_score, SUM(te.training_score) as training_score
+FROM tournament_entries te
+JOIN tournaments t ON te.tournament_id = t.id
+JOIN characters c ON te.character_id = c.id
+WHERE t.month_key = %(month_key)s
+GROUP BY c.id, c.name, c.avatar_url, c.sport_type, c.level
+ORDER BY score DESC LIMIT 50
+"""
+
+# Строки месяца, у которых сумма или место не совпадают с подсчётом по неделям
+MONTHLY_DRIFT_SQL = """
+WITH actual AS (
+    SELECT te.character_id, SUM(te.score) AS total_score
+    FROM tournament_entries te JOIN tournaments t ON t.id = te.tournament_id
+    WHERE t.month_key = %(month_key)s
+    GROUP BY te.character_id
+),
+ranked AS (
+    SELECT character_id, total_score, ROW_NUMBER() OVER (ORDER BY total_score DESC, character_id) AS rank
+    FROM actual
+)
+SELECT COALESCE(r.character_id, ml.character_id) AS character_id,
+       r.total_score AS actual, ml.total_score AS stored, r.rank AS actual_rank, ml.rank AS stored_rank
+FROM ranked r
+FULL JOIN (SELECT * FROM monthly_leaderboards WHERE month_start = %(month_start)s) ml
+    ON ml.character_id = r.character_id
+WHERE (r.total_score, r.rank) IS DISTINCT FROM (ml.total_score::numeric, ml.rank::bigint)
+"""
+
+
+def call(api, action, **params):
+    event = {'httpMethod': 'GET', 'queryStringParameters': {'action': action, **{k: str(v) for k, v in params.items()}}}
+    started = time.perf_counter()
+    result = api.handler(event, None)
+    return result['statusCode'], (time.perf_counter() - started) * 1000
+
+
+def timings(samples):
+    samples = sorted(samples)
+    return f'p50 {statistics.median(samples):.2f} ms, p95 {samples[max(int(len(samples) * 0.95) - 1, 0)]:.2f} ms, n={len(samples)}'
+
+
+def refresh_after_change(api, conn, tid, entrants, changed, repeat, rng):
+    """Меняет очки у changed участников и замеряет только обновление месяца; всё откатывается."""
+    cur = conn.cursor()
+    samples, rows = [], []
+    for _ in range(repeat):
+        if changed:
+            cur.execute(
+                "UPDATE tournament_entries SET games_score = games_score + %s, score = score + %s WHERE id = ANY(%s)",
+                (api.GAME_POINTS, api.GAME_POINTS, rng.sample(entrants, changed))
+            )
+        started = time.perf_counter()
+        rows.append(api.refresh_monthly_leaderboard(cur, tid))
+        samples.append((time.perf_counter() - started) * 1000)
+        conn.rollback()
+    return samples, statistics.median(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк материализованных рейтингов.')
+    parser.add_argument('--changed', default='1,100,1000', help='участников с изменёнными очками через запятую')
+    parser.add_argument('--repeat', type=int, default=20, help='повторов каждого замера обновления')
+    parser.add_argument('--reads', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    api = load_api()
+    rng = random.Random(args.seed)
+    conn = api.db_pool.acquire()
+    cur = conn.cursor()
+    tournament = api.get_or_create_tournament(cur)
+    conn.commit()
+    tid = tournament['id']
+    cur.execute("SELECT id, character_id FROM tournament_entries WHERE tournament_id = %s", (tid,))
+    rows = cur.fetchall()
+    entrants = [r['id'] for r in rows]
+    characters = [r['character_id'] for r in rows]
+    cur.execute("SELECT COUNT(*) AS n FROM monthly_leaderboards WHERE month_start = %s", (date.today().replace(day=1),))
+    month_rows = cur.fetchone()['n']
+    conn.rollback()
+    if not entrants:
+        print(f'tournament {tid} has no entries, seed the database first', file=sys.stderr)
+        raise SystemExit(2)
+    print(f'tournament {tid}: {len(entrants)} entries, {month_rows} monthly rows')
+
+    for changed in [int(n) for n in args.changed.split(',')]:
+        changed = min(changed, len(entrants))
+        samples, rewritten = refresh_after_change(api, conn, tid, entrants, changed, args.repeat, rng)
+        print(f'refresh_monthly_leaderboard, {changed} changed: {timings(samples)}, {rewritten:.0f} rows rewritten')
+    samples, _ = refresh_after_change(api, conn, tid, entrants, 0, args.repeat, rng)
+    print(f'refresh_monthly_leaderboard, no changes: {timings(samples)}')
+
+    samples = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        api.recalc_tournament_scores(cur, tid)
+        samples.append((time.perf_counter() - started) * 1000)
+        conn.rollback()
+    print(f'recalc_tournament_scores: {timings(samples)}')
+
+    for period in ('weekly', 'monthly'):
+        samples = [call(api, 'leaderboard', period=period, limit=50)[1] for _ in range(args.reads)]
+        print(f'leaderboard {period}: {timings(samples)}')
+    mine = [call(api, 'leaderboard', period='monthly', character_id=rng.choice(characters))[1] for _ in range(args.reads)]
+    print(f'leaderboard monthly with me: {timings(mine)}')
+    month_key = date.today().strftime('%Y-%m')
+    samples = []
+    for _ in range(args.reads):
+        started = time.perf_counter()
+        cur.execute(ON_THE_FLY_SQL, {'month_key': month_key})
+        cur.fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+    conn.rollback()
+    print(f'on-the-fly monthly aggregate: {timings(samples)}')
+
+    cur.execute(MONTHLY_DRIFT_SQL, {'month_key': month_key, 'month_start': date.today().replace(day=1)})
+    drift = cur.fetchall()
+    conn.rollback()
+    api.db_pool.release(conn)
+    print(f'monthly drift: {len(drift)} rows')
+    for row in drift[:10]:
+        print(f'  {json.dumps(dict(row), default=str)}')
+    raise SystemExit(1 if drift else 0)
+
+
+if __name__ == '__main__':
+    main()
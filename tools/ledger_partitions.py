@@ -0,0 +1,39 @@
+"""Месячные секции журнала кинетиков: создание наперёд по расписанию.
+
+Создаёт секции на текущий и --months-ahead следующих месяцев. Если строки
+месяца уже попали в kinetics_transactions_default (секцию вовремя не
+создали), они переносятся в новую секцию. Итог — строка JSON; код выхода 1,
+если в секции по умолчанию остались строки.
+
+    DATABASE_URL=... python tools/ledger_partitions.py
+    DATABASE_URL=... python tools/ledger_partitions.py --months-ahead 6
+
+Пример cron (ежедневно, 00:05; секции создаются за месяцы до начала):
+
+    5 0 * * *  cd /srv/kinetic && DATABASE_URL=... python tools/ledger_partitions.py >> /var/log/ledger_partitions.log
+"""
+import argparse
+import json
+import sys
+
+from functions import load_api  # tools/functions.py
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Секции журнала кинетиков.')
+    parser.add_argument('--months-ahead', type=int, help='сколько месяцев вперёд держать секции')
+    args = parser.parse_args()
+
+    api = load_api()
+    months = args.months_ahead if args.months_ahead is not None else api.LEDGER_PARTITIONS_AHEAD
+    conn = api.db_pool.acquire()
+    try:
+        result = api.ensure_ledger_partitions(conn, months)
+    finally:
+        api.db_pool.release(conn)
+    print(json.dumps(result), flush=True)
+    sys.exit(1 if result['default_partition_rows'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+"""Нагрузочный прогон трёх функций: handler вызывается напрямую синтетическими событиями.
+
+Наполняет локальную БД (--seed: tools/datagen.py в масштабе флагов), гоняет взвешенную
+смесь действий kinetic-api, diary и visitor-analytics в N потоков и печатает
+пропускную способность и p50/p95/p99 по действиям. Результат пишется в JSON;
+с --baseline прогон сравнивается с прошлым, регрессии p95 дают код выхода 1.
+
+Только для одноразовой БД с применёнными миграциями:
+
+    DATABASE_URL=... python tools/loadtest.py --seed --characters 100000 --games 100
+    DATABASE_URL=... python tools/loadtest.py --concurrency 8 --duration 60 --out base.json
+    DATABASE_URL=... python tools/loadtest.py --concurrency 8 --duration 60 --baseline base.json
+
+Потоки делят один процесс и GIL: цифры показывают работу БД и обработчиков под
+конкуренцией, а не точную модель параллельных инстансов облачной функции.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+import datagen  # tools/datagen.py — единственный сидер
+from functions import load_function  # tools/functions.py
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(args):
+    """Наполняет БД генератором tools/datagen.py в масштабе флагов прогона."""
+    datagen.generate(datagen.options(
+        rng_seed=args.rng_seed, characters=args.characters, weeks=args.weeks, games=args.games,
+        visits=args.visits, notifications=args.notifications, students=args.students, visitors=args.visitors,
+    ))
+
+
+def load_context(conn, sample):
+    """Идентификаторы из БД, из которых собираются события."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT id, user_id FROM characters ORDER BY random() LIMIT %s", (sample,))
+        characters = cur.fetchall()
+        cur.execute(
+            "SELECT u.id, u.role, m.group_id FROM users u "
+            "LEFT JOIN student_group_members m ON m.student_id = u.id "
+            "WHERE u.role IN ('student', 'trainer') ORDER BY random() LIMIT %s",
+            (sample,)
+        )
+        users = cur.fetchall()
+        cur.execute("SELECT visitor_uuid FROM visitors ORDER BY random() LIMIT %s", (sample,))
+        visitors = [str(r['visitor_uuid']) for r in cur.fetchall()]
+        cur.execute("SELECT id, sport_type FROM tricks ORDER BY id")
+        tricks = cur.fetchall()
+    conn.rollback()
+    students = [u for u in users if u['role'] == 'student']
+    trainers = [u for u in users if u['role'] == 'trainer']
+    if not characters or not students or not trainers:
+        sys.exit('в БД нет данных: сначала запустите с --seed')
+    return {
+        'characters': characters, 'students': students, 'trainers': trainers,
+        'visitors': visitors, 'tricks': [t['id'] for t in tricks],
+    }
+
+
+def kinetic(method, action, params):
+    event = {'httpMethod': method, 'queryStringParameters': {'action': action}}
+    if method == 'GET':
+        event['queryStringParameters'].update({k: str(v) for k, v in params.items()})
+    else:
+        event['body'] = json.dumps(params)
+    return 'kinetic-api', event
+
+
+def diary(method, path, user, params=None, body=None):
+    event = {
+        'httpMethod': method, 'path': path, 'queryStringParameters': params or {},
+        'headers': {'X-User-Id': str(user['id']), 'X-Role': user['role']},
+    }
+    if body is not None:
+        event['body'] = json.dumps(body)
+    return 'diary', event
+
+
+def beacon(rng, ctx):
+    # Половина маяков — постоянные посетители из БД, половина — новые
+    if ctx['visitors'] and rng.random() < 0.5:
+        visitor = rng.choice(ctx['visitors'])
+    else:
+        visitor = str(uuid.uuid4())
+    body = {'visitorId': visitor, 'page': rng.choice(['/', '/shop', '/tricks', '/profile']), 'referrer': ''}
+    headers = {'User-Agent': 'Mozilla/5.0 Chrome/120', 'X-Forwarded-For': f'10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}'}
+    return 'visitor-analytics', {'httpMethod': 'POST', 'headers': headers, 'body': json.dumps(body)}
+
+
+# (вес, имя, сборщик события): примерная смесь тёплого дня
+def action_mix():
+    def char(rng, ctx):
+        return rng.choice(ctx['characters'])
+
+    return [
+        (10, 'my_character', lambda rng, ctx: kinetic('GET', 'my_character', {'user_id': char(rng, ctx)['user_id']})),
+        (6, 'tricks', lambda rng, ctx: kinetic('GET', 'tricks', {})),
+        (3, 'all_characters', lambda rng, ctx: kinetic('GET', 'all_characters', {})),
+        (4, 'directory', lambda rng, ctx: kinetic('GET', 'directory', {'sport_type': rng.choice(['skate', 'bmx', 'scooter'])})),
+        (4, 'mastered_tricks', lambda rng, ctx: kinetic('GET', 'mastered_tricks', {'character_id': char(rng, ctx)['id']})),
+        (6, 'notifications', lambda rng, ctx: kinetic('GET', 'notifications', {'character_id': char(rng, ctx)['id']})),
+        (8, 'unread_count', lambda rng, ctx: kinetic('GET', 'unread_count', {'character_id': char(rng, ctx)['id']})),
+        (3, 'achievements', lambda rng, ctx: kinetic('GET', 'achievements', {'character_id': char(rng, ctx)['id']})),
+        (3, 'transactions', lambda rng, ctx: kinetic('GET', 'transactions', {'character_id': char(rng, ctx)['id']})),
+        (4, 'public_profile', lambda rng, ctx: kinetic('GET', 'public_profile', {'character_id': char(rng, ctx)['id']})),
+        (5, 'leaderboard', lambda rng, ctx: kinetic('GET', 'leaderboard', {'period': 'weekly', 'character_id': char(rng, ctx)['id']})),
+        (8, 'game_complete', lambda rng, ctx: kinetic('POST', 'game_complete', {
+            'character_id': char(rng, ctx)['id'], 'earned_xp': 10, 'earned_kinetics': 5,
+            'won': rng.random() < 0.5, 'score': rng.randint(0, 1000)})),
+        (2, 'confirm_tricks', lambda rng, ctx: kinetic('POST', 'confirm_tricks', {
+            'character_id': char(rng, ctx)['id'], 'trick_ids': rng.sample(ctx['tricks'], 2)})),
+        (2, 'add_training_visit', lambda rng, ctx: kinetic('POST', 'add_training_visit', {'character_id': char(rng, ctx)['id']})),
+        (1, 'join_tournament', lambda rng, ctx: kinetic('POST', 'join_tournament', {'character_id': char(rng, ctx)['id']})),
+        (1, 'purchase_item', lambda rng, ctx: kinetic('POST', 'purchase_item', {
+            'character_id': char(rng, ctx)['id'], 'item_type': 'badge', 'item_value': f'load-{rng.getrandbits(32)}', 'cost': 1})),
+        (5, 'diary_entries', lambda rng, ctx: diary('GET', '/diary/entries', rng.choice(ctx['students']))),
+        (2, 'diary_entries_trainer', lambda rng, ctx: diary('GET', '/diary/entries', rng.choice(ctx['trainers']), {'limit': '50'})),
+        (1, 'diary_groups', lambda rng, ctx: diary('GET', '/diary/groups', rng.choice(ctx['trainers']))),
+        (1, 'diary_plans', lambda rng, ctx: diary('GET', '/diary/plans', rng.choice(ctx['trainers']))),
+        (1, 'diary_create_entry', lambda rng, ctx: diary('POST', '/diary/entries', rng.choice(ctx['trainers']), body={
+            'student_id': rng.choice(ctx['students'])['id'], 'comment': 'Нагрузочная запись', 'grade': '5'})),
+        (6, 'beacon', beacon),
+    ]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run_mix(modules, ctx, mix, concurrency, seconds, requests, seed_value):
+    """Крутит смесь в concurrency потоках; возвращает сэмплы (имя, мс, статус) и длительность."""
+    weights = [w for w, _, _ in mix]
+    samples = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + seconds if seconds else None
+    budget = [requests]
+
+    def take():
+        with lock:
+            if budget[0] is None:
+                return True
+            if budget[0] <= 0:
+                return False
+            budget[0] -= 1
+            return True
+
+    def worker(i):
+        rng = random.Random(seed_value * 1000 + i)
+        local = []
+        while (stop_at is None or time.monotonic() < stop_at) and take():
+            _, name, build = rng.choices(mix, weights)[0]
+            function, event = build(rng, ctx)
+            started = time.perf_counter()
+            try:
+                status = modules[function].handler(event, None)['statusCode']
+            except Exception as e:
+                print(f'{name}: {e!r}', file=sys.stderr)
+                status = 599
+            local.append((name, (time.perf_counter() - started) * 1000, status))
+        with lock:
+            samples.extend(local)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples, elapsed):
+    by_action = {}
+    for name, ms, status in samples:
+        by_action.setdefault(name, []).append((ms, status))
+    actions = {}
+    for name, rows in sorted(by_action.items()):
+        latencies = [ms for ms, _ in rows]
+        statuses = {}
+        for _, status in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        actions[name] = {
+            'count': len(rows),
+            'errors': sum(1 for _, status in rows if status >= 500),
+            'rps': round(len(rows) / elapsed, 2),
+            'p50_ms': round(statistics.median(latencies), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(max(latencies), 2),
+            'statuses': statuses,
+        }
+    latencies = [ms for _, ms, _ in samples]
+    total = {
+        'count': len(samples),
+        'errors': sum(1 for _, _, status in samples if status >= 500),
+        'rps': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(statistics.median(latencies), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+    }
+    return actions, total
+
+
+def compare(report, baseline, tolerance, floor_ms):
+    """Действия, у которых p95 вырос больше чем на tolerance (и больше floor_ms), или появились 5xx."""
+    regressions = []
+    for name, now in report['actions'].items():
+        before = baseline['actions'].get(name)
+        if before is None:
+            continue
+        if now['p95_ms'] > before['p95_ms'] * (1 + tolerance) and now['p95_ms'] - before['p95_ms'] > floor_ms:
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {now['p95_ms']} ms")
+        if now['errors'] and not before['errors']:
+            regressions.append(f"{name}: {now['errors']} ошибок 5xx")
+    before_rps, now_rps = baseline['total']['rps'], report['total']['rps']
+    if before_rps and now_rps < before_rps * (1 - tolerance):
+        regressions.append(f'throughput {before_rps} -> {now_rps} rps')
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def table_rows(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT relname, reltuples::bigint AS rows FROM pg_class "
+            "WHERE relname IN ('characters', 'game_results', 'kinetics_transactions', 'character_notifications', "
+            "'training_visits', 'diary_entries', 'visitors', 'visit_sessions')"
+        )
+        rows = {r['relname']: r['rows'] for r in cur.fetchall()}
+    conn.rollback()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seed', action='store_true', help='наполнить БД перед прогоном')
+    # масштаб сида передаётся в tools/datagen.py
+    parser.add_argument('--characters', type=int, default=20000)
+    parser.add_argument('--weeks', type=int, default=26, help='недель истории')
+    parser.add_argument('--games', type=float, default=40, help='игр на персонажа в среднем')
+    parser.add_argument('--visits', type=float, default=12, help='посещений тренировок в среднем')
+    parser.add_argument('--notifications', type=float, default=30, help='уведомлений в среднем')
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--visitors', type=int, default=50000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=30.0, help='секунд замера')
+    parser.add_argument('--requests', type=int, help='вместо --duration: ровно столько запросов')
+    parser.add_argument('--warmup', type=float, default=3.0, help='секунд прогрева, в отчёт не входят')
+    parser.add_argument('--rng-seed', type=int, default=1)
+    parser.add_argument('--out', help='записать отчёт JSON')
+    parser.add_argument('--baseline', help='отчёт прошлого прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимый рост p95 (доля)')
+    parser.add_argument('--floor-ms', type=float, default=2.0, help='меньшие приросты p95 считаются шумом')
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args)
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=RealDictCursor)
+    ctx = load_context(conn, 5000)
+    scale = table_rows(conn)
+    conn.close()
+
+    os.environ.setdefault('REQUEST_LOG', '0')
+    os.environ['DB_POOL_MAX_SIZE'] = str(args.concurrency)
+    modules = {
+        'kinetic-api': load_function('kinetic-api', 'loadtest_kinetic_api'),
+        'diary': load_function('diary', 'loadtest_diary'),
+        'visitor-analytics': load_function('visitor-analytics', 'loadtest_visitor_analytics'),
+    }
+    mix = action_mix()
+
+    if args.warmup:
+        run_mix(modules, ctx, mix, args.concurrency, args.warmup, None, args.rng_seed + 1)
+        modules['kinetic-api'].action_stats.reset()
+    seconds = None if args.requests else args.duration
+    samples, elapsed = run_mix(modules, ctx, mix, args.concurrency, seconds, args.requests, args.rng_seed)
+    actions, total = summarize(samples, elapsed)
+
+    report = {
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'concurrency': args.concurrency,
+        'elapsed_s': round(elapsed, 2),
+        'scale': scale,
+        'total': total,
+        'actions': actions,
+        # серверная сторона kinetic-api: время в БД и число запросов на действие
+        'server': {
+            name: {k: s[k] for k in ('db_avg_ms', 'statements_avg', 'statements_max', 'rows_avg', 'encode_avg_ms')}
+            for name, s in modules['kinetic-api'].action_stats.summary().items()
+        },
+    }
+
+    print(f"{'action':<24}{'count':>7}{'err':>5}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'db':>8}{'sql':>6}")
+    for name, a in actions.items():
+        server = report['server'].get(name, {})
+        db = f"{server['db_avg_ms']:.1f}" if server else '-'
+        sql = f"{server['statements_avg']:.1f}" if server else '-'
+        print(f"{name:<24}{a['count']:>7}{a['errors']:>5}{a['rps']:>9.1f}{a['p50_ms']:>9.2f}{a['p95_ms']:>9.2f}"
+              f"{a['p99_ms']:>9.2f}{db:>8}{sql:>6}")
+    print(f"{'total':<24}{total['count']:>7}{total['errors']:>5}{total['rps']:>9.1f}{total['p50_ms']:>9.2f}"
+          f"{total['p95_ms']:>9.2f}{total['p99_ms']:>9.2f}")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, args.floor_ms)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if not regressions:
+            print(f"no regressions against {args.baseline} ({baseline.get('revision')})")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Бенчмарк public_profile и achievements на медленном канале до БД.
+
+Поднимает локальный TCP-прокси с искусственной задержкой в каждую сторону и
+направляет через него пул kinetic-api. Каждое действие вызывается через handler
+дважды: прежней реализацией (последовательные запросы) и текущей (один
+составной запрос); ответы сверяются, печатаются p50/p95 и число запросов.
+
+Для одноразовой БД с данными (например, после tools/datagen.py):
+
+    DATABASE_URL=... python tools/profile_bench.py --latency-ms 5 --characters 200
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import socket
+import statistics
+import threading
+import time
+
+import psycopg2
+from psycopg2.extensions import make_dsn, parse_dsn
+from psycopg2.extras import RealDictCursor
+
+import functions  # tools/functions.py
+
+
+class LatencyProxy:
+    """TCP-прокси до PostgreSQL: каждый блок данных доставляется через delay секунд."""
+
+    def __init__(self, upstream, delay):
+        self.upstream = upstream
+        self.delay = delay
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _connect(self):
+        host, port = self.upstream
+        if host.startswith('/'):
+            sock = socket.socket(socket.AF_UNIX)
+            sock.connect(os.path.join(host, f'.s.PGSQL.{port}'))
+            return sock
+        return socket.create_connection((host, port))
+
+    def _accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            server = self._connect()
+            self._pipe(client, server)
+            self._pipe(server, client)
+
+    def _pipe(self, src, dst):
+        pending = queue.Queue()
+
+        def receive():
+            while True:
+                try:
+                    data = src.recv(65536)
+                except OSError:
+                    data = b''
+                pending.put((time.monotonic() + self.delay, data))
+                if not data:
+                    return
+
+        def deliver():
+            while True:
+                due, data = pending.get()
+                pause = due - time.monotonic()
+                if pause > 0:
+                    time.sleep(pause)
+                try:
+                    if not data:
+                        dst.shutdown(socket.SHUT_WR)
+                        return
+                    dst.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=receive, daemon=True).start()
+        threading.Thread(target=deliver, daemon=True).start()
+
+
+# Прежние реализации: независимые чтения идут друг за другом
+
+def sequential_public_profile(api):
+    def get_public_profile(req):
+        cur = req.cur
+        char_id = req.qs.get('character_id', '')
+        cur.execute(
+            "SELECT c.id, c.user_id, c.name, c.sport_type, c.sport_types, c.riding_style, c.level, c.experience, "
+            "c.balance, c.speed, c.courage, c.body_type, c.hairstyle, c.hair_color, c.avatar_url, c.kinetics, "
+            "c.games_won, c.games_played, c.age, c.trainer_name, c.created_at, "
+            "COALESCE(s.tricks_count, 0) AS tricks_count, COALESCE(s.trainings_count, 0) AS trainings_count, "
+            "COALESCE(s.achievements_count, 0) AS achievements_count "
+            "FROM characters c LEFT JOIN character_stats s ON s.character_id = c.id WHERE c.id = %s",
+            (char_id,)
+        )
+        char = cur.fetchone()
+        if not char:
+            return api.resp(404, {'error': 'not_found'})
+        stats = {
+            'tricks_learned': char.pop('tricks_count'),
+            'achievements_earned': char.pop('achievements_count'),
+            'training_visits': char.pop('trainings_count'),
+        }
+        cur.execute(
+            "SELECT te.score, te.rank, t.week_start, t.week_end "
+            "FROM tournament_entries te JOIN tournaments t ON te.tournament_id = t.id "
+            "WHERE te.character_id = %s ORDER BY t.week_start DESC LIMIT 10",
+            (char_id,)
+        )
+        stats['tournament_history'] = cur.fetchall()
+        return api.resp(200, {'character': char, 'stats': stats})
+    return get_public_profile
+
+
+def sequential_achievements(api):
+    def get_achievements(req):
+        cur = req.cur
+        char_id = req.qs.get('character_id', '')
+        all_ach = api.catalog_cache.get(cur, 'achievements', 'all', api.load_achievements)['rows']
+        cur.execute("SELECT achievement_id, earned_at FROM character_achievements WHERE character_id = %s", (char_id,))
+        earned = {r['achievement_id']: r['earned_at'] for r in cur.fetchall()}
+        cur.execute(
+            "SELECT c.level, c.games_won, COALESCE(s.tricks_count, 0) AS tricks_count "
+            "FROM characters c LEFT JOIN character_stats s ON s.character_id = c.id WHERE c.id = %s",
+            (char_id,)
+        )
+        char = cur.fetchone() or {'level': 0, 'games_won': 0, 'tricks_count': 0}
+        values = {'character_created': 1, 'tricks_count': char['tricks_count'], 'level': char['level'],
+                  'games_won': char['games_won']}
+        result = []
+        for ach in all_ach:
+            is_earned = ach['id'] in earned
+            progress = min(values.get(ach['requirement_type'], 0), ach['requirement_value'])
+            result.append({**ach, 'is_earned': is_earned, 'earned_at': str(earned[ach['id']]) if is_earned else None,
+                           'progress': progress})
+        return api.resp(200, {'achievements': result})
+    return get_achievements
+
+
+def load_api(dsn):
+    os.environ['DATABASE_URL'] = dsn
+    return functions.load_api()
+
+
+def sample_characters(dsn, count, seed):
+    """Половина — самые активные в турнирах, половина — случайные, плюс несуществующий id."""
+    conn = psycopg2.connect(dsn, cursor_factory=RealDictCursor)
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT character_id FROM tournament_entries GROUP BY character_id ORDER BY COUNT(*) DESC LIMIT %s",
+        (count // 2,)
+    )
+    ids = [r['character_id'] for r in cur.fetchall()]
+    cur.execute("SELECT id FROM characters")
+    rest = [r['id'] for r in cur.fetchall()]
+    conn.close()
+    ids += random.Random(seed).sample(rest, min(len(rest), count - len(ids)))
+    return ids + [max(rest, default=0) + 1]
+
+
+def run(api, action, ids, repeat):
+    samples, bodies = [], {}
+    api.action_stats.reset()
+    for _ in range(repeat):
+        for cid in ids:
+            event = {'httpMethod': 'GET', 'queryStringParameters': {'action': action, 'character_id': str(cid)}}
+            started = time.perf_counter()
+            result = api.handler(event, None)
+            samples.append((time.perf_counter() - started) * 1000)
+            bodies[cid] = json.loads(result['body'])
+    stats = api.action_stats.summary()[action]
+    samples.sort()
+    return {
+        'p50': statistics.median(samples),
+        'p95': samples[int(len(samples) * 0.95) - 1],
+        'statements': stats['statements_avg'],
+    }, bodies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк профиля и достижений на медленном канале.')
+    parser.add_argument('--latency-ms', type=float, default=5, help='задержка в одну сторону')
+    parser.add_argument('--characters', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    dsn = os.environ['DATABASE_URL']
+    params = parse_dsn(dsn)
+    upstream = (params.get('host', 'localhost'), int(params.get('port', 5432)))
+    proxy = LatencyProxy(upstream, args.latency_ms / 1000)
+    ids = sample_characters(dsn, args.characters, args.seed)
+    api = load_api(make_dsn(dsn, host='127.0.0.1', port=proxy.port))
+
+    print(f'RTT {2 * args.latency_ms:.1f} ms, {len(ids)} characters x {args.repeat}')
+    print(f"{'action':<16}{'path':<14}{'p50 ms':>9}{'p95 ms':>9}{'queries':>9}")
+    mismatches = 0
+    for action, legacy in (('public_profile', sequential_public_profile), ('achievements', sequential_achievements)):
+        route = api.ROUTES[('GET', action)]
+        current = route['fn']
+        results = {}
+        for path, fn in (('sequential', legacy(api)), ('single', current)):
+            route['fn'] = fn
+            results[path] = run(api, action, ids, args.repeat)
+            stats = results[path][0]
+            print(f"{action:<16}{path:<14}{stats['p50']:>9.1f}{stats['p95']:>9.1f}{stats['statements']:>9.2f}")
+        route['fn'] = current
+        differ = [cid for cid in ids if results['sequential'][1][cid] != results['single'][1][cid]]
+        mismatches += len(differ)
+        print(f"{action:<16}{'responses':<14}{'same' if not differ else f'{len(differ)} differ, e.g. {differ[0]}'}")
+    raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Разовый ремонт денормализованных счётчиков character_stats.
+
+Счётчики пересчитываются по исходным таблицам пачками по --batch персонажей
+в порядке id, каждая пачка — отдельная транзакция, поэтому блокировки
+короткие, а прерванный запуск продолжается с --after. Прогресс пишется в
+stdout строками JSON, итог — последней строкой.
+
+    DATABASE_URL=... python tools/repair_stats.py
+    DATABASE_URL=... python tools/repair_stats.py --batch 500 --after 120000
+    DATABASE_URL=... python tools/repair_stats.py --character 42
+
+Проверить без записи: action=stats_drift с X-Admin-Token.
+"""
+import argparse
+import json
+import time
+
+from functions import load_api  # tools/functions.py
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ремонт счётчиков character_stats.')
+    parser.add_argument('--character', type=int, help='починить только этого персонажа')
+    parser.add_argument('--batch', type=int, help='персонажей в одной транзакции')
+    parser.add_argument('--after', type=int, default=0, help='начать с персонажей с id больше этого')
+    args = parser.parse_args()
+
+    api = load_api()
+    batch = args.batch or api.STATS_REPAIR_BATCH
+    after, total, batches = args.after, 0, 0
+    started = time.monotonic()
+    conn = api.db_pool.acquire()
+    try:
+        cur = conn.cursor()
+        while True:
+            result = api.repair_character_stats(cur, args.character, after, batch)
+            conn.commit()
+            if result['last_id'] is None:
+                break
+            after = result['last_id']
+            total += result['repaired']
+            batches += 1
+            print(json.dumps({'event': 'batch', 'last_id': after, 'repaired': result['repaired']}), flush=True)
+    finally:
+        api.db_pool.release(conn)
+
+    print(json.dumps({
+        'event': 'done', 'repaired': total, 'batches': batches,
+        'seconds': round(time.monotonic() - started, 2),
+    }), flush=True)
+
+
+if __name__ == '__main__':
+    main()
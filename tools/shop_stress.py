@@ -0,0 +1,147 @@
+"""Нагрузочная проверка магазина kinetic-api: параллельные покупки одного персонажа.
+
+Все запросы бьют в одного персонажа одновременно: разные товары дороже
+остатка в сумме, повторы одного товара, аксессуара и вида спорта. После
+прогона проверяется, что остаток не ушёл в минус, ничего не списано дважды,
+каждый повтор куплен один раз, а журнал сходится с characters.kinetics.
+
+    DATABASE_URL=... python tools/shop_stress.py --workers 16 --requests 200
+"""
+import argparse
+import json
+import os
+import random
+import secrets
+import sys
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import functions  # tools/functions.py
+
+
+def load_api(pool_size):
+    os.environ['DB_POOL_MAX_SIZE'] = str(pool_size)
+    os.environ.setdefault('DB_POOL_TIMEOUT', '30')
+    # сверка журнала в конце прогона требует X-Admin-Token
+    os.environ.setdefault('ADMIN_TOKEN', secrets.token_hex(16))
+    return functions.load_api()
+
+
+def call(api, method, params):
+    event = {'httpMethod': method, 'queryStringParameters': {}, 'headers': {'X-Admin-Token': os.environ['ADMIN_TOKEN']}}
+    if method == 'GET':
+        event['queryStringParameters'] = {k: str(v) for k, v in params.items()}
+    else:
+        event['body'] = json.dumps(params)
+    result = api.handler(event, None)
+    return result['statusCode'], json.loads(result['body']) if result.get('body') else None
+
+
+def check(name, condition, detail=''):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}{': ' + str(detail) if detail else ''}")
+    return condition
+
+
+def build_requests(cid, total, rng):
+    """Смесь покупок: уникальные товары, повторы одного товара, аксессуар, вид спорта, кастомизация."""
+    requests = []
+    for i in range(total):
+        kind = rng.choice(['item', 'item', 'duplicate', 'accessory', 'sport', 'customization'])
+        if kind == 'item':
+            params = {'character_id': cid, 'item_type': 'badge', 'item_value': f'stress-{i}', 'cost': 50}
+            requests.append(('item', 'purchase_item', params))
+        elif kind == 'duplicate':
+            params = {'character_id': cid, 'item_type': 'badge', 'item_value': 'stress-duplicate', 'cost': 50}
+            requests.append(('duplicate', 'purchase_item', params))
+        elif kind == 'accessory':
+            requests.append(('accessory', 'buy_accessory', {'character_id': cid, 'accessory_id': 1}))
+        elif kind == 'sport':
+            requests.append(('sport', 'add_sport', {'character_id': cid, 'sport_type': 'bmx', 'cost': 100}))
+        else:
+            params = {'character_id': cid, 'item_type': 'hairstyle', 'item_value': 7, 'cost': 30}
+            requests.append(('customization', 'purchase_customization', params))
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Параллельные покупки одного персонажа.')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--balance', type=int, default=2000, help='остаток персонажа перед прогоном')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    api = load_api(args.workers)
+    status, body = call(api, 'POST', {
+        'action': 'create_character', 'user_id': f'stress-{uuid.uuid4()}', 'name': 'Stress', 'sport_type': 'skate',
+    })
+    cid = body['character']['id']
+    call(api, 'POST', {'action': 'add_kinetics', 'character_id': cid, 'amount': args.balance - body['character']['kinetics']})
+
+    requests = build_requests(cid, args.requests, random.Random(args.seed))
+
+    def run(request):
+        kind, action, params = request
+        started = time.perf_counter()
+        status, body = call(api, 'POST', {'action': action, **params})
+        return kind, status, body, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.workers) as pool:
+        outcomes = list(pool.map(run, requests))
+    elapsed = time.perf_counter() - started
+
+    statuses = Counter((kind, status, (body or {}).get('error')) for kind, status, body, _ in outcomes)
+    for (kind, status, error), count in sorted(statuses.items(), key=str):
+        print(f'     {kind:<14} {status} {error or "":<22} x{count}')
+    latencies = sorted(t for *_, t in outcomes)
+    print(f'     {len(outcomes)} requests in {elapsed:.2f}s, p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms')
+
+    results = [check('нет ошибок сервера', not any(s >= 500 for _, s, _, _ in outcomes))]
+    conn = api.db_pool.acquire()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT kinetics, sport_types, hairstyle FROM characters WHERE id = %s", (cid,))
+        char = cur.fetchone()
+        cur.execute(
+            "SELECT source, COUNT(*) AS cnt, SUM(amount) AS amount FROM kinetics_transactions "
+            "WHERE character_id = %s GROUP BY source",
+            (cid,)
+        )
+        ledger = {r['source']: r for r in cur.fetchall()}
+        cur.execute(
+            "SELECT item_type, item_value, COUNT(*) AS cnt FROM purchased_items WHERE character_id = %s "
+            "GROUP BY item_type, item_value",
+            (cid,)
+        )
+        items = {(r['item_type'], r['item_value']): r['cnt'] for r in cur.fetchall()}
+        cur.execute("SELECT COUNT(*) AS cnt FROM character_accessories WHERE character_id = %s", (cid,))
+        accessories = cur.fetchone()['cnt']
+        conn.rollback()
+    finally:
+        api.db_pool.release(conn)
+
+    succeeded = Counter(kind for kind, status, _, _ in outcomes if status == 200)
+    results.append(check('остаток не отрицательный', char['kinetics'] >= 0, char['kinetics']))
+    results.append(check('журнал сходится с остатком', sum(r['amount'] for r in ledger.values()) == char['kinetics']))
+    results.append(check(
+        'одно списание на успешную покупку',
+        ledger.get('shop', {}).get('cnt', 0) == sum(succeeded[k] for k in ('item', 'duplicate', 'accessory', 'sport', 'customization'))
+        - max(succeeded['customization'] - 1, 0),
+        f"shop={ledger.get('shop', {}).get('cnt', 0)} ok={dict(succeeded)}",
+    ))
+    results.append(check('повтор товара куплен один раз', items.get(('badge', 'stress-duplicate'), 0) <= 1 and succeeded['duplicate'] <= 1))
+    results.append(check('аксессуар куплен один раз', accessories <= 1 and succeeded['accessory'] <= 1))
+    results.append(check('вид спорта добавлен один раз', char['sport_types'].count('bmx') <= 1 and succeeded['sport'] <= 1))
+    results.append(check('все товары в одном экземпляре', all(cnt == 1 for cnt in items.values())))
+
+    status, body = call(api, 'GET', {'action': 'reconcile_ledger', 'character_id': cid})
+    results.append(check('сверка журнала', status == 200 and body['consistent'], body and body['drift']))
+
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
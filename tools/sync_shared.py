@@ -0,0 +1,56 @@
+"""Копии общего кода функций: backend/shared/*.py → backend/<функция>/.
+
+Каждая функция деплоится только из своего каталога, поэтому общий модуль
+(пул соединений, метрики, кодирование ответов) лежит рядом с её index.py
+копией. Правится только backend/shared/, затем копии обновляются:
+
+    python tools/sync_shared.py
+
+Перед сборкой и в CI копии сверяются с исходником; код выхода 1, если
+какая-то копия отличается или отсутствует:
+
+    python tools/sync_shared.py --check
+"""
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHARED = os.path.join(ROOT, 'backend', 'shared')
+
+# Функции, которые импортируют общий код
+FUNCTIONS = ('kinetic-api', 'diary', 'visitor-analytics')
+
+
+def pairs():
+    for name in sorted(os.listdir(SHARED)):
+        if not name.endswith('.py'):
+            continue
+        for fn in FUNCTIONS:
+            yield os.path.join(SHARED, name), os.path.join(ROOT, 'backend', fn, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Копии общего кода функций.')
+    parser.add_argument('--check', action='store_true', help='только сверить копии, ничего не менять')
+    args = parser.parse_args()
+
+    stale = []
+    for source, copy in pairs():
+        if os.path.exists(copy) and filecmp.cmp(source, copy, shallow=False):
+            continue
+        stale.append(os.path.relpath(copy, ROOT))
+        if not args.check:
+            shutil.copyfile(source, copy)
+
+    for path in stale:
+        print(f"{'out of sync' if args.check else 'updated'}: {path}")
+    if args.check and stale:
+        print('run: python tools/sync_shared.py', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
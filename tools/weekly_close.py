@@ -0,0 +1,50 @@
+"""Закрытие прошедших турнирных недель: заморозка итогов и рассылка пачками.
+
+Повторный запуск безопасен: рассылка продолжается с сохранённого чекпоинта.
+Прогресс пишется в stdout строками JSON, итог — последней строкой.
+
+    DATABASE_URL=... python tools/weekly_close.py
+    DATABASE_URL=... python tools/weekly_close.py --tournament 12 --chunk 500 --max-seconds 60
+
+Пример cron (понедельник, 00:10):
+
+    10 0 * * 1  cd /srv/kinetic && DATABASE_URL=... python tools/weekly_close.py >> /var/log/weekly_close.log
+"""
+import argparse
+import json
+import sys
+import time
+
+from functions import load_api  # tools/functions.py
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Закрытие турнирных недель.')
+    parser.add_argument('--tournament', type=int, help='закрыть только этот турнир')
+    parser.add_argument('--chunk', type=int, help='уведомлений в одной транзакции')
+    parser.add_argument('--max-seconds', type=float, help='остановиться после N секунд, остаток — следующим запуском')
+    args = parser.parse_args()
+
+    api = load_api()
+    chunk = args.chunk or api.WEEKLY_RESULTS_CHUNK
+    deadline = time.monotonic() + args.max_seconds if args.max_seconds else None
+
+    def progress(metrics):
+        print(json.dumps({'event': 'chunk', **metrics}), flush=True)
+
+    conn = api.db_pool.acquire()
+    try:
+        if args.tournament:
+            results = [api.close_weekly_tournament(conn, args.tournament, chunk, deadline, progress)]
+        else:
+            results = api.close_weekly_tournaments(conn, chunk, deadline, progress)
+    finally:
+        api.db_pool.release(conn)
+
+    done = all(r['status'] == 'closed' for r in results)
+    print(json.dumps({'event': 'done', 'complete': done, 'tournaments': results}), flush=True)
+    sys.exit(0 if done else 2)
+
+
+if __name__ == '__main__':
+    main()